@@ -1,14 +1,73 @@
-from maslite import Agent, Scheduler, AgentMessage
+"""
+MASlite benchmark suite.
+
+    python benchmark.py                                 # runs all benchmarks.
+    python benchmark.py ping_pong broadcast             # runs some of them.
+    python benchmark.py --quick                         # runs smaller workloads.
+    python benchmark.py --output results.json           # writes the results as json.
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.25
+
+With --baseline the results are compared with the stored baseline and the script
+exits with status 1 if any metric is worse than the baseline by more than the
+threshold (default 25%). Baselines are machine specific, so save one on the
+machine that runs the comparison.
+"""
+import sys
+import json
+import time
+import asyncio
+import threading
+import random
+import logging
+import argparse
+from collections import deque
+import tempfile
+import platform
+import tracemalloc
+from pathlib import Path
+
+from maslite import Agent, Scheduler, AgentMessage, FrozenMessage, RingBufferSink, handles, OffloadResult
+from maslite.asynchronous import AsyncScheduler
+from maslite.checkpoint import save, restore
+from maslite.maillog import MailLog
+from maslite.tracing import Tracer
+from demos.auction_model import Seller, Buyer
+from demos.scheduling import Machine, Order, StockAgent
+
+BENCHMARKS = {}  # name: function(quick) -> {metric: {"value": float, "unit": str, "better": "higher" or "lower"}}
+
+
+def benchmark(function):
+    """ registers a benchmark. """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def metric(value, unit, better="higher"):
+    assert better in {"higher", "lower"}
+    return {"value": value, "unit": unit, "better": better}
+
 
 class Msg(AgentMessage):
     def __init__(self, sender, receiver=None, topic=None):
         super().__init__(sender, receiver, topic)
         self.value = 0
 
+    def copy(self):
+        msg = Msg(self.sender, self.receiver, self.topic)
+        msg.value = self.value
+        return msg
+
+
+class FrozenMsg(FrozenMessage):
+    pass
+
+
 class A(Agent):
     def __init__(self, uuid=None):
         super().__init__(uuid)
-        
+
     def update(self):
         if self.messages:
             m = self.receive()
@@ -18,20 +77,969 @@ class A(Agent):
             self.send(m)
 
 
-if __name__ == "__main__":
-    s = Scheduler()
-    a = A()
-    b = A()
+class Listener(Agent):
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.count = 0
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.count += 1
+
+
+class SlottedListener(Agent):
+    __slots__ = ('count',)
+
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.count = 0
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.count += 1
+
+
+class SlottedMsg(AgentMessage):
+    __slots__ = ('value',)
+
+    def __init__(self, sender, receiver=None, topic=None):
+        super().__init__(sender, receiver, topic)
+        self.value = 0
+
+
+class Arrival(Agent):
+    """ an agent that wakes up after exponentially distributed delays. """
+    def __init__(self, events, seed):
+        super().__init__()
+        self.events = events
+        self.random = random.Random(seed)
+
+    def setup(self):
+        self.set_alarm(self.random.expovariate(0.1), Msg(self, self), ignore_alarm_if_idle=False)
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.events -= 1
+            if self.events > 0:
+                self.set_alarm(self.random.expovariate(0.1), Msg(self, self), ignore_alarm_if_idle=False)
+
+
+class Sleeper(Agent):
+    """ an agent that sets an alarm for itself every time it wakes up. """
+    def __init__(self, wakeups):
+        super().__init__()
+        self.wakeups = wakeups
+
+    def setup(self):
+        self.set_alarm(1 + self.uuid % 7, Msg(self, self), ignore_alarm_if_idle=False)
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.wakeups -= 1
+            if self.wakeups > 0:
+                self.set_alarm(1 + (self.uuid + self.wakeups) % 7, Msg(self, self), ignore_alarm_if_idle=False)
+
+
+class Punctual(Agent):
+    """ an agent that sets real-time alarms for itself and records how late they arrive. """
+    def __init__(self, wakeups, delay):
+        super().__init__()
+        self.wakeups = wakeups
+        self.delay = delay
+        self.due = None
+        self.lateness = []
+
+    def setup(self):
+        self.due = self.time + self.delay
+        self.set_alarm(self.delay, Msg(self, self), ignore_alarm_if_idle=False)
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.lateness.append(time.time() - self.due)
+            self.wakeups -= 1
+            if self.wakeups > 0:
+                self.setup()
+
+
+class Caller(Agent):
+    """ an agent that waits for a service (a sleep) before it replies to each message. """
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.calls = 0
+
+    def update(self):
+        while self.messages:
+            msg = self.receive()
+            time.sleep(self.delay)
+            self.reply(msg)
+
+    def reply(self, msg):
+        self.calls += 1
+        msg.receiver, msg.sender = msg.sender, self.uuid
+        self.send(msg)
+
+
+class ThreadedCaller(Caller):
+    io_bound = True
+
+
+class AsyncCaller(Caller):
+    async def update(self):
+        while self.messages:
+            msg = self.receive()
+            await asyncio.sleep(self.delay)
+            self.reply(msg)
+
+
+class Stamped(AgentMessage):
+    __slots__ = ('posted',)
+
+    def __init__(self, sender, receiver=None, topic=None):
+        super().__init__(sender, receiver, topic)
+        self.posted = time.perf_counter()
+
+
+class Inlet(Agent):
+    """ an agent that receives the messages posted from another thread. """
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self.latency = []
+
+    def update(self):
+        for msg in self.drain():
+            self.latency.append(time.perf_counter() - msg.posted)
+        if len(self.latency) >= self.expected:
+            self.pause()
+
+
+def quiet_logger():
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    return logger
+
+
+@benchmark
+def ping_pong(quick=False):
+    """ one message bouncing between two agents, with and without the scheduler's runtime checks,
+    and with a tracer. """
+    seconds = 0.5 if quick else 5
+    results = {}
+    for name, checked, tracer in [("messages/second", True, None), ("unchecked messages/second", False, None),
+                                  ("traced messages/second", True, Tracer())]:
+        s = Scheduler(logger=quiet_logger(), checked=checked, tracer=tracer)
+        a = A()
+        b = A()
+        s.add(a)
+        s.add(b)
+        m = Msg(a,b)
+        a.send(m)
+        s.run(seconds=seconds)
+        results[name] = metric(m.value / seconds, "msg/s")
+    return results
+
+
+@benchmark
+def broadcast(quick=False):
+    """ broadcasts to 10,000 subscribers, with messages that are copied and with frozen messages. """
+    subscribers, broadcasts = (1_000, 20) if quick else (10_000, 100)
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    sender = A()
+    s.add(sender)
+    listeners = [Listener() for _ in range(subscribers)]
+    for agent in listeners:
+        s.add(agent)
+        agent.subscribe(topic="news")
+
+    results = {}
+    for name, cls in [("deliveries/second", Msg), ("frozen deliveries/second", FrozenMsg)]:
+        start = time.perf_counter()
+        for _ in range(broadcasts):
+            sender.send(cls(sender, topic="news"))
+            s.run()
+        end = time.perf_counter()
+        results[name] = metric(subscribers * broadcasts / (end - start), "msg/s")
+    assert sum(agent.count for agent in listeners) == 2 * subscribers * broadcasts
+    return results
+
+
+@benchmark
+def batching(quick=False):
+    """ sends and receives messages one at a time and in batches. """
+    n = 100_000 if quick else 1_000_000
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    a, b = A(), A()
     s.add(a)
     s.add(b)
-    m = Msg(a,b)
-    a.send(m)
-    s.run(seconds=10)
-    print(f"{m.value/10:,} messages/second")
+    messages = [Msg(a, b) for _ in range(n)]
+
+    start = time.perf_counter()
+    for msg in messages:
+        a.send(msg)
+    end = time.perf_counter()
+    send_rate = n / (end - start)
+    s.mail_queue.clear()
+
+    start = time.perf_counter()
+    a.send_many(messages)
+    end = time.perf_counter()
+    send_many_rate = n / (end - start)
+    s.mail_queue.clear()
+
+    b.inbox.extend(messages)
+    start = time.perf_counter()
+    while b.messages:
+        b.receive()
+    end = time.perf_counter()
+    receive_rate = n / (end - start)
+
+    b.inbox.extend(messages)
+    start = time.perf_counter()
+    b.receive_all()
+    end = time.perf_counter()
+    receive_all_rate = n / (end - start)
+
+    b.inbox.extend(messages)
+    start = time.perf_counter()
+    for _ in b.drain():
+        pass
+    end = time.perf_counter()
+    drain_rate = n / (end - start)
+    return {"send/second": metric(send_rate, "msg/s"),
+            "send_many/second": metric(send_many_rate, "msg/s"),
+            "receive/second": metric(receive_rate, "msg/s"),
+            "receive_all/second": metric(receive_all_rate, "msg/s"),
+            "drain/second": metric(drain_rate, "msg/s")}
+
+
+@benchmark
+def alarms(quick=False):
+    """ sets 1M pending alarms on a simulation clock, cancels the alarms of 10% of
+    the agents and releases the rest, one wakeup time at a time. """
+    n, agents = (20_000, 1000) if quick else (1_000_000, 1000)
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    clock = s.clock
+    population = [A() for _ in range(agents)]
+    for agent in population:
+        s.add(agent)
+
+    start = time.process_time()
+    for i in range(n):
+        receiver = population[i % agents]
+        clock.set_alarm(delay=i, alarm_message=Msg(receiver, receiver), ignore_alarm_if_idle=True)
+    end = time.process_time()
+    set_rate = n / (end - start)
+
+    start = time.process_time()
+    for agent in population[::10]:
+        clock.clear_alarms(receiver=agent.uuid)
+    end = time.process_time()
+    cancelled = n - sum(len(registry.alarms) for registry in clock.registry.values())
+    clear_rate = cancelled / (end - start)
+
+    released = 0
+    start = time.process_time()
+    while clock.alarms:
+        clock._time = clock.alarms.next_timestamp()
+        clock.release_alarm_messages()
+        released += len(s.mail_queue)
+        s.mail_queue.clear()
+    end = time.process_time()
+    release_rate = released / (end - start)
+
+    # The list based alarm engine of version 2023.1.1 only managed 5,655 set_alarm/second
+    # with 20,000 alarms pending (and 23,125 releases/second).
+    return {"set_alarm/second": metric(set_rate, "alarms/s"),
+            "clear_alarms/second": metric(clear_rate, "alarms/s"),
+            "release/second": metric(release_rate, "alarms/s")}
+
+
+@benchmark
+def alarm_sim(quick=False):
+    """ agents on a simulation clock that only wake up by alarms. """
+    agents, wakeups = (100, 20) if quick else (1000, 100)
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    for _ in range(agents):
+        s.add(Sleeper(wakeups))
+    start = time.perf_counter()
+    s.run()
+    end = time.perf_counter()
+    assert all(agent.wakeups == 0 for agent in s.agents.values())
+    return {"wakeups/second": metric(agents * wakeups / (end - start), "alarms/s")}
+
+
+@benchmark
+def discrete_events(quick=False):
+    """ a sparse simulation over a long horizon: agents that wake up at random times, mostly alone,
+    on the SimulationClock and on the DiscreteEventClock. """
+    agents, events = (100, 100) if quick else (100, 2000)
+    results = {}
+    for name, discrete in [("SimulationClock", False), ("DiscreteEventClock", True)]:
+        s = Scheduler(logger=quiet_logger(), real_time=False, discrete_events=discrete)
+        for seed in range(agents):
+            s.add(Arrival(events, seed))
+        start = time.perf_counter()
+        s.run()
+        end = time.perf_counter()
+        assert all(agent.events == 0 for agent in s.agents.values())
+        results[f"events/second ({name})"] = metric(agents * events / (end - start), "alarms/s")
+    return results
+
+
+@benchmark
+def alarm_real_time(quick=False):
+    """ an agent on the real-time clock that sleeps 10 ms between alarms: how late the
+    alarms arrive and how much CPU the scheduler uses while it waits. """
+    wakeups = 20 if quick else 200
+    s = Scheduler(logger=quiet_logger(), stats=True)
+    agent = Punctual(wakeups, delay=0.01)
+    s.add(agent)
+    cpu_start, start = time.process_time(), time.perf_counter()
+    s.run(pause_if_idle=True)
+    cpu_end, end = time.process_time(), time.perf_counter()
+    assert agent.wakeups == 0
+    lateness = sorted(agent.lateness)
+    return {"median lateness": metric(1000 * lateness[len(lateness) // 2], "ms", better="lower"),
+            "mean lateness": metric(1000 * sum(lateness) / wakeups, "ms", better="lower"),
+            "iterations/alarm": metric(s.stats()["iterations"] / wakeups, "", better="lower"),
+            "cpu/wall time": metric((cpu_end - cpu_start) / (end - start), "", better="lower")}
+
+
+@benchmark
+def async_io(quick=False):
+    """ agents that wait 10 ms for a service in every update, with blocking calls
+    in the Scheduler, in the Scheduler's thread pool and with awaited calls in the AsyncScheduler. """
+    agents, seconds = (20, 0.5) if quick else (100, 2)
+    results = {}
+    for name, scheduler_class, cls, threads in [("updates/second", Scheduler, Caller, 0),
+                                                ("threaded updates/second", Scheduler, ThreadedCaller, 32),
+                                                ("async updates/second", AsyncScheduler, AsyncCaller, 0)]:
+        options = {"io_threads": threads} if threads else {}
+        s = scheduler_class(logger=quiet_logger(), **options)
+        callers = [cls(delay=0.01) for _ in range(agents)]
+        for agent in callers:
+            s.add(agent)
+            agent.send(Msg(agent, agent))
+        start = time.perf_counter()
+        if scheduler_class is AsyncScheduler:
+            asyncio.run(s.run(seconds=seconds))
+        else:
+            s.run(seconds=seconds)
+        end = time.perf_counter()
+        results[name] = metric(sum(agent.calls for agent in callers) / (end - start), "updates/s")
+    return results
+
+
+@benchmark
+def ingress(quick=False):
+    """ messages posted from another thread while the scheduler runs: the throughput
+    of a thread that posts as fast as it can, and the latency of messages posted every
+    5 ms to an idle scheduler. """
+    n, spaced = (20_000, 20) if quick else (200_000, 200)
+    results = {}
+    for name, count, pause in [("posts/second", n, 0), ("latency", spaced, 0.005)]:
+        s = Scheduler(logger=quiet_logger())
+        agent = Inlet(expected=count)
+        s.add(agent)
+
+        def feed():
+            for _ in range(count):
+                s.post(Stamped("thread", agent.uuid))
+                if pause:
+                    time.sleep(pause)
+
+        thread = threading.Thread(target=feed)
+        start = time.perf_counter()
+        thread.start()
+        s.run(pause_if_idle=False)
+        end = time.perf_counter()
+        thread.join()
+        if pause:
+            results["mean latency"] = metric(1000 * sum(agent.latency) / count, "ms", better="lower")
+        else:
+            results[name] = metric(count / (end - start), "msg/s")
+    return results
+
+
+class UrgentMsg(Msg):
+    priority = -1
 
-    # :~$ python3.9 benchmarks.py
-    # 480,440.9 messages/second
+    def copy(self):
+        return UrgentMsg(self.sender, self.receiver, self.topic)
 
-    # :-$ pypy3 benchmarks.py
-    # 6,441,251.9 messages/second
-    
+
+class Sorting(Agent):
+    """ sorts its inbox, as the readme used to recommend. """
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.order = []
+
+    def update(self):
+        urgent, normal = deque(), deque()
+        while self.messages:
+            msg = self.receive()
+            if msg.priority < 0:
+                urgent.append(msg)
+            else:
+                normal.append(msg)
+        urgent.extend(normal)
+        while urgent:
+            self.order.append(urgent.popleft().priority)
+
+
+class Prioritising(Agent):
+    priority_inbox = True
+
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.order = []
+
+    def update(self):
+        while self.messages:
+            self.order.append(self.receive().priority)
+
+
+@benchmark
+def priority(quick=False):
+    """ 1,000 agents that each get 10 messages per iteration, 1 of them urgent:
+    sorted in update and with a priority inbox. """
+    agents, iterations = (100, 20) if quick else (1_000, 100)
+    results = {}
+    for name, cls in [("sorted in update", Sorting), ("priority inbox", Prioritising)]:
+        s = Scheduler(logger=quiet_logger(), real_time=False)
+        receivers = [cls() for _ in range(agents)]
+        for agent in receivers:
+            s.add(agent)
+        s.run()
+        elapsed = 0.0
+        for _ in range(iterations):
+            for agent in receivers:
+                s.mail_queue.extend([Msg(0, agent) for _ in range(9)] + [UrgentMsg(0, agent)])
+            start = time.perf_counter()  # the messages are delivered and received.
+            s.run(iterations=1)
+            elapsed += time.perf_counter() - start
+        assert all(agent.order[0] == -1 for agent in receivers)
+        results[f"messages/second ({name})"] = metric(agents * iterations * 10 / elapsed, "msg/s")
+    return results
+
+class Looking(Agent):
+    """ looks up the operation of every message, as the demos used to. """
+    class_operations = {"Msg": "on_msg", "UrgentMsg": "on_urgent", "stop": "on_stop"}
+
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.handled = 0
+
+    def update(self):
+        while self.messages:
+            msg = self.receive()
+            operation = self.get_operation(msg.topic)
+            if operation is not None:
+                operation(msg)
+
+    def on_msg(self, msg):
+        self.handled += 1
+
+    def on_urgent(self, msg):
+        self.handled += 1
+
+    def on_stop(self, msg):
+        self.handled += 1
+
+
+class Dispatching(Agent):
+    """ the same operations, with handles and dispatch_inbox. """
+    def __init__(self, uuid=None):
+        super().__init__(uuid)
+        self.handled = 0
+
+    def update(self):
+        self.dispatch_inbox()
+
+    @handles(Msg)
+    def on_msg(self, msg):
+        self.handled += 1
+
+    @handles(UrgentMsg)
+    def on_urgent(self, msg):
+        self.handled += 1
+
+    @handles("stop")
+    def on_stop(self, msg):
+        self.handled += 1
+
+
+@benchmark
+def dispatch(quick=False):
+    """ an agent that receives 1M messages of 3 topics in batches of 100 and calls their
+    operations: looked up with get_operation and with dispatch_inbox. """
+    n = 100_000 if quick else 1_000_000
+    batch = [Msg(0, 1) for _ in range(50)] + [UrgentMsg(0, 1) for _ in range(25)] + \
+            [Msg(0, 1, topic="stop") for _ in range(25)]
+    results = {}
+    for name, cls in [("get_operation", Looking), ("dispatch_inbox", Dispatching)]:
+        agent = cls(1)
+        inbox = agent.inbox
+        start = time.perf_counter()
+        for _ in range(n // len(batch)):
+            inbox.extend(batch)
+            agent.update()
+        elapsed = time.perf_counter() - start
+        assert agent.handled == n // len(batch) * len(batch)
+        results[f"messages/second ({name})"] = metric(agent.handled / elapsed, "msg/s")
+    return results
+
+
+class Trader(Agent):
+    """ a trader that adjusts its price in every iteration and sells to the orders it receives. """
+    def __init__(self):
+        super().__init__()
+        self.keep_awake = True
+        self.price = 100.0
+        self.sold = 0
+
+    def update(self):
+        self.price *= 1.001
+        while self.messages:
+            self.sold += self.receive().value
+
+
+def _traders():
+    """ returns the AgentArray version of Trader. Needs numpy. """
+    import numpy as np
+    from maslite.arrays import AgentArray
+
+    class Traders(AgentArray):
+        columns = {"price": "f8", "sold": "i8"}
+
+        def __init__(self, size):
+            super().__init__(size, price=100.0)
+            self.keep_awake = True
+
+        def update(self):
+            self.price *= 1.001
+            messages = self.receive_all()
+            if messages:
+                np.add.at(self.sold, self.rows_of(messages), [msg.value for msg in messages])
+
+    return Traders
+
+
+@benchmark
+def agent_array(quick=False):
+    """ 100,000 traders that update their price in every iteration, 1% of them get an order:
+    as agents and as an AgentArray (skipped without numpy). """
+    try:
+        Traders = _traders()
+    except ImportError:
+        return {}
+    size, iterations = (10_000, 10) if quick else (100_000, 20)
+    results = {}
+    for name in ("agents", "AgentArray"):
+        s = Scheduler(logger=quiet_logger(), real_time=False)
+        if name == "agents":
+            traders = [Trader() for _ in range(size)]
+            for agent in traders:
+                s.add(agent)
+            uuids = [agent.uuid for agent in traders]
+        else:
+            traders = Traders(size)
+            s.add(traders)
+            uuids = traders.uuids.tolist()
+        start = time.perf_counter()
+        for i in range(iterations):
+            for uuid in uuids[i % 100::100]:
+                msg = Msg(0, uuid)
+                msg.value = 1
+                s.mail_queue.append(msg)
+            s.run(iterations=1)
+        elapsed = time.perf_counter() - start
+        sold = sum(agent.sold for agent in traders) if name == "agents" else int(traders.sold.sum())
+        assert sold == size // 100 * iterations
+        results[f"member updates/second ({name})"] = metric(size * iterations / elapsed, "updates/s")
+    return results
+
+
+def busy(n):
+    """ a CPU-heavy computation. """
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return total
+
+
+class Optimiser(Agent):
+    """ computes a plan when asked, inline or in the process pool. """
+    def __init__(self, work, offloaded):
+        super().__init__()
+        self.work = work
+        self.offloaded = offloaded
+        self.plans = 0
+
+    def update(self):
+        for msg in self.receive_all():
+            if isinstance(msg, OffloadResult):
+                self.plans += 1
+            elif self.offloaded:
+                self.offload(busy, self.work)
+            else:
+                busy(self.work)
+                self.plans += 1
+
+
+class Responsive(Agent):
+    """ bounces a message and records the longest time between two of its updates. """
+    def __init__(self):
+        super().__init__()
+        self.last = None
+        self.longest = 0.0
+
+    def update(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.longest = max(self.longest, now - self.last)
+        self.last = now
+        for msg in self.receive_all():
+            msg.sender, msg.receiver = msg.receiver, msg.sender
+            self.send(msg)
+
+
+@benchmark
+def offload(quick=False):
+    """ 4 agents that each compute a plan (about 70 ms), whilst two agents play ping pong:
+    the longest the ping pong stalls with the plans computed inline and offloaded to processes. """
+    work, seconds = (300_000, 0.5) if quick else (1_000_000, 2)
+    results = {}
+    for name, offloaded in [("inline", False), ("offloaded", True)]:
+        s = Scheduler(logger=quiet_logger(), processes=2)
+        optimisers = [Optimiser(work, offloaded) for _ in range(4)]
+        a, b = Responsive(), Responsive()
+        for agent in optimisers + [a, b]:
+            s.add(agent)
+        a.send(Msg(a, b))
+        s.run(iterations=10)
+        for agent in optimisers:
+            agent.send(Msg(agent, agent))
+        s.run(seconds=seconds)
+        s.close()
+        assert all(agent.plans == 1 for agent in optimisers), "the plans weren't ready in time."
+        results[f"longest stall ({name})"] = metric(max(a.longest, b.longest) * 1000, "ms", better="lower")
+    return results
+
+
+class Monitor(Agent):
+    """ looks around when it's woken up. """
+    def __init__(self):
+        super().__init__()
+        self.looks = 0
+
+    def update(self):
+        self.looks += 1
+
+
+@benchmark
+def polling(quick=False):
+    """ ping pong next to 100 monitors that are kept awake, and that wake up every 10 ms. """
+    seconds = 0.5 if quick else 3
+    results = {}
+    for name in ("keep_awake", "wake_every"):
+        s = Scheduler(logger=quiet_logger())
+        monitors = [Monitor() for _ in range(100)]
+        for agent in monitors:
+            s.add(agent)
+            if name == "keep_awake":
+                agent.keep_awake = True
+            else:
+                agent.wake_every(seconds=0.01)
+        a, b = A(), A()
+        s.add(a)
+        s.add(b)
+        m = Msg(a, b)
+        a.send(m)
+        s.run(seconds=seconds)
+        results[f"messages/second ({name})"] = metric(m.value / seconds, "msg/s")
+    return results
+
+
+@benchmark
+def routing(quick=False):
+    """ routes auction style messages: broadcast RFQs from buyers that sellers
+    subscribe to, and Adverts addressed to buyers who also subscribe to all Adverts. """
+    n, traders = (50_000, 100) if quick else (1_000_000, 100)
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    buyers = [A() for _ in range(traders)]
+    sellers = [A() for _ in range(traders)]
+    for agent in buyers + sellers:
+        s.add(agent)
+    for agent in sellers:
+        agent.subscribe(topic="RFQ")
+    for agent in buyers:
+        agent.subscribe(topic="Advert")
+
+    messages = []
+    for i in range(traders):
+        messages.append(Msg(buyers[i], topic="RFQ"))
+        messages.append(Msg(sellers[i], buyers[(i * 7) % traders], topic="Advert"))
+
+    get_mail_recipients = s.mailing_lists.get_mail_recipients
+    start = time.process_time()
+    for i in range(n):
+        get_mail_recipients(messages[i % len(messages)])
+    end = time.process_time()
+    # version 2023.1.1 without the routing cache: 63,341 routes/second
+    return {"routes/second": metric(n / (end - start), "routes/s")}
+
+
+@benchmark
+def churn(quick=False):
+    """ adds and removes agents with subscriptions, without events and with the events in a ring buffer,
+    loads agents in bulk and removes agents that subscribe to each other. """
+    n = 5_000 if quick else 100_000
+    results = {}
+    for name, sink in [("", None), (" (ring buffer sink)", RingBufferSink())]:
+        s = Scheduler(logger=quiet_logger(), real_time=False, event_sink=sink)
+        agents = [Listener() for _ in range(n)]
+        start = time.perf_counter()
+        for agent in agents:
+            s.add(agent)
+            agent.subscribe(topic="news")
+        added = time.perf_counter()
+        for agent in agents:
+            s.remove(agent)
+        removed = time.perf_counter()
+        results[f"add/second{name}"] = metric(n / (added - start), "agents/s")
+        results[f"remove/second{name}"] = metric(n / (removed - added), "agents/s")
+
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    agents = [Listener() for _ in range(n)]
+    start = time.perf_counter()
+    s.add_many(agents, setup=False)
+    s.subscribe_many([(agent.uuid, None, None, "news") for agent in agents])
+    end = time.perf_counter()
+    results["add_many/second (subscribe_many)"] = metric(n / (end - start), "agents/s")
+
+    # every agent listens to the mail of its neighbour, so removing it also cleans up other subscriptions.
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    agents = [Listener() for _ in range(n)]
+    for agent in agents:
+        s.add(agent)
+    for a, b in zip(agents, agents[1:] + agents[:1]):
+        a.subscribe(sender=b.uuid)
+    start = time.perf_counter()
+    s.remove_many(agents)
+    end = time.perf_counter()
+    assert not s.mailing_lists.directory, "subscriptions were left behind."
+    results["remove_many/second (neighbour subscriptions)"] = metric(n / (end - start), "agents/s")
+    return results
+
+
+@benchmark
+def auction(quick=False):
+    """ the auction demo with randomly priced sellers and buyers. """
+    traders = 30 if quick else 100
+    rng = random.Random(42)
+    buyers = {1000 + i: rng.randint(200, 400) for i in range(traders)}
+    sellers = {i: {b: (round(rng.uniform(150, 400), 2) if rng.random() < 0.5 else None) for b in buyers}
+               for i in range(traders)}
+    s = Scheduler(logger=quiet_logger())
+    for uuid, prices in sellers.items():
+        s.add(Seller(uuid, prices=prices))
+    for uuid, max_price in buyers.items():
+        s.add(Buyer(uuid, max_price=max_price))
+    start = time.perf_counter()
+    s.run(pause_if_idle=True)
+    end = time.perf_counter()
+    return {"seconds": metric(end - start, "s", better="lower")}
+
+
+@benchmark
+def scheduling(quick=False):
+    """ independent copies of the supply chain (2 machines and stock) of the scheduling demo. """
+    chains = 200 if quick else 5000
+    s = Scheduler(logger=quiet_logger())
+    for _ in range(chains):
+        # the demo data: the idle time negotiation of the demo does not converge for arbitrary run times.
+        m2 = Machine(name='M2', run_times={'A': 14, 'B': 7, 'C': 3, 'D': 10, 'E': 5, 'F': 6, 'G': 6},
+                     transformations={sku: 'M1' + sku for sku in 'ABCDEFG'})
+        m1 = Machine(name='M1', run_times={'M1A': 2, 'M1B': 5, 'M1C': 10, 'M1D': 8, 'M1E': 4, 'M1F': 12, 'M1G': 9},
+                     transformations={'M1' + sku: 'raw' + sku for sku in 'ABCDEFG'})
+        stock = StockAgent()
+        stock.set_customer(m1)
+        m2.set_supplier(m1)
+        m1.set_customer(m2)
+        m1.set_supplier(stock)
+        for agent in [m1, m2, stock]:
+            s.add(agent)
+        m2.inbox.append(Order(sender=m2, receiver=m2, order_items={sku: 1 for sku in 'ABCDEFG'}))
+    start = time.perf_counter()
+    s.run(pause_if_idle=True)
+    end = time.perf_counter()
+    assert all([job.order_sku for job in agent.jobs] == list("AEBDGFC")
+               for agent in s.agents.values() if isinstance(agent, Machine) and agent.name == 'M2')
+    return {"seconds": metric(end - start, "s", better="lower")}
+
+
+@benchmark
+def checkpoint(quick=False):
+    """ saves and restores a population of agents that subscribe to a topic and have mail in their inbox. """
+    n = 20_000 if quick else 1_000_000
+    s = Scheduler(logger=quiet_logger(), real_time=False)
+    for _ in range(n):
+        agent = SlottedListener()
+        s.add(agent)
+        agent.subscribe(topic="news")
+        agent.inbox.append(Msg(agent.uuid, agent.uuid))
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "benchmark.checkpoint"
+        start = time.perf_counter()
+        size = save(s, path)
+        saved = time.perf_counter()
+        restored = restore(path, scheduler=Scheduler(logger=quiet_logger(), real_time=False))
+        end = time.perf_counter()
+    assert len(restored.agents) == n
+    return {"save agents/second": metric(n / (saved - start), "agents/s"),
+            "restore agents/second": metric(n / (end - saved), "agents/s"),
+            "bytes/agent": metric(size / n, "B", better="lower")}
+
+
+@benchmark
+def mail_log(quick=False):
+    """ ping pong between 1 and between 500 pairs of agents, without and with a MailLog. """
+    seconds = 0.5 if quick else 5
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for pairs in [1, 500]:
+            for name, path in [("", None), (" (mail log)", Path(folder) / f"{pairs}.maillog")]:
+                s = Scheduler(logger=quiet_logger(), mail_log=None if path is None else MailLog(path))
+                messages = []
+                for _ in range(pairs):
+                    a, b = A(), A()
+                    s.add(a)
+                    s.add(b)
+                    messages.append(Msg(a, b))
+                    a.send(messages[-1])
+                s.run(seconds=seconds)
+                if path is not None:
+                    s.mail_log.close()
+                results[f"{pairs} pairs messages/second{name}"] = metric(sum(m.value for m in messages) / seconds, "msg/s")
+    return results
+
+
+def _bytes_per_object(factory, n):
+    """ returns the bytes retained per object and the peak bytes per object while creating n objects. """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [factory() for _ in range(n)]
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return (after - before) / n, (peak - before) / n
+
+
+@benchmark
+def memory(quick=False):
+    """ bytes per agent (added to a scheduler) and bytes per message, for subclasses
+    with and without __slots__. """
+    n = 10_000 if quick else 100_000
+    results = {}
+    for name, cls in [("agent", Listener), ("slotted agent", SlottedListener)]:
+        s = Scheduler(logger=quiet_logger(), real_time=False)
+
+        def factory():
+            agent = cls()
+            s.add(agent)
+            return agent
+
+        retained, peak = _bytes_per_object(factory, n)
+        results[f"bytes/{name}"] = metric(retained, "B", better="lower")
+        results[f"peak bytes/{name}"] = metric(peak, "B", better="lower")
+
+    for name, cls in [("message", Msg), ("slotted message", SlottedMsg)]:
+        retained, peak = _bytes_per_object(lambda: cls(1, 2), n)
+        results[f"bytes/{name}"] = metric(retained, "B", better="lower")
+        results[f"peak bytes/{name}"] = metric(peak, "B", better="lower")
+    return results
+
+
+def run(names=None, quick=False):
+    """ runs the benchmarks.
+    :param names: list of benchmark names, None for all.
+    :param quick: bool, use smaller workloads.
+    :return: dict with the results.
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"unknown benchmarks: {unknown}. Choose from {list(BENCHMARKS)}")
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](quick=quick)
+        for key, m in results[name].items():
+            print(f"{name:<12} {key:<34} {m['value']:>16,.3f} {m['unit']}", flush=True)
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "quick": quick,
+            "results": results}
+
+
+def compare(results, baseline, threshold=0.25):
+    """ compares results with a baseline.
+    :param results: dict from run()
+    :param baseline: dict from run()
+    :param threshold: float, the fraction by which a metric may be worse than the baseline.
+    :return: list of regressions (str). Metrics that aren't in both are ignored.
+    """
+    regressions = []
+    for name, metrics in results["results"].items():
+        for key, m in metrics.items():
+            reference = baseline["results"].get(name, {}).get(key, None)
+            if reference is None or reference["value"] == 0:
+                continue
+            change = (m["value"] - reference["value"]) / reference["value"]
+            if m["better"] == "lower":
+                change = -change
+            if change < -threshold:
+                regressions.append(f"{name} {key}: {m['value']:,.1f} {m['unit']} vs baseline "
+                                   f"{reference['value']:,.1f} {m['unit']} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MASlite benchmark suite.")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--quick", action="store_true", help="use smaller workloads.")
+    parser.add_argument("--output", help="write the results to this json file.")
+    parser.add_argument("--save-baseline", help="write the results to this json file as the new baseline.")
+    parser.add_argument("--baseline", help="compare the results with this json file.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed regression (fraction). Default 0.25")
+    args = parser.parse_args(argv)
+
+    results = run(args.names or None, quick=args.quick)
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("quick") != results["quick"]:
+            print("warning: the baseline and the results were made with different workloads (--quick).")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
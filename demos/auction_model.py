@@ -1,4 +1,4 @@
-from maslite import Agent, AgentMessage, Scheduler
+from maslite import Agent, AgentMessage, Scheduler, handles
 from collections import defaultdict
 
 __author__ = ["dr.bjorn.madsen@gmail.com"]
@@ -125,9 +125,6 @@ class Withdraw(AgentMessage):
 class Seller(Agent):
     def __init__(self, uid, prices, send_advert_at_setup=True):
         super().__init__(uuid=uid)
-        self.operations[RFQ.__name__] = self.rfq
-        self.operations[Accept.__name__] = self.acc
-        self.operations[Withdraw.__name__] = self.withdraw
         self.buyers = defaultdict(dict)
         self.prices = prices
         self.send_advert_at_setup = send_advert_at_setup
@@ -138,12 +135,7 @@ class Seller(Agent):
             self.send(Advert(sender=self))
 
     def update(self):
-        while self.messages:
-            msg = self.receive()
-            if msg.receiver not in {self.uuid, None}:
-                continue
-            ops = self.operations.get(msg.topic)
-            ops(msg)
+        self.dispatch_inbox()
 
         # make up my mind.
         offers = []
@@ -173,8 +165,11 @@ class Seller(Agent):
     def teardown(self):
         pass
 
+    @handles(RFQ)
     def rfq(self, msg):
         assert isinstance(msg, RFQ)
+        if msg.receiver not in {self.uuid, None}:
+            return  # an RFQ for another seller.
         if msg.sender in self.buyers:
             return
         price = self.prices.get(msg.sender, None)
@@ -185,11 +180,13 @@ class Seller(Agent):
         self.buyers[msg.sender] = {'price': price, 'accepted': None, 'selected': None, 'withdrawn': False}
         self.send(Advert(sender=self, receiver=msg.sender, price=price))
 
+    @handles(Accept)
     def acc(self, msg):
         assert isinstance(msg, Accept)
         self.buyers[msg.sender]['accepted'] = True
         self.buyers[msg.sender]['withdrawn'] = False
 
+    @handles(Withdraw)
     def withdraw(self, msg):
         assert isinstance(msg, Withdraw)
         self.buyers[msg.sender]['price'] = 0
@@ -207,9 +204,6 @@ class Buyer(Agent):
     def __init__(self, uid, max_price, send_rfq_at_setup=True):
         super().__init__(uuid=uid)
         self.max_price = max_price
-        self.operations[Advert.__name__] = self.adv
-        self.operations[Accept.__name__] = self.acc
-        self.operations[Withdraw.__name__] = self.withdraw
         self.sellers = defaultdict(dict)
         self.send_rfq_at_setup = send_rfq_at_setup
 
@@ -219,14 +213,7 @@ class Buyer(Agent):
             self.send(RFQ(sender=self, max_price=self.max_price))
 
     def update(self):
-        while self.messages:
-            msg = self.receive()
-
-            if msg.receiver not in {self.uuid, None}:
-                continue
-
-            ops = self.operations.get(msg.topic)
-            ops(msg)
+        self.dispatch_inbox()
 
         # make up my mind.
         offers = []
@@ -265,8 +252,11 @@ class Buyer(Agent):
     def teardown(self):
         pass
 
+    @handles(Advert)
     def adv(self, msg):
         assert isinstance(msg, Advert)
+        if msg.receiver not in {self.uuid, None}:
+            return  # an Advert for another buyer.
         if msg.price is None:
             self.send(RFQ(sender=self, receiver=msg.sender, max_price=self.max_price))
             return
@@ -277,11 +267,13 @@ class Buyer(Agent):
         else:
             self.send(Withdraw(sender=self, receiver=msg.sender))
 
+    @handles(Accept)
     def acc(self, msg):
         assert isinstance(msg, Accept)
         self.sellers[msg.sender]['accepted'] = True
         self.sellers[msg.sender]['withdrawn'] = False
 
+    @handles(Withdraw)
     def withdraw(self, msg):
         assert isinstance(msg, Withdraw)
         self.sellers[msg.sender]['accepted'] = False
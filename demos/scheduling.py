@@ -1,4 +1,4 @@
-from maslite import Agent, AgentMessage
+from maslite import Agent, AgentMessage, handles
 from collections import namedtuple
 
 __description__ = """The scheduling demo presented in Bjorn Madsen's PhD thesis (https://oro.open.ac.uk/61375/)."""
@@ -100,9 +100,6 @@ class Machine(Agent):
         self.stock = {}
         self.jobs = []
         self.finish_time = -1
-        self.operations.update({Order.__name__: self.process_order,  # new order arrives.
-                                SupplySchedule.__name__: self.update_schedule_with_supply_schedule,
-                                JobsWithIdleTime.__name__: self.deal_with_idle_time})  # supply schedule arrives.
 
     def __str__(self):
         return "<{} {}>".format(self.__class__.__name__, self.name)
@@ -114,12 +111,7 @@ class Machine(Agent):
         pass
 
     def update(self):
-        while self.messages:
-            msg = self.receive()
-            operation = self.operations.get(msg.topic, None)
-            if operation is not None:
-                operation(msg)
-
+        self.dispatch_inbox()
         self.update_finish_time()
 
     def set_customer(self, agent):
@@ -140,6 +132,7 @@ class Machine(Agent):
             if last_job.finish_time:
                 self.finish_time = last_job.finish_time
 
+    @handles(Order)  # new order arrives.
     def process_order(self, msg):
         """
         Process order registers any new order in the joblist.
@@ -190,6 +183,7 @@ class Machine(Agent):
         jobs.sort()
         self.jobs = [j for supply_time, run_time, j in jobs]
 
+    @handles(SupplySchedule)  # supply schedule arrives.
     def update_schedule_with_supply_schedule(self, msg):
         """
         :param msg: SupplySchedule
@@ -265,6 +259,7 @@ class Machine(Agent):
             new_msg = SupplySchedule(sender=self, receiver=self.customer, schedule=customer_supply_schedule)
             self.send(new_msg)
 
+    @handles(JobsWithIdleTime)
     def deal_with_idle_time(self, msg):
         assert isinstance(msg, JobsWithIdleTime)
         jobs_with_idle_time = msg.get_jobs_with_idle_time()
@@ -283,7 +278,6 @@ class StockAgent(Agent):
         super().__init__()
         self.customer = None
         self.name = name
-        self.operations.update({Order.__name__: self.process_order})
 
     def __str__(self):
         return "<{} {}>".format(self.__class__.__name__, self.name)
@@ -295,16 +289,13 @@ class StockAgent(Agent):
         pass
 
     def update(self):
-        while self.messages:
-            msg = self.receive()
-            operation = self.operations.get(msg.topic, None)
-            if operation is not None:
-                operation(msg)
+        self.dispatch_inbox()
 
     def set_customer(self, agent):
         assert isinstance(agent, Agent)
         self.customer = agent.uuid
 
+    @handles(Order)
     def process_order(self, msg):
         assert isinstance(msg, Order)
         ordered_items = msg.get_ordered_items()
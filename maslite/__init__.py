@@ -1,9 +1,16 @@
+import gc
 import time
 import logging
+import threading
 from collections import deque, defaultdict
 from itertools import count
-from bisect import insort
+from contextlib import contextmanager
+from operator import attrgetter
+from functools import partial
+from heapq import heappush, heappop, heapify
 from math import inf
+from inspect import iscoroutinefunction
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
 
 CRITICAL = logging.CRITICAL
 FATAL = CRITICAL
@@ -21,6 +28,68 @@ class MasLiteException(Exception):
     pass
 
 
+_SLOT_NAMES = {}  # class: tuple of slot names, see _slot_names.
+
+
+def _slot_names(cls):
+    """ returns the (mangled) names of the __slots__ of cls and its base classes. """
+    names = _SLOT_NAMES.get(cls, None)
+    if names is not None:
+        return names
+    names = []
+    for c in cls.__mro__:
+        slots = c.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            if name in ('__dict__', '__weakref__'):
+                continue
+            if name.startswith('__') and not name.endswith('__'):
+                name = f"_{c.__name__.lstrip('_')}{name}"
+            names.append(name)
+    names = _SLOT_NAMES[cls] = tuple(names)
+    return names
+
+
+def _get_state(obj):
+    """ returns the attributes of obj, held in __slots__ or __dict__, as a dict. """
+    state = dict(getattr(obj, '__dict__', {}))
+    for name in _slot_names(type(obj)):
+        try:
+            state[name] = getattr(obj, name)
+        except AttributeError:  # the slot hasn't been set.
+            pass
+    return state
+
+
+def _set_state(obj, state):
+    """ sets the attributes in state (dict or (dict, slots dict) as made by pickle) on obj. """
+    if isinstance(state, tuple):
+        state, slots = state
+        state = {**(state or {}), **(slots or {})}
+    for name, value in state.items():
+        object.__setattr__(obj, name, value)
+
+
+@contextmanager
+def _gc_paused():
+    """ pauses the garbage collector whilst many new objects are made in one go, which would
+    trigger it over and over again. Afterwards it is on again if it was on before.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _post_unattached(msg):
+    """ Agent.send of agents that haven't been added to a scheduler. """
+    raise AssertionError("agent must be added to scheduler using scheduler.add(agent)")
+
+
 class AgentMessage(object):
     """
     BaseMessage checks whether the sender and receiver are
@@ -28,7 +97,24 @@ class AgentMessage(object):
     If the receiver is None, the message is considered a broadcast
     where the mailman needs to figure out who is subscribing and
     how to get it to the subscribers.
+
+    AgentMessage uses __slots__. Subclasses that also declare __slots__ for their
+    own attributes are stored without a __dict__ and use about half the memory:
+
+        class Bid(AgentMessage):
+            __slots__ = ('price',)
+
+    Urgent messages set a lower priority than the default 0, at class level (or per
+    message, for subclasses with a __dict__ or a 'priority' slot):
+
+        class Cancel(AgentMessage):
+            priority = -1
+
+    Agents with priority_inbox = True receive them first, and a Scheduler with
+    priority_mail=True delivers them first.
     """
+    __slots__ = ('sender', 'receiver', 'topic', 'direct')
+    priority = 0  # lower is more urgent. See PriorityInbox and Scheduler(priority_mail=True).
 
     def __init__(self, sender, receiver=None, topic=None, direct=False):
         """
@@ -68,9 +154,210 @@ class AgentMessage(object):
         raise NotImplementedError("subclasses must implement a suitable copy method.")
 
 
+class OffloadResult(AgentMessage):
+    """ The result of a computation that an agent has offloaded to the process pool, see Agent.offload. """
+    __slots__ = ('job', 'result', 'error')
+
+    def __init__(self, receiver, job, result=None, error=None, topic=None):
+        """
+        :param receiver: uuid of the agent that offloaded the computation. It's also the sender.
+        :param job: int, the number returned by Agent.offload.
+        :param result: the return value of the function, None if it raised.
+        :param error: None, or the exception that the function raised.
+        :param topic: the topic given to Agent.offload. Default: 'OffloadResult'.
+        """
+        super().__init__(sender=receiver, receiver=receiver, topic=topic)
+        self.job = job
+        self.result = result
+        self.error = error
+
+
+class _FreezeAfterInit(type):
+    """ metaclass that freezes FrozenMessages once their __init__ has completed. """
+    def __call__(cls, *args, **kwargs):
+        msg = super().__call__(*args, **kwargs)
+        object.__setattr__(msg, '_frozen', True)
+        return msg
+
+
+class FrozenMessage(AgentMessage, metaclass=_FreezeAfterInit):
+    """
+    An immutable AgentMessage. The attributes can be set in __init__, after which
+    any attempt to set or delete an attribute raises AttributeError.
+
+    As nobody can change a FrozenMessage, the scheduler delivers the same instance
+    to the receiver and all subscribers instead of a copy for each subscriber, so
+    a broadcast to 10,000 subscribers doesn't create 10,000 messages, and subclasses
+    don't need to implement copy.
+
+    The freeze is shallow: the contents of mutable attributes (lists, dicts, ...)
+    should be treated as read-only by convention, for example by using tuples.
+    """
+    __slots__ = ('_frozen',)
+
+    def __new__(cls, *args, **kwargs):
+        msg = super().__new__(cls)
+        object.__setattr__(msg, '_frozen', False)
+        return msg
+
+    def __setstate__(self, state):
+        """ unpickles and copies without tripping over the freeze. """
+        _set_state(self, state)
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError(f"{self.__class__.__name__} is frozen. Can't set {name}.")
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if self._frozen:
+            raise AttributeError(f"{self.__class__.__name__} is frozen. Can't delete {name}.")
+        super().__delattr__(name)
+
+    def copy(self):
+        """
+        :return: self, as frozen messages can be shared.
+        """
+        return self
+
+
+_priority = attrgetter('priority')
+
+
+def handles(*topics):
+    """ registers an Agent method as the operation for the topics. A topic that is
+    an AgentMessage class stands for the messages of that class and its subclasses,
+    whatever their topic:
+
+        class Seller(Agent):
+            @handles(RFQ)
+            def rfq(self, msg):
+                ...
+
+            @handles("Accept", "Confirm")
+            def accept(self, msg):
+                ...
+
+            def update(self):
+                self.dispatch_inbox()
+
+    The registrations are compiled into the dispatch table of the class, together
+    with the class_operations. See Agent.dispatch_inbox
+    """
+    if not topics:
+        raise ValueError("handles needs at least one topic.")
+
+    def register(method):
+        method.handled_topics = getattr(method, 'handled_topics', ()) + topics
+        return method
+    return register
+
+
+class PriorityInbox(deque):
+    """ An inbox that hands out the messages with the lowest msg.priority first, and
+    messages with the same priority in the order they arrived.
+
+    It is a deque that is kept sorted by priority: append inserts a message behind
+    the messages with the same or a lower priority. Messages usually arrive in
+    priority order or with the default priority, so append is an append at the
+    end, and popleft, len and iteration are those of the deque.
+    """
+    __slots__ = ()
+
+    def __init__(self, messages=()):
+        super().__init__()
+        self.extend(messages)
+
+    def append(self, msg):
+        priority = msg.priority
+        if not self or priority >= self[-1].priority:
+            deque.append(self, msg)
+            return
+        low, high = 0, len(self) - 1  # the message goes before self[high]
+        while low < high:
+            middle = (low + high) // 2
+            if priority < self[middle].priority:
+                high = middle
+            else:
+                low = middle + 1
+        self.insert(high, msg)
+
+    def extend(self, messages):
+        for msg in messages:
+            self.append(msg)
+
+    def appendleft(self, msg):
+        raise NotImplementedError("the position of a message in a PriorityInbox is set by its priority.")
+
+    def extendleft(self, messages):
+        raise NotImplementedError("the position of a message in a PriorityInbox is set by its priority.")
+
+
 class Agent(object):
-    """ The default agent class. """
+    """ The default agent class.
+
+    Agent uses __slots__, the inbox is only allocated when the agent gets mail and
+    the operations dict when it's used. Subclasses that declare __slots__ for their
+    own attributes are stored without a __dict__:
+
+        class Machine(Agent):
+            __slots__ = ('stock', 'jobs')
+
+    Operations that are the same for all instances of a class should be declared
+    once at class level, as topic: method name, instead of per agent:
+
+        class Seller(Agent):
+            class_operations = {'RFQ': 'rfq', 'Accept': 'accept'}
+
+            def update(self):
+                while self.messages:
+                    msg = self.receive()
+                    operation = self.get_operation(msg.topic)
+                    if operation is not None:
+                        operation(msg)
+
+    The class_operations of a subclass are merged with those of its base classes.
+    Methods can also be registered with the `handles` decorator, and dispatch_inbox
+    calls the operations of all messages in the inbox.
+
+    Agents that set priority_inbox = True get a PriorityInbox, so receive() returns
+    the messages with the lowest msg.priority first.
+
+    Agents that set has_members = True receive the mail of the uuids returned by
+    member_uuids(), see maslite.arrays.AgentArray.
+
+    Agents that set io_bound = True are updated in a thread pool when the scheduler
+    has io_threads, see Scheduler.__init__.
+    """
+    __slots__ = ('_clock', '_scheduler_api', '_post', '_checked', '_inbox', '_uuid', '_operations', 'keep_awake')
     uuid_counter = count(1)
+    class_operations = {}  # topic: name of the method that handles the topic. Shared by all instances.
+    priority_inbox = False  # True: the inbox is a PriorityInbox instead of a deque.
+    has_members = False  # True: the agent also receives the mail of its member_uuids().
+    io_bound = False  # True: the update waits for I/O and may run in the scheduler's thread pool.
+
+    _topic_handlers = {}  # topic: function(agent, msg), compiled from class_operations. See dispatch_inbox.
+    _message_handlers = {}  # AgentMessage class: function(agent, msg), from @handles(message class).
+    _resolved_handlers = {}  # message class: function or None, resolved through the MRO of the message class.
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        operations = {}
+        message_operations = {}
+        for base in reversed(cls.__mro__):
+            operations.update(base.__dict__.get('class_operations', {}))
+            for name, attribute in base.__dict__.items():
+                for topic in getattr(attribute, 'handled_topics', ()):
+                    if isinstance(topic, type) and issubclass(topic, AgentMessage):
+                        message_operations[topic] = name
+                    else:
+                        operations[topic] = name
+        cls.class_operations = operations
+
+        # the dispatch table holds the functions, so that dispatching needs no getattr per message.
+        cls._topic_handlers = {topic: getattr(cls, name) for topic, name in operations.items() if hasattr(cls, name)}
+        cls._message_handlers = {c: getattr(cls, name) for c, name in message_operations.items() if hasattr(cls, name)}
+        cls._resolved_handlers = {}
 
     def __init__(self, uuid=None):
         """
@@ -78,7 +365,9 @@ class Agent(object):
         """
         self._clock = None
         self._scheduler_api = None
-        self.inbox = deque()  # when using self.receive() we get the messages from here
+        self._post = _post_unattached  # the scheduler's mail_queue.append, installed by Scheduler.add
+        self._checked = True  # see Scheduler(checked=...)
+        self._inbox = None  # deque, allocated when the first message arrives. See Agent.inbox.
         if uuid is None:
             self._uuid = next(Agent.uuid_counter)  # this is our worldwide unique id.
         else:
@@ -87,9 +376,9 @@ class Agent(object):
             except TypeError:
                 raise TypeError("uuid must be hashable.")
             self._uuid = uuid
-        self.operations = dict()  # this is the link between msg.topic and agents response.
+        self._operations = None  # dict, allocated when used. See Agent.operations.
         self.keep_awake = False  # this prevents the agent from entering sleep mode when there
-        # are no new messages.
+        # are no new messages. To be updated now and then rather than always, see wake_every.
 
     def __str__(self):
         return f"{self.__class__.__name__}({self.uuid})"
@@ -97,6 +386,129 @@ class Agent(object):
     def __repr__(self):
         return f"{self.__class__.__name__}({self.uuid})"
 
+    def __getstate__(self):
+        """ agents are pickled without their references to the scheduler and clock. """
+        state = _get_state(self)
+        state['_scheduler_api'] = None
+        state['_clock'] = None
+        state['_post'] = _post_unattached
+        return state
+
+    def __setstate__(self, state):
+        self._post = _post_unattached
+        _set_state(self, state)
+
+    @property
+    def inbox(self):
+        """ deque (or PriorityInbox) with the messages that the agent has received. """
+        inbox = self._inbox
+        if inbox is None:
+            inbox = self._inbox = self._new_inbox()
+        return inbox
+
+    @inbox.setter
+    def inbox(self, value):
+        self._inbox = value
+
+    def _new_inbox(self):
+        """ returns an empty inbox: a PriorityInbox if priority_inbox is set, otherwise a deque. """
+        return PriorityInbox() if self.priority_inbox else deque()
+
+    @property
+    def operations(self):
+        """ dict with topic: callable(msg) for this agent only. This is the link between
+        msg.topic and the agents response. See also Agent.class_operations and Agent.get_operation.
+        """
+        operations = self._operations
+        if operations is None:
+            operations = self._operations = dict()
+        return operations
+
+    @operations.setter
+    def operations(self, value):
+        self._operations = value
+
+    def get_operation(self, topic):
+        """ returns the operation for a topic from the agents operations, or if
+        it has none, from the class_operations.
+        :param topic: msg.topic
+        :return: callable(msg) or None
+        """
+        operations = self._operations
+        if operations:
+            operation = operations.get(topic, None)
+            if operation is not None:
+                return operation
+        name = self.class_operations.get(topic, None)
+        if name is None:
+            return None
+        return getattr(self, name)
+
+    @classmethod
+    def _message_handler(cls, message_class):
+        """ returns the function registered for message_class or the nearest of its base classes, or None. """
+        resolved = cls._resolved_handlers
+        try:
+            return resolved[message_class]
+        except KeyError:
+            pass
+        handler = None
+        for base in message_class.__mro__:
+            handler = cls._message_handlers.get(base, None)
+            if handler is not None:
+                break
+        resolved[message_class] = handler
+        return handler
+
+    def dispatch_inbox(self):
+        """ receives all messages in the inbox and calls their operation, which is the first of:
+
+        1. the agent's own operations[msg.topic]
+        2. the method registered for msg.topic with `handles` or in class_operations.
+        3. the method registered with `handles` for the class of the message, or the
+           nearest of its base classes.
+
+        Messages without an operation are passed to `unhandled`. The methods are taken from the
+        dispatch table that is compiled when the class is created, so methods that are replaced
+        on an instance aren't called; use the agent's operations for that.
+
+        :return: int, the number of messages received.
+        """
+        inbox = self._inbox
+        if not inbox:
+            return 0
+        cls = self.__class__
+        topic_handlers = cls._topic_handlers
+        operations = self._operations
+        received = 0
+        while inbox:
+            msg = inbox.popleft()
+            received += 1
+            if operations:
+                operation = operations.get(msg.topic, None)
+                if operation is not None:
+                    operation(msg)
+                    continue
+            handler = topic_handlers.get(msg.topic, None)
+            if handler is None:
+                handler = cls._message_handler(msg.__class__)
+                if handler is None:
+                    self.unhandled(msg)
+                    continue
+            handler(self, msg)
+        return received
+
+    def unhandled(self, msg):
+        """ called by dispatch_inbox with the messages that have no operation. Does nothing;
+        override it to log or raise.
+        :param msg: AgentMessage
+        """
+        pass
+
+    def member_uuids(self):
+        """ returns the uuids whose mail the agent receives, if has_members is True. """
+        return ()
+
     @property
     def time(self):
         """ returns time as float"""
@@ -123,31 +535,70 @@ class Agent(object):
         """
         :return: Boolean: True if there are messages.
         """
-        if self.inbox:
+        if self._inbox:
             return True
         else:
             return False
 
     def send(self, msg):
         """ The only method for sending messages in the system.
-        Message are deliberately NOT asserted for, as it should be possible
-        to dispatch all kinds of objects.
-        :param msg: any pickleable object.
+        :param msg: AgentMessage. This is only checked if the scheduler runs with checks (the default).
         :return: None
         """
-        assert isinstance(msg, AgentMessage), "sending messages that aren't based on AgentMessage's wont work"
-        assert isinstance(self._scheduler_api, Scheduler), "agent must be added to scheduler using scheduler.add(agent)"
-        self._scheduler_api.mail_queue.append(msg)
+        if self._checked:
+            assert isinstance(msg, AgentMessage), "sending messages that aren't based on AgentMessage's wont work"
+        self._post(msg)
+
+    def send_many(self, messages):
+        """ Sends many messages in one call.
+        :param messages: iterable of AgentMessages
+        :return: None
+        """
+        scheduler = self._scheduler_api
+        assert isinstance(scheduler, Scheduler), "agent must be added to scheduler using scheduler.add(agent)"
+        if scheduler.checked:
+            if not isinstance(messages, (list, tuple)):
+                messages = list(messages)
+            assert all(isinstance(msg, AgentMessage) for msg in messages), \
+                "sending messages that aren't based on AgentMessage's wont work"
+        self._post.__self__.extend(messages)  # the mail queue, or the outbox of an update in a thread.
 
     def receive(self):
         """
         :return: Returns AgentMessage if any.
         """
-        if self.messages:
-            return self.inbox.popleft()
+        inbox = self._inbox
+        if inbox:
+            return inbox.popleft()
         else:
             return None
 
+    def receive_all(self):
+        """
+        :return: Returns all messages in the inbox as a list and empties the inbox.
+        """
+        inbox = self._inbox
+        if not inbox:
+            return []
+        messages = list(inbox)
+        inbox.clear()
+        return messages
+
+    def drain(self):
+        """ Hands over the inbox. The agent gets a new inbox when the next message arrives.
+
+        Cheaper than receive_all as the messages aren't copied into a list:
+
+            for msg in self.drain():
+                ...
+
+        :return: deque (or PriorityInbox) with the messages.
+        """
+        inbox, self._inbox = self._inbox, None
+        if inbox is None:
+            return self._new_inbox()
+        return inbox
+
     def setup(self):
         """ Users can implement this setup method for starting up the kernel agent.
 
@@ -166,16 +617,14 @@ class Agent(object):
                 self.send(msg)
 
         A good approach is to use have functions for each message and register the
-        functions in the Agent's class' operations at setup:
-
-            def setup(self):
-                self.subscribe(self.uuid)
+        functions in the Agent's class_operations, and subscribe to the topics at setup:
 
-                self.operations.update({"new request": self.new_request,
-                                        "hello": self.receive_hello_msg})
+            class_operations = {"new request": "new_request",
+                                "hello": "receive_hello_msg"}
 
-                for topic in self.operations:
-                    self.subscribe(topic)
+            def setup(self):
+                for topic in self.class_operations:
+                    self.subscribe(topic=topic)
         """
         pass
 
@@ -193,35 +642,26 @@ class Agent(object):
             receive(msg)
         examples of CnC signals are the classes `StartMessage` and `StopMessage`
 
-        A good approach is to use:
+        A good approach is to register a method per topic with `handles` (or in
+        class_operations) and to use:
+
+        self.dispatch_inbox()  # calls the operation of every message in the inbox.
+
+        which does the same as:
 
         while self.messages:
             msg = self.receive()
-            operation = self.operations.get(msg.topic)
+            operation = self.get_operation(msg.topic)
             if operation is not None:
                 operation(msg)
             else:
-                text = "{} {}: don't know what to do with: {}".format(
-                    self.__class__.__name__, str(uuid), str(msg)
-                )
-                self.logger(text, log_level="DEBUG")
-
-        if some messages take precedence over others (priority messages), the
-        inbox should be emptied in the beginning of the update function for
-        sorting. For example:
-
-        priority_topics = [1,2,3]
-        priority_messages = deque()  # from collections import deque
-        normal_messages = deque()
-        while self.messages:
-            msg = self.receive()
-            if msg.topic in priority_topics:
-                priority_messages.append(msg)
-            else:
-                normal_messages.append(msg)
-        priority_messages.extend(normal_messages)
-        while len(priority_messages) > 0:
-            msg = priority_messages.popleft()
+                self.unhandled(msg)
+
+        but without looking up the method for every message.
+
+        if some messages take precedence over others (priority messages), give
+        them a lower msg.priority and set priority_inbox = True on the agent's
+        class. See PriorityInbox.
         """
         raise NotImplementedError("derived classes must implement a update method")
 
@@ -249,12 +689,12 @@ class Agent(object):
         :param ignore_alarm_if_idle: boolean, if True, the scheduler will ignore that an alarm was set,
         if there are no more messages being exchanged.
         """
-        if not isinstance(alarm_time, (float, int)):
-            raise TypeError("expected float or int time. Use time.time() or datetime.datetime.now().timestamp()")
-        if not isinstance(alarm_message, AgentMessage):
-            raise TypeError("expected AgentMessage")
-
-        assert isinstance(self._clock, Clock), "agent must be added to scheduler using scheduler.add(agent)"
+        if self._clock is None or self._clock.checked:
+            if not isinstance(alarm_time, (float, int)):
+                raise TypeError("expected float or int time. Use time.time() or datetime.datetime.now().timestamp()")
+            if not isinstance(alarm_message, AgentMessage):
+                raise TypeError("expected AgentMessage")
+            assert isinstance(self._clock, Clock), "agent must be added to scheduler using scheduler.add(agent)"
         delay = alarm_time if relative else alarm_time - self.time
         self._clock.set_alarm(delay=delay,
                               alarm_message=alarm_message,
@@ -329,6 +769,40 @@ class Agent(object):
         assert isinstance(self._scheduler_api, Scheduler), "agent must be added to scheduler using scheduler.add(agent)"
         self._scheduler_api.pause()
 
+    def wake_every(self, seconds=None, iterations=None):
+        """ updates the agent periodically, also when it has no mail: every `seconds` of the
+        clock or every `iterations` of the scheduler's run. The scheduler keeps track of the
+        wakeups, so the agent needn't set alarms or keep_awake. Without arguments the periodic
+        updates stop.
+
+            def setup(self):
+                self.wake_every(seconds=0.1)  # a monitor that looks around 10 times per second.
+
+        :param seconds: int or float > 0, or None.
+        :param iterations: int > 0, or None.
+        """
+        assert isinstance(self._scheduler_api, Scheduler), "agent must be added to scheduler using scheduler.add(agent)"
+        self._scheduler_api.wake_every(self.uuid, seconds, iterations)
+
+    def offload(self, function, *args, topic=None, **kwargs):
+        """ computes function(*args, **kwargs) in the scheduler's process pool, whilst the
+        scheduler carries on with the other agents. The result arrives in a later iteration as
+        an OffloadResult message to this agent, with the topic given here (or 'OffloadResult').
+
+            def update(self):
+                for msg in self.receive_all():
+                    if isinstance(msg, OffloadResult):
+                        self.jobs_table = msg.result
+                    elif isinstance(msg, Order):
+                        self.offload(plan_jobs, self.orders, topic='plan')
+
+        :param function: a function that can be pickled, so defined at module level. It shouldn't
+        depend on anything but its arguments, which are pickled too.
+        :return: int, the number of the job, which is the `job` of the OffloadResult.
+        """
+        assert isinstance(self._scheduler_api, Scheduler), "agent must be added to scheduler using scheduler.add(agent)"
+        return self._scheduler_api.offload(self.uuid, function, args, kwargs, topic)
+
     def add(self, agent):
         """ Adds the agent to the scheduler. """
         assert isinstance(agent, Agent)
@@ -341,6 +815,18 @@ class Agent(object):
         self._scheduler_api.remove(agent)
 
 
+def _timed_update(agent, deferred, calls):
+    """ updates agent in a thread of the pool.
+    :param deferred: threading.local of the scheduler, see Scheduler._update_in_threads.
+    :param calls: list for the calls to the scheduler and the clock that the update makes.
+    :return: time.perf_counter() before and after the update.
+    """
+    deferred.calls = calls
+    started = time.perf_counter()
+    agent.update()
+    return started, time.perf_counter()
+
+
 class SchedulerException(MasLiteException):
     pass
 
@@ -382,12 +868,180 @@ class AlarmRegistry(object):
         self.alarms[wakeup_time].append(message)
 
     def release_alarm(self, timestamp):
-        alarms = []
-        for t2, msgs in self.alarms.copy().items():
-            if t2 <= timestamp:
-                alarms.extend(msgs[:])
-                del self.alarms[t2]
-        return alarms
+        """ returns (and forgets) the messages that are due at timestamp.
+        The AlarmStore releases timestamps in ascending order, so there are
+        never any earlier alarms left to look for.
+        """
+        return self.alarms.pop(timestamp, [])
+
+
+class AlarmStore(object):
+    """ The pending alarms of a Clock.
+
+    A heap holds the distinct wakeup times (smallest first) and a dict maps each
+    wakeup time to the AlarmRegistries that have messages due at that time, in
+    the order the receivers first set an alarm for it.
+
+    set_alarm and release are O(log n). Cancelled timestamps are left in the heap
+    and skipped when popped, so cancel is O(1) with the heap being re-built once
+    more than half of it is stale.
+    """
+    __slots__ = ['_heap', '_buckets', '_stale']
+
+    def __init__(self):
+        self._heap = []  # wakeup times, smallest first. May contain cancelled (stale) timestamps.
+        self._buckets = dict()  # wakeup time: {receiver: AlarmRegistry}
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, timestamp):
+        return timestamp in self._buckets
+
+    def items(self):
+        """ returns (timestamp, {receiver: AlarmRegistry}) in ascending time order. """
+        return sorted(self._buckets.items(), key=lambda item: item[0])
+
+    def timestamps(self):
+        """ returns the pending wakeup times in ascending order. """
+        return sorted(self._buckets)
+
+    def next_timestamp(self):
+        """ returns the earliest pending wakeup time or None. """
+        heap = self._heap
+        while heap and heap[0] not in self._buckets:
+            heappop(heap)
+            self._stale -= 1
+        return heap[0] if heap else None
+
+    def set_alarm(self, wakeup_time, registry, message=None):
+        """
+        :param wakeup_time: float
+        :param registry: AlarmRegistry of the receiver, which holds the messages.
+        :param message: the AgentMessage, which the registry has. See SequencedAlarmStore.
+        """
+        bucket = self._buckets.get(wakeup_time, None)
+        if bucket is None:
+            bucket = self._buckets[wakeup_time] = dict()
+            heappush(self._heap, wakeup_time)
+        bucket[registry.uuid] = registry
+
+    def pop_due(self, timestamp):
+        """ pops the alarms due at or before timestamp.
+        :return: list of tuples (wakeup time, {receiver: AlarmRegistry}) in ascending time order.
+        """
+        heap, buckets = self._heap, self._buckets
+        due = []
+        while heap and heap[0] <= timestamp:
+            wakeup_time = heappop(heap)
+            bucket = buckets.pop(wakeup_time, None)
+            if bucket is None:  # cancelled.
+                self._stale -= 1
+                continue
+            due.append((wakeup_time, bucket))
+        return due
+
+    def release(self, timestamp):
+        """ pops all alarms due at or before timestamp.
+        :return: list of messages, ordered by wakeup time, receiver and the order they were set.
+        """
+        messages = []
+        for wakeup_time, bucket in self.pop_due(timestamp):
+            for registry in bucket.values():
+                messages.extend(registry.release_alarm(wakeup_time))
+        return messages
+
+    def forget(self, wakeup_time, messages):
+        """ called when messages due at wakeup_time are cleared from an AlarmRegistry.
+        The buckets only know the registries, so there is nothing to do. See SequencedAlarmStore.
+        """
+        pass
+
+    def cancel(self, wakeup_time, receiver):
+        """ removes receiver from the alarms due at wakeup_time. """
+        bucket = self._buckets.get(wakeup_time, None)
+        if bucket is None:
+            return
+        bucket.pop(receiver, None)
+        if bucket:
+            return
+        del self._buckets[wakeup_time]
+        self._stale += 1
+        if self._stale > 64 and self._stale > len(self._heap) // 2:
+            self._heap = list(self._buckets)
+            heapify(self._heap)
+            self._stale = 0
+
+    def clear(self):
+        self._heap.clear()
+        self._buckets.clear()
+        self._stale = 0
+
+
+class SequencedAlarmStore(AlarmStore):
+    """ An AlarmStore that releases the alarms that are due at the same time in the
+    order they were set, (time, sequence), instead of grouped by receiver.
+
+    Besides the buckets, it keeps the messages of every wakeup time in a list in
+    the order they were set, so release hands out that list as it is.
+    """
+    __slots__ = ['_sequences']
+
+    def __init__(self):
+        super().__init__()
+        self._sequences = dict()  # wakeup time: [messages in the order they were set]. Same keys as _buckets.
+
+    def set_alarm(self, wakeup_time, registry, message=None):
+        sequence = self._sequences.get(wakeup_time, None)
+        if sequence is None:
+            self._buckets[wakeup_time] = {registry.uuid: registry}
+            heappush(self._heap, wakeup_time)
+            self._sequences[wakeup_time] = [message]
+        else:
+            self._buckets[wakeup_time][registry.uuid] = registry
+            sequence.append(message)
+
+    def release(self, timestamp):
+        """ pops all alarms due at or before timestamp.
+        :return: list of messages, ordered by wakeup time and the order they were set.
+        """
+        heap, buckets, sequences = self._heap, self._buckets, self._sequences
+        messages = None
+        while heap and heap[0] <= timestamp:
+            wakeup_time = heappop(heap)
+            bucket = buckets.pop(wakeup_time, None)
+            if bucket is None:  # cancelled.
+                self._stale -= 1
+                continue
+            for registry in bucket.values():
+                registry.release_alarm(wakeup_time)
+            sequence = sequences.pop(wakeup_time)
+            if messages is None:
+                messages = sequence
+            else:
+                messages.extend(sequence)
+        return [] if messages is None else messages
+
+    def sequences(self):
+        """ returns (wakeup time, [messages in the order they were set]) in ascending time order. """
+        return sorted(self._sequences.items(), key=lambda item: item[0])
+
+    def forget(self, wakeup_time, messages):
+        """ removes messages that were cleared from an AlarmRegistry from the sequence of wakeup_time. """
+        sequence = self._sequences.get(wakeup_time, None)
+        if sequence is not None:
+            cleared = {id(msg) for msg in messages}
+            self._sequences[wakeup_time] = [msg for msg in sequence if id(msg) not in cleared]
+
+    def cancel(self, wakeup_time, receiver):
+        super().cancel(wakeup_time, receiver)
+        if wakeup_time not in self._buckets:
+            self._sequences.pop(wakeup_time, None)
+
+    def clear(self):
+        super().clear()
+        self._sequences.clear()
 
 
 class Clock(object):
@@ -395,39 +1049,44 @@ class Clock(object):
         if not isinstance(scheduler_api, Scheduler):
             raise TypeError
         self.scheduler_api = scheduler_api
+        self.checked = True  # see Scheduler(checked=...)
         self._time = None
         self.registry = dict()
-        self.alarm_time = []
-        self.clients_to_wake_up = defaultdict(dict)
+        self.alarms = AlarmStore()
         self.last_required_alarm = -1
+        self._deferred = None  # see Scheduler._update_in_threads
 
     @property
     def time(self):
         return self._time
 
+    @property
+    def alarm_time(self):
+        """ returns sorted list of the pending wakeup times. """
+        return self.alarms.timestamps()
+
+    @property
+    def clients_to_wake_up(self):
+        """ returns dict {wakeup time: {receiver: True}} of the pending alarms. """
+        return {t: {uuid: True for uuid in bucket} for t, bucket in self.alarms.items()}
+
     def __str__(self):
-        return f"{self.__class__.__name__}: {self.time} {len(self.alarm_time)} alarms pending"
+        return f"{self.__class__.__name__}: {self.time} {len(self.alarms)} alarms pending"
 
     def tick(self, limit=None):
         """ progresses time by one tick."""
         raise NotImplementedError("sub classes implement this so that _time is updated.")
 
+    def idle_timeout(self, limit=None, next_alarm=None):
+        """ returns the seconds that the scheduler may wait when there is nothing to do.
+        Clocks that jump in time never wait, so the default is 0. See RealTimeClock.
+        """
+        return 0
+
     def release_alarm_messages(self):
         """ releases alarms to the mail queue (whereafter Agent.update will be called). """
-        for timestamp in self.alarm_time[:]:  # alarms are already sorted.
-            if timestamp > self._time:
-                return
-
-            list_of_messages = []
-            clients = self.clients_to_wake_up[timestamp].keys()
-            for client in clients:
-                registry = self.registry[client]
-                assert isinstance(registry, AlarmRegistry)
-                list_of_messages.extend(registry.release_alarm(timestamp))
-
-            self.scheduler_api.mail_queue.extend(list_of_messages)
-            del self.clients_to_wake_up[timestamp]
-            self.alarm_time.remove(timestamp)
+        if self.alarms:
+            self.scheduler_api.mail_queue.extend(self.alarms.release(self._time))
 
     def set_alarm(self, delay, alarm_message, ignore_alarm_if_idle):
         """
@@ -436,23 +1095,23 @@ class Clock(object):
         :param ignore_alarm_if_idle: boolean - scheduler will ignore alarm if no messages
         are exchanged.
         """
-        assert isinstance(delay, (int, float))
-        assert isinstance(alarm_message, AgentMessage)
-        assert isinstance(ignore_alarm_if_idle, bool)
+        if self.checked:
+            assert isinstance(delay, (int, float))
+            assert isinstance(alarm_message, AgentMessage)
+            assert isinstance(ignore_alarm_if_idle, bool)
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.set_alarm, (delay, alarm_message, ignore_alarm_if_idle)))
         wakeup_time = self.time + delay
         if ignore_alarm_if_idle is False:
             self.last_required_alarm = max(self.last_required_alarm, wakeup_time)
 
-        if wakeup_time not in self.alarm_time:
-            insort(self.alarm_time, wakeup_time)  # smallest first!
-
         registry = self.registry.get(alarm_message.receiver, None)
         if registry is None:
             registry = AlarmRegistry(alarm_message.receiver)
             self.registry[alarm_message.receiver] = registry
         registry.set_alarm(wakeup_time, alarm_message)
 
-        self.clients_to_wake_up[wakeup_time][alarm_message.receiver] = True
+        self.alarms.set_alarm(wakeup_time, registry, alarm_message)
 
     def list_alarms(self, receiver):
         """ returns alarms set for uuid
@@ -468,23 +1127,24 @@ class Clock(object):
         :param receiver: receiver of the alarm. If None, all alarms are cleared.
         :param topic: optional, message topic to be cleared.
         """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.clear_alarms, (receiver, topic)))
         if receiver is not None:
             registry = self.registry.get(receiver, None)
             if not registry:
                 return
 
             assert isinstance(registry, AlarmRegistry)
-            for timestamp in registry.alarms.copy():
+            for timestamp, messages in list(registry.alarms.items()):
                 registry.clear_alarms(timestamp, topic)
                 if not registry.has_alarm(timestamp):
-                    del self.clients_to_wake_up[timestamp][receiver]
-
-                if not self.clients_to_wake_up[timestamp]:
-                    self.alarm_time.remove(timestamp)
-                    del self.clients_to_wake_up[timestamp]
+                    self.alarms.cancel(timestamp, receiver)
+                    self.alarms.forget(timestamp, messages)
+                elif len(registry.alarms[timestamp]) < len(messages):
+                    kept = {id(msg) for msg in registry.alarms[timestamp]}
+                    self.alarms.forget(timestamp, [msg for msg in messages if id(msg) not in kept])
         else:
-            self.alarm_time.clear()
-            self.clients_to_wake_up.clear()
+            self.alarms.clear()
 
 
 class RealTimeClock(Clock):
@@ -495,6 +1155,19 @@ class RealTimeClock(Clock):
     def tick(self, limit=None):
         self._time = time.time()
 
+    def idle_timeout(self, limit=None, next_alarm=None):
+        """ returns the seconds until the next alarm, the last required alarm or the limit, whichever comes first.
+        :param limit: the time at which the scheduler stops (optional).
+        :param next_alarm: the next wakeup time of alarms kept elsewhere (optional).
+        :return: float or None if there is neither an alarm nor a limit.
+        """
+        deadlines = [t for t in (self.alarms.next_timestamp(), next_alarm, limit) if t is not None]
+        if self.last_required_alarm > self._time:  # also when the required alarm has been cleared.
+            deadlines.append(self.last_required_alarm)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.time(), 0)
+
 
 class SimulationClock(Clock):
     def __init__(self, scheduler_api):
@@ -509,22 +1182,63 @@ class SimulationClock(Clock):
             pass  # don't progress time, there are new messages to handle
         elif self.scheduler_api.needs_update:
             pass  # don't progress time, agents are updating.
-        elif self.alarm_time:  # jump in time to the next alarm.
-            if not limit:
-                limit = inf
-            self._time = min(min(self.alarm_time), limit)
-        else:
-            pass
+        elif self.scheduler_api._offloads:
+            pass  # don't progress time, the results of offloaded computations are on their way.
+        else:  # jump in time to the next alarm or periodic wakeup.
+            next_alarm = self.alarms.next_timestamp() if self.alarms else None
+            if self.scheduler_api._periods:
+                wakeup = self.scheduler_api.next_periodic_wakeup()
+                if wakeup is not None and (next_alarm is None or wakeup < next_alarm):
+                    next_alarm = wakeup
+            required = self.last_required_alarm
+            if self._time < required and (next_alarm is None or required < next_alarm):
+                next_alarm = required  # the required alarm has been cleared, so the run ends there.
+            if next_alarm is not None:
+                if not limit:
+                    limit = inf
+                self._time = min(next_alarm, limit)
         return
 
+    def idle_timeout(self, limit=None, next_alarm=None):
+        """ a simulation doesn't wait, unless for the results of offloaded computations. """
+        if self.scheduler_api._offloads:
+            return None
+        return 0
+
+
+class DiscreteEventClock(SimulationClock):
+    """ A SimulationClock for discrete-event simulations: Scheduler(real_time=False, discrete_events=True).
+
+    The alarms are the events. The clock jumps from the time of one event to the
+    next, and all events that are due at the same time are released together, in
+    the order (time, sequence) in which they were set, so the agents are updated
+    in that order too. The mail that the agents send is delivered at the same
+    time, before the clock moves on.
+    """
+
+    def __init__(self, scheduler_api):
+        super().__init__(scheduler_api)
+        self.alarms = SequencedAlarmStore()
+
 
 class MailingList(object):
 
-    __slots__ = ['directory', 'subscriptions']
+    __slots__ = ['directory', 'subscriptions', 'cache_size', 'hits', 'misses', '_routes', '_routes_index',
+                 '_senders_of']
 
-    def __init__(self):
+    def __init__(self, cache_size=100_000):
+        """
+        :param cache_size: int, the maximum number of (sender, receiver, topic) routes
+        that get_mail_recipients memorises. When full, the cache is emptied.
+        """
         self.directory = defaultdict(dict)
         self.subscriptions = defaultdict(dict)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._routes = dict()  # (sender, receiver, topic): tuple of recipients.
+        self._routes_index = (defaultdict(set), defaultdict(set), defaultdict(set))  # sender, receiver, topic: {routes}
+        self._senders_of = defaultdict(dict)  # receiver: {sender: True} for the receivers in the directory.
 
     def topics(self):
         topics = set()
@@ -552,8 +1266,39 @@ class MailingList(object):
         """
         self._add(subscriber=subscriber, a=sender, b=receiver, c=topic)
 
+    def subscribe_many(self, subscriptions):
+        """ subscribes in one pass, with one invalidation of the routing cache.
+        :param subscriptions: iterable of (subscriber, sender, receiver, topic)
+        """
+        self.cache_clear()
+        directory, subscribed, senders_of = self.directory, self.subscriptions, self._senders_of
+        with _gc_paused():  # every subscriber gets new dicts.
+            for subscriber, a, b, c in subscriptions:
+                own = subscribed[subscriber]
+                if a not in own:
+                    own[a] = {b: {c: True}}
+                elif b not in own[a]:
+                    own[a][b] = {c: True}
+                elif c in own[a][b]:
+                    continue  # subscribed already.
+                else:
+                    own[a][b][c] = True
+
+                receivers = directory[a]
+                topics = receivers.get(b, None)
+                if topics is None:
+                    receivers[b] = {c: [subscriber]}
+                    senders_of[b][a] = True
+                elif c in topics:
+                    topics[c].append(subscriber)
+                else:
+                    topics[c] = [subscriber]
+
     def _add(self, subscriber, a, b, c):
         """ insert helper """
+        if c in self.subscriptions[subscriber].get(a, {}).get(b, ()):
+            return  # subscribing twice is idempotent.
+        self._invalidate(a, b, c)
         if b in self.directory[a]:
             if c in self.directory[a][b]:
                 self.directory[a][b][c].append(subscriber)
@@ -561,6 +1306,7 @@ class MailingList(object):
                 self.directory[a][b][c] = [subscriber]
         else:
             self.directory[a][b] = {c: [subscriber]}
+            self._senders_of[b][a] = True
 
         if a not in self.subscriptions[subscriber]:
             self.subscriptions[subscriber][a] = {b: {c: True}}
@@ -571,12 +1317,17 @@ class MailingList(object):
 
     def _remove(self, subscriber, a, b, c):
         """ cleanup helper """
+        self._invalidate(a, b, c)
         try:
             self.directory[a][b][c].remove(subscriber)
             if not self.directory[a][b][c]:
                 del self.directory[a][b][c]
                 if not self.directory[a][b]:
                     del self.directory[a][b]
+                    senders = self._senders_of[b]
+                    del senders[a]
+                    if not senders:
+                        del self._senders_of[b]
                     if not self.directory[a]:
                         del self.directory[a]
         except KeyError:
@@ -610,13 +1361,40 @@ class MailingList(object):
         if everything is False and sender is None and receiver is None and topic is None: raise ValueError("please read the docstring. ")
 
         if everything:
-            for sender, receiver_dict in self.subscriptions[subscriber].copy().items():
-                for receiver, topic_dict in receiver_dict.copy().items():
-                    for topic, values in topic_dict.copy().items():
-                        self._remove(subscriber, sender, receiver, topic)
+            for sender, receiver, topic in self._subscription_keys(subscriber):
+                self._remove(subscriber, sender, receiver, topic)
         else:
             self._remove(subscriber, sender, receiver, topic)
 
+    def _subscription_keys(self, subscriber):
+        """ returns list of the (sender, receiver, topic) that subscriber subscribes to. """
+        return [(a, b, c) for a, receiver_dict in self.subscriptions.get(subscriber, {}).items()
+                for b, topic_dict in receiver_dict.items() for c in topic_dict]
+
+    def remove(self, uuid):
+        """ removes everything that refers to an agent that leaves: its subscriptions, the
+        subscriptions of others to messages from or to it, and the cached routes of its messages.
+        Takes time in proportion to the number of these, not to the size of the directory.
+        :param uuid: uuid of the agent.
+        """
+        for a, b, c in self._subscription_keys(uuid):
+            self._remove(uuid, a, b, c)
+
+        keys = []
+        for b, topic_dict in self.directory.get(uuid, {}).items():  # messages from uuid.
+            keys.extend((uuid, b, c) for c in topic_dict)
+        for a in self._senders_of.get(uuid, ()):  # messages to uuid.
+            keys.extend((a, uuid, c) for c in self.directory[a][uuid])
+        for a, b, c in keys:
+            subscribers = self.directory.get(a, {}).get(b, {}).get(c, None)
+            if subscribers is None:  # a key that was both from and to uuid, and is gone already.
+                continue
+            for subscriber in list(subscribers):
+                self._remove(subscriber, a, b, c)
+
+        self._invalidate(uuid, None, None)
+        self._invalidate(None, uuid, None)
+
     def get_subscriptions(self, subscriber):
         """ returns a copy of """
         return self.subscriptions[subscriber].copy()
@@ -628,14 +1406,36 @@ class MailingList(object):
             return []
 
     def get_mail_recipients(self, message):
+        """ returns the uuids of the recipients of message: the receiver first, then the subscribers.
+        :param message: AgentMessage
+        """
         assert isinstance(message, AgentMessage)
+        return self.route(message)
 
+    def route(self, message):
+        """ get_mail_recipients without checking that message is an AgentMessage. """
         if message.direct:
             return [message.receiver]
 
-        # Fetch directory values once
-        sender, receiver, topic = message.sender, message.receiver, message.topic
-
+        key = (message.sender, message.receiver, message.topic)
+        recipients = self._routes.get(key, None)
+        if recipients is not None:
+            self.hits += 1
+            return recipients
+
+        self.misses += 1
+        recipients = self._resolve(*key)
+        if len(self._routes) >= self.cache_size:
+            self.cache_clear()
+        self._routes[key] = recipients
+        for index, value in zip(self._routes_index, key):
+            index[value].add(key)
+        return recipients
+
+    def _resolve(self, sender, receiver, topic):
+        """ looks up the recipients of a message from sender to receiver on topic.
+        :return: tuple of recipients; the receiver (if any) first.
+        """
         if receiver is None:
             recipients = {}
         else:
@@ -668,29 +1468,276 @@ class MailingList(object):
                 if topic in none_none_dict:
                     recipients.update({target: True for target in none_none_dict[topic]})
 
-        return recipients.keys()
+        return tuple(recipients)
+
+    def _invalidate(self, a, b, c):
+        """ forgets the cached routes that a subscription on (sender a, receiver b, topic c) affects.
+        None is a wildcard, so the most selective of a, b, c is used to find the candidates.
+        """
+        if not self._routes:
+            return
+        if a is not None:
+            candidates = self._routes_index[0].get(a, None)
+        elif b is not None:
+            candidates = self._routes_index[1].get(b, None)
+        elif c is not None:
+            candidates = self._routes_index[2].get(c, None)
+        else:
+            candidates = self._routes
+        if not candidates:
+            return
+
+        for key in list(candidates):
+            sender, receiver, topic = key
+            if a is not None and sender != a:
+                continue
+            if b is not None and receiver != b:
+                continue
+            if c is not None and topic != c:
+                continue
+            del self._routes[key]
+            for index, value in zip(self._routes_index, key):
+                keys = index[value]
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+
+    def cache_info(self):
+        """ returns dict with the hits, misses and size of the routing cache. """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._routes), "maxsize": self.cache_size}
+
+    def cache_clear(self):
+        """ empties the routing cache. """
+        self._routes.clear()
+        for index in self._routes_index:
+            index.clear()
+
+
+EVENT_FORMATS = {
+    "add": "Registering agent {0} {1}",
+    "remove": "DeRegistering agent {0}",
+    "remove_unknown": "Agent exists but hasn't been added: {0}",
+    "subscribe": "{0} subscribing to msgs from {1} to {2} on topic {3}",
+    "unsubscribe": "{0} unsubscribing from msgs from {1} to {2} on topic {3}",
+    "unsubscribe_all": "{0} unsubscribing from everything",
+    "add_members": "Agent {0} receives the mail of {1} members",
+}
+
+
+def format_event(kind, args):
+    """ formats an event of the Scheduler as text.
+    :param kind: str, key in EVENT_FORMATS
+    :param args: tuple with the event's arguments. None means 'any' for the sender, receiver and topic.
+    :return: str
+    """
+    if kind in {"subscribe", "unsubscribe"}:
+        subscriber, sender, receiver, topic = args
+        args = (subscriber,
+                "all agents" if sender is None else sender,
+                "all agents" if receiver is None else receiver,
+                "all topics" if topic is None else topic)
+    template = EVENT_FORMATS.get(kind, None)
+    if template is None:
+        return f"{kind} {args}"
+    return template.format(*args)
+
+
+class EventSink(object):
+    """ Receives the lifecycle and subscription events of a Scheduler:
+
+        ("add", (class name, uuid)), ("remove", (uuid,)), ("remove_unknown", (uuid,)),
+        ("subscribe", (subscriber, sender, receiver, topic)),
+        ("unsubscribe", (subscriber, sender, receiver, topic)), ("unsubscribe_all", (subscriber,))
+
+    Subclasses implement emit. The events are passed unformatted; use format_event
+    to turn them into text. A Scheduler without an event sink (the default) doesn't
+    create the events at all.
+    """
+    __slots__ = ()
+
+    def emit(self, kind, args):
+        """
+        :param kind: str, the kind of event. See EVENT_FORMATS
+        :param args: tuple, the arguments of the event.
+        """
+        raise NotImplementedError("subclasses must implement emit.")
+
+
+class RingBufferSink(EventSink):
+    """ Keeps the last `size` events in memory. They are only formatted when read with `lines`. """
+    __slots__ = ('buffer',)
+
+    def __init__(self, size=10_000):
+        """
+        :param size: int, the number of events to keep.
+        """
+        self.buffer = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def emit(self, kind, args):
+        self.buffer.append((kind, args))
+
+    def events(self):
+        """
+        :return: list of (kind, args) tuples, the oldest first.
+        """
+        return list(self.buffer)
+
+    def lines(self):
+        """
+        :return: list of the events as text, the oldest first.
+        """
+        return [format_event(kind, args) for kind, args in self.buffer]
+
+    def clear(self):
+        self.buffer.clear()
+
+
+class LoggingSink(EventSink):
+    """ Writes the events to a logger. They are only formatted if the logger is enabled for the level. """
+    __slots__ = ('logger', 'level')
+
+    def __init__(self, logger, level=DEBUG):
+        """
+        :param logger: logging.Logger
+        :param level: the log level of the events.
+        """
+        self.logger = logger
+        self.level = level
+
+    def emit(self, kind, args):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, format_event(kind, args))
+
+
+class SchedulerStats(object):
+    """ Runtime statistics collected by the Scheduler when stats are enabled. """
+
+    __slots__ = ['iterations', 'run_time', 'copies', 'updates', 'update_time',
+                 'messages_in', 'messages_out', 'deliveries']
+
+    def __init__(self):
+        self.iterations = 0  # iterations of the main loop.
+        self.run_time = 0.0  # wall time spent in Scheduler.run
+        self.copies = 0  # number of msg.copy() calls.
+        self.updates = defaultdict(int)  # uuid: number of agent.update() calls.
+        self.update_time = defaultdict(float)  # uuid: cumulative wall time of agent.update()
+        self.messages_in = defaultdict(int)  # uuid: messages delivered to the agent.
+        self.messages_out = defaultdict(int)  # uuid: messages sent by the agent.
+        self.deliveries = defaultdict(int)  # topic: messages delivered.
+
+    def delivered(self, msg, recipients, agents, members):
+        """ counts the deliveries made by Scheduler.send_to_recipients
+        :param msg: AgentMessage
+        :param recipients: uuids of the recipients
+        :param agents: the agents of the scheduler.
+        :param members: the members of the agents of the scheduler, see Scheduler.add_members.
+        """
+        for uuid in recipients:
+            if uuid not in agents and uuid not in members:
+                continue
+            self.messages_in[uuid] += 1
+            self.deliveries[msg.topic] += 1
+
+    def report(self):
+        """
+        :return: dict with the statistics. The agents are sorted by update time, the busiest first.
+        """
+        agents = {}
+        uuids = set(self.updates) | set(self.messages_in) | set(self.messages_out)
+        for uuid in sorted(uuids, key=lambda uuid: self.update_time.get(uuid, 0.0), reverse=True):
+            agents[uuid] = {
+                "updates": self.updates.get(uuid, 0),
+                "update_time": self.update_time.get(uuid, 0.0),
+                "messages_in": self.messages_in.get(uuid, 0),
+                "messages_out": self.messages_out.get(uuid, 0),
+            }
+        return {
+            "iterations": self.iterations,
+            "run_time": self.run_time,
+            "iterations_per_second": self.iterations / self.run_time if self.run_time else 0.0,
+            "copies": self.copies,
+            "topics": dict(self.deliveries),
+            "agents": agents,
+        }
 
 
 class Scheduler(object):
     """ The scheduler that handles updates of all agents."""
 
-    def __init__(self, logger=None, real_time=True):
+    awaits_updates = False  # True for schedulers that await `async def update`, see maslite.asynchronous
+
+    def __init__(self, logger=None, real_time=True, stats=False, checked=True, event_sink=None, mail_log=None,
+                 tracer=None, priority_mail=False, io_threads=0, processes=None, discrete_events=False):
         """
-        :param logger: optional: logging.logger
+        :param logger: optional: logging.logger, used by Agent.log and Scheduler.log
+        :param real_time: bool, use the RealTimeClock (True) or the SimulationClock (False)
+        :param stats: bool, collect runtime statistics (see Scheduler.stats)
+        :param checked: bool, if False the scheduler runs without the runtime checks of
+        messages and alarms in Agent.send, Agent.set_alarm, Scheduler.add and when routing
+        messages. Use it for production runs of models that have been validated with checks on.
+        :param event_sink: optional: EventSink that receives the lifecycle and subscription events,
+        for example RingBufferSink() or LoggingSink(logger). Default None: no events.
+        :param mail_log: optional: maslite.maillog.MailLog that records the mail, the posted
+        messages and the clock of every iteration, for recovery and replay. Default None: no log.
+        :param tracer: optional: maslite.tracing.Tracer that records the timeline of the iterations,
+        updates, deliveries and alarms. Default None: no trace.
+        :param priority_mail: bool, if True the mail of every iteration is delivered in the order of
+        msg.priority (lowest first, otherwise in the order sent), so urgent messages reach the inboxes
+        before bulk traffic. Default False: the order sent.
+        :param io_threads: int, if > 0 the agents with io_bound = True are updated concurrently by
+        this many threads, after the other agents of the iteration. The messages that each of them
+        sends are added to the mail queue in the order of the updates, whatever the order in which
+        they finish, and so are their alarms, subscriptions and the agents they add or remove.
+        They can't offload. Default 0: every agent is updated in turn.
+        :param processes: int, the number of processes of the pool that runs the computations of
+        Agent.offload. The pool is started by the first offload. Default None: os.cpu_count().
+        :param discrete_events: bool, if True (with real_time=False) the DiscreteEventClock releases
+        the alarms that are due at the same time in the order they were set, instead of grouped by
+        receiver. Default False: the SimulationClock.
         """
+        if not isinstance(io_threads, int) or io_threads < 0:
+            raise ValueError("io_threads must be an int >= 0.")
+        if real_time and discrete_events:
+            raise ValueError("discrete_events requires real_time=False.")
         if real_time:
             self.clock = RealTimeClock(scheduler_api=self)
+        elif discrete_events:
+            self.clock = DiscreteEventClock(scheduler_api=self)
         else:
             self.clock = SimulationClock(scheduler_api=self)
         self.mail_queue = deque()
+        self._ingress = deque()  # messages posted from other threads, see post().
         self.mailing_lists = MailingList()
         self.agents = dict()
+        self.members = dict()  # uuid of a member: uuid of the agent that receives its mail. See Agent.has_members
         self.needs_update = dict()
         self.has_keep_awake = dict()
+        self._pending_setup = []  # agents from add_many(setup=False), set up at the start of the next run.
         self._must_run_until_alarm_expires = False
 
         self._quit = False
-        self._operating_frequency = 1000
+        self._wakeup = threading.Event()  # set by wake() and pause() to end an idle wait.
+        self._stats = SchedulerStats() if stats else None
+        self.checked = True
+        self._set_checked(checked)
+        self.event_sink = event_sink
+        self.mail_log = mail_log
+        self.tracer = tracer
+        self.priority_mail = priority_mail
+        self.io_threads = io_threads
+        self.processes = processes
+        self._process_pool = None
+        self._jobs = count(1)
+        self._offloads = dict()  # job: uuid of the agent, for the computations that haven't finished yet.
+        self.iteration = 0  # the number of iterations of run, over all runs.
+        self._periods = dict()  # uuid: (seconds, iterations, sequence) of the agents that wake_every.
+        self._timed_wakeups = []  # heap of (time, sequence, uuid)
+        self._counted_wakeups = []  # heap of (iteration, sequence, uuid)
+        self._wakeup_sequence = count(1)  # tells the current entries of the heaps from the cancelled ones.
+        self._deferred = None  # threading.local with the calls of the io_bound updates, see _update_in_threads.
 
         if logger is None:
             self._logger = logging.getLogger(self.__class__.__name__)
@@ -709,17 +1756,44 @@ class Scheduler(object):
     def log(self, level, msg):
         self._logger.log(level, msg)
 
+    def _set_checked(self, checked):
+        """ switches the runtime checks on or off. See Scheduler.__init__ """
+        assert isinstance(checked, bool)
+        self.checked = checked
+        self.clock.checked = checked
+        for agent in self.agents.values():
+            agent._checked = checked
+
+    def _attach(self, agent):
+        """ connects an agent to the scheduler. """
+        agent._scheduler_api = self
+        agent._clock = self.clock
+        agent._post = self.mail_queue.append
+        agent._checked = self.checked
+
     def add(self, agent):
         """ Adds an agent to the scheduler
         :param agent: Agent
         """
-        assert isinstance(agent, Agent)
-        self.log(level=DEBUG, msg="Registering agent {} {}".format(agent.__class__.__name__, agent.uuid))
-        if agent.uuid in self.agents:
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.add, (agent,)))
+        if self.checked:
+            assert isinstance(agent, Agent)
+            if not self.awaits_updates and iscoroutinefunction(agent.update):
+                raise SchedulerException(f"{agent.__class__.__name__}.update is a coroutine. "
+                                         f"Use maslite.asynchronous.AsyncScheduler")
+        if self.event_sink is not None:
+            self.event_sink.emit("add", (agent.__class__.__name__, agent.uuid))
+        if agent.uuid in self.agents or agent.uuid in self.members:
             raise SchedulerException("Agent uuid already in usage.")
         self.agents[agent.uuid] = agent
-        agent._scheduler_api = self
-        agent._clock = self.clock
+        self._attach(agent)
+        if agent.has_members:
+            try:
+                self.add_members(agent, agent.member_uuids())
+            except SchedulerException:
+                del self.agents[agent.uuid]
+                raise
 
         agent.setup()
 
@@ -727,10 +1801,77 @@ class Scheduler(object):
             self.has_keep_awake[agent.uuid] = True
         self.needs_update[agent.uuid] = True
 
+    def add_many(self, agents, setup=True):
+        """ Adds many agents at once, for example to load a large model. As add, but the
+        uuids are checked in one go and, without an event sink, nothing is done per agent
+        but the registration and setup.
+        :param agents: iterable of Agents.
+        :param setup: bool, if False the agents are set up at the start of the next run
+        instead, so their subscriptions can be made in bulk with subscribe_many first.
+        :return: list of the agents.
+        """
+        agents = list(agents)
+        if self._deferred is not None:
+            self._deferred.calls.append((self.add_many, (agents, setup)))
+            return agents
+        if self.checked:
+            classes = set()
+            for agent in agents:
+                assert isinstance(agent, Agent)
+                classes.add(agent.__class__)
+            if not self.awaits_updates:
+                for cls in classes:
+                    if iscoroutinefunction(cls.update):
+                        raise SchedulerException(f"{cls.__name__}.update is a coroutine. "
+                                                 f"Use maslite.asynchronous.AsyncScheduler")
+        new = {agent.uuid: agent for agent in agents}
+        if len(new) != len(agents) or not self.agents.keys().isdisjoint(new) or not self.members.keys().isdisjoint(new):
+            raise SchedulerException("Agent uuid already in usage.")
+        if self.event_sink is not None:
+            for agent in agents:
+                self.event_sink.emit("add", (agent.__class__.__name__, agent.uuid))
+
+        self.agents.update(new)
+        added_members = []
+        for agent in agents:
+            if agent.has_members:
+                try:
+                    self.add_members(agent, agent.member_uuids())
+                except SchedulerException:
+                    for done in added_members:
+                        self.remove_members(done.member_uuids())
+                    for uuid in new:
+                        del self.agents[uuid]
+                    raise
+                added_members.append(agent)
+        for agent in agents:
+            self._attach(agent)
+
+        if setup:
+            for agent in agents:
+                agent.setup()
+        else:
+            self._pending_setup.extend(agents)
+        self.has_keep_awake.update((agent.uuid, True) for agent in agents if agent.keep_awake)
+        self.needs_update.update(dict.fromkeys(new, True))
+        return agents
+
+    def _setup_pending(self):
+        """ sets up the agents that add_many didn't set up, if they're still there. """
+        pending, self._pending_setup = self._pending_setup, []
+        for agent in pending:
+            if self.agents.get(agent.uuid, None) is agent:
+                agent.setup()
+                if agent.keep_awake:
+                    self.has_keep_awake[agent.uuid] = True
+
     def remove(self, agent_or_uuid):
-        """ Removes an agent from the scheduler
+        """ Removes an agent from the scheduler, with its subscriptions, the subscriptions of
+        other agents to messages from or to it, and the alarms for it.
         :param agent_or_uuid: Agent or uuid of the agent.
         """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.remove, (agent_or_uuid,)))
         if not isinstance(agent_or_uuid, Agent):
             agent = self.agents.get(agent_or_uuid, None)
             if agent is None:
@@ -740,20 +1881,62 @@ class Scheduler(object):
         assert isinstance(agent, Agent)
 
         if agent.uuid not in self.agents:
-            self.log(level=DEBUG, msg="Agent exists but hasn't been added: {}".format(agent_or_uuid))
+            if self.event_sink is not None:
+                self.event_sink.emit("remove_unknown", (agent.uuid,))
             return
 
-        self.log(level=DEBUG, msg="DeRegistering agent {}".format(agent.uuid))
+        if self.event_sink is not None:
+            self.event_sink.emit("remove", (agent.uuid,))
         agent.teardown()
 
-        self.unsubscribe(subscriber=agent.uuid, everything=True)
+        if self.event_sink is not None:
+            self.event_sink.emit("unsubscribe_all", (agent.uuid,))
+        self.mailing_lists.remove(agent.uuid)
+        self.clock.clear_alarms(receiver=agent.uuid)
+        self.clock.registry.pop(agent.uuid, None)
+        if agent.has_members:
+            self.remove_members(agent.member_uuids())
 
         if agent.uuid in self.needs_update:
             del self.needs_update[agent.uuid]
         if agent.uuid in self.has_keep_awake:
             del self.has_keep_awake[agent.uuid]
+        self._periods.pop(agent.uuid, None)
         del self.agents[agent.uuid]
 
+    def remove_many(self, agents_or_uuids):
+        """ Removes many agents. See remove.
+        :param agents_or_uuids: iterable of Agents or uuids of agents.
+        """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.remove_many, (list(agents_or_uuids),)))
+        self.mailing_lists.cache_clear()  # cheaper than forgetting the routes of the agents one by one.
+        for agent in list(agents_or_uuids):
+            self.remove(agent)
+
+    def add_members(self, agent, uuids):
+        """ delivers the mail for uuids to agent, which handles it on their behalf.
+        :param agent: Agent, added to the scheduler.
+        :param uuids: iterable of uuids that are neither agents nor members.
+        """
+        uuids = list(uuids)
+        members, agents = self.members, self.agents
+        for uuid in uuids:
+            if uuid in agents or uuid in members:
+                raise SchedulerException(f"member uuid {uuid} already in usage.")
+        if self.event_sink is not None:
+            self.event_sink.emit("add_members", (agent.uuid, len(uuids)))
+        for uuid in uuids:
+            members[uuid] = agent.uuid
+
+    def remove_members(self, uuids):
+        """ stops the delivery of the mail for uuids.
+        :param uuids: iterable of member uuids. Unknown uuids are ignored.
+        """
+        members = self.members
+        for uuid in uuids:
+            members.pop(uuid, None)
+
     def run(self, seconds=None, iterations=None, pause_if_idle=True, clear_alarms_at_end=True):
         """ The main 'run' operation of the Scheduler.
 
@@ -770,6 +1953,77 @@ class Scheduler(object):
         Depending on which of 'seconds' or 'iterations' occurs first, the simulation
         will be paused.
         """
+        seconds, start_time, iterations_to_halt = self._start_run(seconds, iterations, pause_if_idle,
+                                                                  clear_alarms_at_end)
+        stats = self._stats
+        if stats is not None:
+            run_started = time.perf_counter()
+        tracer = self.tracer
+        timed = stats is not None or tracer is not None
+        iteration = 0
+        pool = ThreadPoolExecutor(self.io_threads, thread_name_prefix="maslite-io") if self.io_threads else None
+        io_bound = []
+
+        # The main loop of the scheduler:
+        self._quit = False
+        try:
+            while not self._quit:  # _quit is set by method self.pause() and can be called by any agent.
+                if tracer is not None:
+                    iteration += 1
+                    iteration_started = time.perf_counter()
+
+                # update the agents. process.
+                self.iteration += 1
+                if self._periods:
+                    self._wake_periodic()
+                self.needs_update.update(self.has_keep_awake)
+                for uuid in self.needs_update:
+                    agent = self.agents[uuid]
+                    if pool is not None and agent.io_bound:
+                        io_bound.append(agent)
+                        continue
+                    if not timed:
+                        agent.update()
+                    else:
+                        started = time.perf_counter()
+                        agent.update()
+                        ended = time.perf_counter()
+                        if stats is not None:
+                            stats.update_time[uuid] += ended - started
+                            stats.updates[uuid] += 1
+                        if tracer is not None:
+                            tracer.update(uuid, started, ended)
+                    if agent.keep_awake:
+                        self.has_keep_awake[uuid] = True
+                    elif uuid in self.has_keep_awake:
+                        del self.has_keep_awake[uuid]
+                if io_bound:
+                    self._update_in_threads(io_bound, pool)
+                    io_bound.clear()
+                self.needs_update.clear()
+
+                iterations_to_halt, idle = self._end_iteration(seconds, start_time, iterations_to_halt, pause_if_idle)
+                if idle:
+                    self._idle(limit=seconds)
+
+                if stats is not None:
+                    stats.iterations += 1
+                if tracer is not None:
+                    tracer.iteration(iteration, iteration_started, time.perf_counter())
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if stats is not None:
+            stats.run_time += time.perf_counter() - run_started
+        self._end_run(clear_alarms_at_end)
+
+    def _start_run(self, seconds, iterations, pause_if_idle, clear_alarms_at_end):
+        """ the start of run: checks the arguments and finds the agents that need an update.
+        See run for the parameters.
+        :return: (the clock time at which the run stops or None, the clock time at the start
+        if seconds is set or None, the number of iterations to run or None)
+        """
         start_time = None
         if isinstance(seconds, (int, float)) and seconds > 0:
             start_time = self.clock.time
@@ -784,67 +2038,222 @@ class Scheduler(object):
         assert isinstance(pause_if_idle, bool)
         assert isinstance(clear_alarms_at_end, bool)
 
+        if self._pending_setup:
+            self._setup_pending()
         # check all agents for messages (in case that someone on the outside has added messages).
         for agent in self.agents.values():
-            if agent.inbox or agent.keep_awake:
+            if agent._inbox or agent.keep_awake:
                 self.needs_update[agent.uuid] = True
         self.process_mail_queue()
+        return seconds, start_time, iterations_to_halt
 
-        # The main loop of the scheduler:
-        self._quit = False
-        while not self._quit:  # _quit is set by method self.pause() and can be called by any agent.
-
-            # update the agents. process.
-            self.needs_update.update(self.has_keep_awake)
-            for uuid in self.needs_update:
-                agent = self.agents[uuid]
-                agent.update()
-                if agent.keep_awake:
-                    self.has_keep_awake[uuid] = True
-                elif uuid in self.has_keep_awake:
-                    del self.has_keep_awake[uuid]
-            self.needs_update.clear()
-
-            # check any timed alarms.
-            self.clock.tick(limit=seconds)
+    def _end_iteration(self, seconds, start_time, iterations_to_halt, pause_if_idle):
+        """ the part of an iteration of run after the updates: takes the posted messages, ticks
+        the clock, releases the alarms, delivers the mail and decides whether to stop.
+        :return: (the iterations still to run or None, True if the scheduler should wait for
+        something to do with _idle)
+        """
+        # take the messages posted from outside, then check any timed alarms.
+        if self._ingress:
+            self._take_ingress()
+        self.clock.tick(limit=seconds)
+        if self.tracer is None:
             self.clock.release_alarm_messages()
-
-            # distribute messages or sleep.
-            no_messages = len(self.mail_queue) == 0
-            if self.mail_queue:
-                self.process_mail_queue()
-
-            # determine whether to stop:
-            if start_time is not None:
-                if self.clock.time >= seconds:
-                    self._quit = True
-
-            if iterations_to_halt is not None:
-                iterations_to_halt -= 1
-                if iterations_to_halt <= 0:
-                    self._quit = True
-
-            if no_messages:
-                if self.clock.time < self.clock.last_required_alarm:
-                    time.sleep(1 / self._operating_frequency)
-                elif pause_if_idle:
-                    self._quit = True
-                else:
-                    pass  # nothing to do.
-
+        else:
+            self._traced_release_alarm_messages()
+        if self.mail_log is not None:
+            self.mail_log.iteration(self.clock.time, self.mail_queue)
+
+        # distribute messages or sleep.
+        no_messages = len(self.mail_queue) == 0
+        if self.mail_queue:
+            self.deliver_mail()
+
+        # determine whether to stop:
+        iterations_to_halt = self._count_down(seconds, start_time, iterations_to_halt)
+        if not no_messages:
+            return iterations_to_halt, False
+        if self.clock.time < self.clock.last_required_alarm:
+            return iterations_to_halt, True
+        if self._offloads or self._ingress:
+            return iterations_to_halt, True  # results of offloaded computations are on their way.
+        if pause_if_idle:
+            self._quit = True
+            return iterations_to_halt, False
+        return iterations_to_halt, iterations_to_halt is None  # nothing to do until an alarm, the limit or wake().
+
+    def _count_down(self, seconds, start_time, iterations_to_halt):
+        """ stops the run when the time is up or the iterations have run.
+        :return: the iterations still to run or None.
+        """
+        if start_time is not None:
+            if self.clock.time >= seconds:
+                self._quit = True
+
+        if iterations_to_halt is not None:
+            iterations_to_halt -= 1
+            if iterations_to_halt <= 0:
+                self._quit = True
+        return iterations_to_halt
+
+    def _end_run(self, clear_alarms_at_end):
+        """ the end of run. """
         if clear_alarms_at_end:
             self.clock.clear_alarms()
+        if self.mail_log is not None:
+            self.mail_log.finished(clear_alarms_at_end)
+
+    def wake_every(self, uuid, seconds=None, iterations=None):
+        """ updates an agent periodically. See Agent.wake_every.
+        :param uuid: uuid of the agent.
+        :param seconds: int or float > 0: the period in the time of the clock.
+        :param iterations: int > 0: the period in iterations of run.
+        If both are None, the periodic updates of the agent stop.
+        """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.wake_every, (uuid, seconds, iterations)))
+        if uuid not in self.agents:
+            raise ValueError(f"Agent not found: {uuid}")
+        if seconds is not None and iterations is not None:
+            raise ValueError("set either seconds or iterations, not both.")
+        if seconds is None and iterations is None:
+            self._periods.pop(uuid, None)  # the entries in the heaps are skipped when they are due.
+            return
+        sequence = next(self._wakeup_sequence)
+        if seconds is not None:
+            if not isinstance(seconds, (int, float)) or not seconds > 0:
+                raise ValueError("seconds must be a number > 0")
+            heappush(self._timed_wakeups, (self.clock.time + seconds, sequence, uuid))
+        else:
+            if not isinstance(iterations, int) or iterations < 1:
+                raise ValueError("iterations must be an int > 0")
+            heappush(self._counted_wakeups, (self.iteration + iterations, sequence, uuid))
+        self._periods[uuid] = (seconds, iterations, sequence)
+
+    def _wake_periodic(self):
+        """ adds the agents whose periodic wakeup is due to needs_update, and plans their next wakeup. """
+        periods, needs_update = self._periods, self.needs_update
+        now, heap = self.clock.time, self._timed_wakeups
+        while heap and heap[0][0] <= now:
+            due, sequence, uuid = heappop(heap)
+            period = periods.get(uuid, None)
+            if period is None or period[2] != sequence:
+                continue  # cancelled or replaced.
+            needs_update[uuid] = True
+            due += period[0]
+            if due <= now:  # a real-time agent that missed periods catches up once, not once per period.
+                due = now + period[0]
+            heappush(heap, (due, sequence, uuid))
+
+        now, heap = self.iteration, self._counted_wakeups
+        while heap and heap[0][0] <= now:
+            due, sequence, uuid = heappop(heap)
+            period = periods.get(uuid, None)
+            if period is None or period[2] != sequence:
+                continue
+            needs_update[uuid] = True
+            heappush(heap, (due + period[1], sequence, uuid))
+
+    def next_periodic_wakeup(self):
+        """ returns the clock time of the next periodic wakeup (see wake_every), or None. """
+        heap = self._timed_wakeups
+        while heap and self._periods.get(heap[0][2], (None, None, None))[2] != heap[0][1]:
+            heappop(heap)  # cancelled.
+        return heap[0][0] if heap else None
+
+    def next_counted_wakeup(self):
+        """ returns the iteration of the next periodic wakeup by iterations (see wake_every), or None. """
+        heap = self._counted_wakeups
+        while heap and self._periods.get(heap[0][2], (None, None, None))[2] != heap[0][1]:
+            heappop(heap)  # cancelled.
+        return heap[0][0] if heap else None
+
+    def _update_in_threads(self, agents, pool):
+        """ updates the agents concurrently in the thread pool. Each agent sends to an outbox of its
+        own, and the outboxes are added to the mail queue in the order of agents. Likewise the calls
+        that the updates make to set alarms, subscribe, add or remove agents and so on are kept per
+        agent, and made afterwards in the order of agents, so the results don't depend on the order
+        in which the updates finish.
+        :param agents: list of io_bound agents.
+        :param pool: ThreadPoolExecutor
+        """
+        outboxes, calls = [], []
+        for agent in agents:
+            outbox = []
+            agent._post = outbox.append
+            outboxes.append(outbox)
+            calls.append([])
+        self._deferred = self.clock._deferred = threading.local()
+        try:
+            futures = [pool.submit(_timed_update, agent, self._deferred, agent_calls)
+                       for agent, agent_calls in zip(agents, calls)]
+            wait(futures)
+        finally:
+            self._deferred = self.clock._deferred = None
+            post = self.mail_queue.append
+            for agent in agents:
+                agent._post = post
+
+        stats, tracer = self._stats, self.tracer
+        for outbox, agent_calls in zip(outboxes, calls):
+            self.mail_queue.extend(outbox)
+            for method, args in agent_calls:
+                method(*args)
+        for agent, future in zip(agents, futures):
+            started, ended = future.result()  # raises the exception of a failed update.
+            uuid = agent.uuid
+            if stats is not None:
+                stats.update_time[uuid] += ended - started
+                stats.updates[uuid] += 1
+            if tracer is not None:
+                tracer.update(uuid, started, ended)
+            if agent.keep_awake:
+                self.has_keep_awake[uuid] = True
+            elif uuid in self.has_keep_awake:
+                del self.has_keep_awake[uuid]
+
+    def _traced_release_alarm_messages(self):
+        """ releases the alarms and records a span if any were released. """
+        started = time.perf_counter()
+        queued = len(self.mail_queue)
+        self.clock.release_alarm_messages()
+        released = len(self.mail_queue) - queued
+        if released:
+            self.tracer.alarms(released, started, time.perf_counter())
 
     def process_mail_queue(self):
         """
         distributes the mail, so that when the scheduler pauses, new users
         can debug the agents starting with their fresh state with new messages.
         """
-        for msg in self.mail_queue:
-            assert isinstance(msg, AgentMessage)
-            recipients = self.mailing_lists.get_mail_recipients(message=msg)
+        if self._ingress:
+            self._take_ingress()
+        if self.mail_log is not None:
+            self.mail_log.delivery(self.clock.time, self.mail_queue)
+        self.deliver_mail()
+
+    def deliver_mail(self):
+        """ routes the messages in the mail queue to their recipients and empties the queue.
+        Messages posted meanwhile stay in the ingress until the next iteration.
+        """
+        stats = self._stats
+        tracer = self.tracer
+        if tracer is not None:
+            started = time.perf_counter()
+        route = self.mailing_lists.get_mail_recipients if self.checked else self.mailing_lists.route
+        mail = self.mail_queue
+        if self.priority_mail and len(mail) > 1:
+            mail = sorted(mail, key=_priority)  # stable, so equal priorities keep the order sent.
+        for msg in mail:
+            if stats is not None:
+                stats.messages_out[msg.sender] += 1
+            recipients = route(msg)
             if recipients:
                 self.send_to_recipients(msg=msg, recipients=recipients)
+                if stats is not None:
+                    stats.delivered(msg, recipients, self.agents, self.members)
+        if tracer is not None and self.mail_queue:
+            tracer.delivery(len(self.mail_queue), started, time.perf_counter())
         self.mail_queue.clear()
 
     def send_to_recipients(self, msg, recipients):
@@ -852,19 +2261,160 @@ class Scheduler(object):
         :param msg: an instance of AgentMessage
         :param recipients: The registered recipients
         """
+        if isinstance(msg, FrozenMessage):  # immutable, so everyone gets the same instance.
+            for uuid in recipients:
+                agent = self.agents.get(uuid, None)
+                if agent is None:
+                    uuid = self.members.get(uuid, None)
+                    if uuid is None:
+                        continue
+                    agent = self.agents[uuid]
+                self.needs_update[uuid] = True
+                inbox = agent._inbox
+                if inbox is None:
+                    inbox = agent._inbox = agent._new_inbox()
+                inbox.append(msg)
+            return
+
+        stats = self._stats
         for uuid in recipients:  # this loop is necessary as a tracker may be on the receiver.
             agent = self.agents.get(uuid, None)
-            if agent is None:
-                continue
-            self.needs_update[uuid] = True
+            if agent is None:  # a member gets its mail through the agent it belongs to.
+                owner = self.members.get(uuid, None)
+                if owner is None:
+                    continue
+                agent = self.agents[owner]
+                self.needs_update[owner] = True
+            else:
+                self.needs_update[uuid] = True
+            inbox = agent._inbox
+            if inbox is None:  # the inbox is allocated when the first message arrives.
+                inbox = agent._inbox = agent._new_inbox()
             if msg.receiver == uuid:
-                agent.inbox.append(msg)  # original message
+                inbox.append(msg)  # original message
             else:
                 msg_copy = msg.copy()
-                agent.inbox.append(msg_copy)
+                inbox.append(msg_copy)
+                if stats is not None:
+                    stats.copies += 1
+
+    def _idle(self, limit=None, next_alarm=None):
+        """ waits until the next alarm, the limit or wake(), unless there is work to do.
+        :param limit: the time at which run stops (optional).
+        :param next_alarm: the next wakeup time of alarms that the clock doesn't know about (optional).
+        """
+        if self._quit or self.needs_update or self.has_keep_awake:
+            return
+        timeout = self._idle_timeout(limit, next_alarm)
+        if timeout is None or timeout > 0:
+            if self.tracer is None:
+                self._wakeup.wait(timeout)
+            else:
+                started = time.perf_counter()
+                self._wakeup.wait(timeout)
+                self.tracer.idle(started, time.perf_counter())
+        self._wakeup.clear()
+
+    def _idle_timeout(self, limit=None, next_alarm=None):
+        """ returns the seconds that an idle scheduler may wait, or None to wait until wake().
+        See _idle for the parameters.
+        """
+        if self._periods:
+            if self.next_counted_wakeup() is not None:
+                return 0  # agents that wake every few iterations need the iterations to go on.
+            wakeup = self.next_periodic_wakeup()
+            if wakeup is not None and (next_alarm is None or wakeup < next_alarm):
+                next_alarm = wakeup
+        return self.clock.idle_timeout(limit, next_alarm)
+
+    def post(self, msg):
+        """ puts a message in the mail queue from outside the scheduler, for example
+        from a thread that reads a socket. Safe to call from other threads, also
+        while the scheduler runs: the message is delivered in the next iteration,
+        and an idle scheduler is woken up.
+        :param msg: AgentMessage
+        """
+        if self.checked:
+            assert isinstance(msg, AgentMessage)
+        self._ingress.append(msg)
+        self.wake()
+
+    def _take_ingress(self):
+        """ moves the posted messages to the mail queue. Other threads may post meanwhile. """
+        ingress, mail_queue = self._ingress, self.mail_queue
+        if self.mail_log is None:
+            for _ in range(len(ingress)):
+                mail_queue.append(ingress.popleft())
+            return
+        posted = [ingress.popleft() for _ in range(len(ingress))]
+        mail_queue.extend(posted)
+        self.mail_log.inject(posted)
+
+    def offload(self, receiver, function, args=(), kwargs=None, topic=None):
+        """ runs function(*args, **kwargs) in the process pool and posts the result to receiver.
+        See Agent.offload.
+        :return: int, the number of the job.
+        """
+        if self._deferred is not None:
+            raise SchedulerException("offload can't be used in the update of an io_bound agent.")
+        job = next(self._jobs)
+        if self.mail_log is not None and self.mail_log.replaying:
+            return job  # the result was logged as a posted message, and is replayed as such.
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.processes)
+        self._offloads[job] = receiver
+        future = self._process_pool.submit(function, *args, **(kwargs or {}))
+        future.add_done_callback(partial(self._offload_done, receiver, job, topic))
+        return job
+
+    def _offload_done(self, receiver, job, topic, future):
+        """ posts the result of an offloaded computation. Called by a thread of the process pool. """
+        try:
+            msg = OffloadResult(receiver, job, result=future.result(), topic=topic)
+        except BaseException as e:  # the function raised, or the pool broke or was shut down.
+            msg = OffloadResult(receiver, job, error=e, topic=topic)
+        self._ingress.append(msg)
+        del self._offloads[job]  # after the message is posted, so run doesn't stop in between.
+        self.wake()
+
+    def close(self):
+        """ shuts the process pool of Agent.offload down, after the pending computations. Their
+        results are delivered by the next run. The pool is started again by the next offload.
+        """
+        pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def wake(self):
+        """ ends the wait of an idle scheduler, so that the next iteration starts at once.
+        Safe to call from other threads.
+        """
+        self._wakeup.set()
 
     def pause(self):
         self._quit = True
+        self.wake()
+
+    def enable_stats(self, enabled=True):
+        """ switches the collection of runtime statistics on or off.
+        :param enabled: bool. Switching stats on resets the statistics, switching off discards them.
+        """
+        self._stats = SchedulerStats() if enabled else None
+
+    def stats(self):
+        """ Returns the runtime statistics collected since the stats were enabled:
+
+            {"iterations": int, "run_time": float, "iterations_per_second": float,
+             "copies": int,  # number of msg.copy() calls.
+             "topics": {topic: deliveries},
+             "agents": {uuid: {"updates": int, "update_time": float, "messages_in": int, "messages_out": int}}}
+
+        The agents are sorted by update_time, so the agents that use the most CPU come first.
+        Times are wall time in seconds.
+        """
+        if self._stats is None:
+            raise SchedulerException("stats are not enabled. Use Scheduler(stats=True) or Scheduler.enable_stats()")
+        return self._stats.report()
 
     def subscribe(self, subscriber=None, sender=None, receiver=None, topic=None):
         """ subscribe lets the Agent react to SubscribeMessage and adds the subscriber.
@@ -885,6 +2435,8 @@ class Scheduler(object):
 
         Any agent may subscribe for the same topic many times (this is idempotent)
         """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.subscribe, (subscriber, sender, receiver, topic)))
         if subscriber not in self.agents:
             raise ValueError(f"subscriber {subscriber} unknown")
         if topic in self.agents:
@@ -892,22 +2444,34 @@ class Scheduler(object):
 
         if sender and receiver and topic:
             raise ValueError("A maximum of two of sender, receiver, topic can be specified.")
-        elif sender and receiver:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs from {sender} to {receiver} on all topics")
-        elif sender and topic:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs from {sender} on topic {topic} to all agents")
-        elif receiver and topic:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs to {receiver} on topic {topic} from all agents")
-        elif sender:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs from {sender} to all agents on all topics")
-        elif receiver:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs to {receiver} from all agents on all topics")
-        elif topic:
-            self.log(level=DEBUG, msg=f"{subscriber} subscribing to msgs on topic {topic} from all agents to all agents")
-        else:
+        elif not (sender or receiver or topic):
             raise ValueError(f"invalid subscription attempt, set a maximum of 2 of sender, receiver or topic.")
+        if self.event_sink is not None:
+            self.event_sink.emit("subscribe", (subscriber, sender, receiver, topic))
         self.mailing_lists.subscribe(subscriber=subscriber, sender=sender, topic=topic, receiver=receiver)
 
+    def subscribe_many(self, subscriptions):
+        """ subscribes in bulk, with the checks of subscribe but a single pass over the mailing lists.
+        :param subscriptions: iterable of (subscriber, sender, receiver, topic), with None for 'any'.
+        """
+        subscriptions = list(subscriptions)
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.subscribe_many, (subscriptions,)))
+        agents, event_sink = self.agents, self.event_sink
+        for subscriber, sender, receiver, topic in subscriptions:
+            if subscriber not in agents:
+                raise ValueError(f"subscriber {subscriber} unknown")
+            if topic in agents:
+                raise ValueError(f"{topic} is also id of a registered agent: {agents[topic]}")
+            if sender and receiver and topic:
+                raise ValueError("A maximum of two of sender, receiver, topic can be specified.")
+            elif not (sender or receiver or topic):
+                raise ValueError("invalid subscription attempt, set a maximum of 2 of sender, receiver or topic.")
+        if event_sink is not None:
+            for subscription in subscriptions:
+                event_sink.emit("subscribe", subscription)
+        self.mailing_lists.subscribe_many(subscriptions)
+
     def unsubscribe(self, subscriber, sender=None, receiver=None, topic=None, everything=False):
         """ unsubscribes a subscriber from messages.
         :param subscriber: the agent uuid listening to messages
@@ -915,6 +2479,13 @@ class Scheduler(object):
         :param receiver: the agent receiving messages
         :param topic: the topic received by the receiver
         """
+        if self._deferred is not None:
+            return self._deferred.calls.append((self.unsubscribe, (subscriber, sender, receiver, topic, everything)))
+        if self.event_sink is not None:
+            if everything:
+                self.event_sink.emit("unsubscribe_all", (subscriber,))
+            else:
+                self.event_sink.emit("unsubscribe", (subscriber, sender, receiver, topic))
         self.mailing_lists.unsubscribe(subscriber, sender, receiver, topic, everything=everything)
 
     def get_subscriber_list(self, sender=None, receiver=None, topic=None):
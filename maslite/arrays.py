@@ -0,0 +1,137 @@
+"""
+Populations of identical agents, with their state in NumPy arrays. Requires numpy.
+
+    >>> import numpy as np
+    >>> from maslite import Scheduler
+    >>> from maslite.arrays import AgentArray
+    >>> class Sensors(AgentArray):
+    ...     columns = {"reading": "f8", "alarms": "i4"}
+    ...
+    ...     def update(self):
+    ...         messages = self.receive_all()
+    ...         rows = self.rows_of(messages)                  # the row of the receiver of every message.
+    ...         np.add.at(self.reading, rows[rows >= 0], 1.0)  # one vectorised step for the population.
+    ...
+    >>> s = Scheduler()
+    >>> sensors = Sensors(size=100_000)
+    >>> s.add(sensors)
+
+An AgentArray is a single Agent for the Scheduler: it's updated once per
+iteration when any of its members has mail (or every iteration with
+keep_awake), instead of once per member. Each member has its own uuid and a row
+in the columns, so other agents send messages to members as they would to any
+other agent, and the members send messages with their own uuid as the sender:
+
+    >>> self.send(Reading(sender=int(self.uuids[row]), receiver=hub))
+
+The mail for the members arrives in the inbox of the array, addressed to the
+member. `rows_of` maps the messages to rows, so the update can work on whole
+columns. Subscriptions are made by the array itself, for the whole population.
+
+The columns are attributes of the array, `self.reading` above, and are replaced
+by new arrays when members are added or removed, so don't keep references to
+them between updates.
+"""
+import numpy as np
+
+from maslite import Agent
+
+
+class AgentArray(Agent):
+    """ A population of agents with the same behaviour, updated together. See the module docstring. """
+
+    has_members = True
+    columns = {}  # name: numpy dtype of the column that holds the state of the members.
+
+    def __init__(self, size=0, uuid=None, **values):
+        """
+        :param size: int, the number of members to start with.
+        :param uuid: None (default). Should only be set for inspection purposes.
+        :param values: column name: initial value (scalar or array of size). Other columns start at zero.
+        """
+        super().__init__(uuid)
+        self.uuids = np.empty(0, dtype=np.int64)  # the uuid of the member in each row.
+        self.rows = {}  # member uuid: row.
+        for name, dtype in self.columns.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        if size:
+            self.add_members(size, **values)
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def member_uuids(self):
+        return self.rows.keys()
+
+    def add_members(self, size=None, uuids=None, **values):
+        """ adds members at the end of the columns.
+        :param size: int, the number of members, which get new uuids.
+        :param uuids: optional, instead of size: iterable of int uuids for the new members.
+        :param values: column name: initial value (scalar or array). Other columns start at zero.
+        :return: numpy array with the uuids of the new members.
+        """
+        if uuids is None:
+            if not isinstance(size, int) or size < 0:
+                raise ValueError("size must be a positive integer.")
+            uuids = np.fromiter((next(Agent.uuid_counter) for _ in range(size)), dtype=np.int64, count=size)
+        else:
+            uuids = np.asarray(list(uuids), dtype=np.int64)
+            size = len(uuids)
+        unknown = set(values) - set(self.columns)
+        if unknown:
+            raise ValueError(f"{self.__class__.__name__} has no columns {sorted(unknown)}")
+
+        first = len(self.uuids)
+        new_rows = dict(zip(uuids.tolist(), range(first, first + size)))
+        if len(new_rows) != size or any(uuid in self.rows for uuid in new_rows):
+            raise ValueError("member uuids must be unique.")
+        scheduler = self._scheduler_api
+        if scheduler is not None:
+            scheduler.add_members(self, new_rows)
+
+        self.rows.update(new_rows)
+        self.uuids = np.concatenate((self.uuids, uuids))
+        for name, dtype in self.columns.items():
+            column = np.zeros(size, dtype=dtype)
+            if name in values:
+                column[:] = values[name]
+            setattr(self, name, np.concatenate((getattr(self, name), column)))
+        return uuids
+
+    def remove_members(self, uuids):
+        """ removes members. The remaining members keep their order, but not their rows.
+        :param uuids: iterable of member uuids. Unknown uuids are ignored.
+        :return: int, the number of members removed.
+        """
+        rows = [self.rows[uuid] for uuid in uuids if uuid in self.rows]
+        if not rows:
+            return 0
+        keep = np.ones(len(self.uuids), dtype=bool)
+        keep[rows] = False
+        removed = self.uuids[~keep].tolist()
+        scheduler = self._scheduler_api
+        if scheduler is not None:
+            scheduler.remove_members(removed)
+
+        self.uuids = self.uuids[keep]
+        self.rows = dict(zip(self.uuids.tolist(), range(len(self.uuids))))
+        for name in self.columns:
+            setattr(self, name, getattr(self, name)[keep])
+        return len(removed)
+
+    def rows_of(self, messages, attribute="receiver"):
+        """ returns the rows of the members that the messages are for.
+        :param messages: list of AgentMessages, for example from receive_all().
+        :param attribute: "receiver" (default) or "sender".
+        :return: numpy array of int with the row of every message, -1 where it isn't a member.
+        """
+        rows = self.rows
+        return np.fromiter((rows.get(getattr(msg, attribute), -1) for msg in messages),
+                           dtype=np.intp, count=len(messages))
+
+    def update(self):
+        """ the vectorised update of all members, which subclasses must implement: it's called
+        once per iteration when any member has mail, with the mail of all members in the inbox.
+        See rows_of.
+        """
+        raise NotImplementedError("derived classes must implement a update method")
@@ -0,0 +1,154 @@
+"""
+asyncio execution of the Scheduler.
+
+The AsyncScheduler runs the update loop of `Scheduler.run` on an asyncio event
+loop, so that agents can define `async def update(self)` and await databases,
+HTTP services and other I/O without stalling the other agents:
+
+    >>> s = AsyncScheduler()
+    >>> s.add(agent)
+    >>> await s.run(pause_if_idle=True)   # or asyncio.run(s.run(...))
+
+Every iteration is the same as in `Scheduler.run`:
+
+1. the agents that need an update are updated. Agents with a regular `update`
+   are updated first, one at a time, in the usual order. The coroutines of the
+   agents with `async def update` then run concurrently on the event loop until
+   all of them have finished.
+2. the clock ticks and releases the alarms that are due.
+3. the messages sent during the iteration are delivered.
+
+So messages sent during an iteration are only delivered once every update of
+that iteration has finished, exactly as with the Scheduler. The order in which
+concurrent updates send their messages is the order in which they reach their
+`send` calls, which depends on the I/O they wait for.
+
+When there is nothing to do, the scheduler waits for the next alarm without
+blocking the event loop, and `post()`, `wake()` and `pause()` can be called
+from other threads and from other tasks.
+"""
+import time
+import asyncio
+from inspect import isawaitable
+
+from maslite import Scheduler
+
+
+class AsyncScheduler(Scheduler):
+    """ A Scheduler whose `run` is a coroutine that awaits `async def update` of the agents. """
+    awaits_updates = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._event_loop = None
+        self._async_wakeup = None
+
+    async def run(self, seconds=None, iterations=None, pause_if_idle=True, clear_alarms_at_end=True):
+        """ The main 'run' operation of the AsyncScheduler. See Scheduler.run for the parameters. """
+        seconds, start_time, iterations_to_halt = self._start_run(seconds, iterations, pause_if_idle,
+                                                                  clear_alarms_at_end)
+        stats = self._stats
+        if stats is not None:
+            run_started = time.perf_counter()
+        tracer = self.tracer
+        iteration = 0
+
+        self._event_loop = asyncio.get_running_loop()
+        self._async_wakeup = asyncio.Event()
+        self._quit = False
+        try:
+            while not self._quit:
+                if tracer is not None:
+                    iteration += 1
+                    iteration_started = time.perf_counter()
+                self.iteration += 1
+                if self._periods:
+                    self._wake_periodic()
+                await self.update_agents()
+
+                iterations_to_halt, idle = self._end_iteration(seconds, start_time, iterations_to_halt,
+                                                               pause_if_idle)
+                if idle:
+                    await self._idle_async(limit=seconds)
+
+                if stats is not None:
+                    stats.iterations += 1
+                if tracer is not None:
+                    tracer.iteration(iteration, iteration_started, time.perf_counter())
+        finally:
+            self._event_loop = None
+            self._async_wakeup = None
+
+        if stats is not None:
+            stats.run_time += time.perf_counter() - run_started
+        self._end_run(clear_alarms_at_end)
+
+    async def update_agents(self):
+        """ updates the agents that need an update: the regular agents one at a time,
+        then the coroutines of the async agents concurrently.
+        """
+        stats, tracer = self._stats, self.tracer
+        self.needs_update.update(self.has_keep_awake)
+        updating = list(self.needs_update)  # agents added by the coroutines are updated in the next iteration.
+        pending = []
+        for uuid in updating:
+            agent = self.agents[uuid]
+            if stats is None and tracer is None:
+                result = agent.update()
+                if isawaitable(result):
+                    pending.append(result)
+            else:
+                started = time.perf_counter()
+                result = agent.update()
+                if isawaitable(result):
+                    pending.append(self._timed(uuid, result, started))
+                else:
+                    ended = time.perf_counter()
+                    if stats is not None:
+                        stats.update_time[uuid] += ended - started
+                    if tracer is not None:
+                        tracer.update(uuid, started, ended)
+                if stats is not None:
+                    stats.updates[uuid] += 1
+        if pending:
+            await asyncio.gather(*pending)
+
+        for uuid in updating:
+            self.needs_update.pop(uuid, None)
+            agent = self.agents.get(uuid, None)
+            if agent is not None and agent.keep_awake:
+                self.has_keep_awake[uuid] = True
+            elif uuid in self.has_keep_awake:
+                del self.has_keep_awake[uuid]
+
+    async def _timed(self, uuid, awaitable, started):
+        """ awaits the update of an agent and adds its wall time to the stats and the trace. """
+        await awaitable
+        ended = time.perf_counter()
+        if self._stats is not None:
+            self._stats.update_time[uuid] += ended - started
+        if self.tracer is not None:
+            self.tracer.update(uuid, started, ended)
+
+    async def _idle_async(self, limit=None):
+        """ waits like Scheduler._idle, but without blocking the event loop. """
+        if self._quit or self.needs_update or self.has_keep_awake:
+            return
+        timeout = self._idle_timeout(limit)
+        if timeout is None or timeout > 0:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self.tracer is not None:
+                self.tracer.idle(started, time.perf_counter())
+        self._async_wakeup.clear()
+        self._wakeup.clear()
+
+    def wake(self):
+        """ ends the wait of an idle scheduler. Safe to call from other threads. """
+        super().wake()
+        loop, event = self._event_loop, self._async_wakeup
+        if loop is not None and event is not None:
+            loop.call_soon_threadsafe(event.set)
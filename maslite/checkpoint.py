@@ -0,0 +1,168 @@
+"""
+Checkpoints of the Scheduler.
+
+    >>> from maslite.checkpoint import save, restore
+    >>> s.run(seconds=3600)
+    >>> save(s, "model.checkpoint")
+    ...
+    >>> s = restore("model.checkpoint")
+    >>> s.run(seconds=3600)
+
+A checkpoint holds everything the scheduler knows: the agents (with their
+inboxes), the mail queue, the messages posted with `post()`, which agents
+need an update, are kept awake or wake periodically, the members of AgentArrays,
+the clock's time and alarms and the subscriptions of the MailingList. Agents aren't set up again when they are
+restored, so `setup` isn't called twice.
+
+The file is a header followed by a stream of pickles: the agents are written in
+chunks, so the memory used while saving or restoring a large population stays
+small, and the file is replaced atomically when it is complete, so a crash
+whilst saving leaves the previous checkpoint intact.
+
+Limitations:
+- save between runs (or after an agent has paused the scheduler), not from
+  within `update`.
+- agents and messages must be pickleable.
+- with a RealTimeClock the alarms keep their wall clock time, so alarms that
+  became due whilst the model wasn't running are released as soon as it runs.
+"""
+import os
+import pickle
+from itertools import count
+
+from maslite import Agent, Scheduler, MailingList, AlarmRegistry, SchedulerException, RealTimeClock, DiscreteEventClock
+from maslite import SequencedAlarmStore, _gc_paused
+
+MAGIC = b"MASLITE-CHECKPOINT 1\n"
+
+
+def save(scheduler, path, chunk_size=10_000):
+    """ writes a checkpoint of the scheduler.
+    :param scheduler: Scheduler
+    :param path: file name.
+    :param chunk_size: int, number of agents per pickle.
+    :return: number of bytes written.
+    """
+    if not isinstance(scheduler, Scheduler):
+        raise TypeError(f"expected Scheduler, not {type(scheduler)}")
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    clock = scheduler.clock
+    header = {
+        "real_time": isinstance(clock, RealTimeClock),
+        "discrete_events": isinstance(clock, DiscreteEventClock),
+        "checked": scheduler.checked,
+        "time": clock.time,
+        "last_required_alarm": clock.last_required_alarm,
+        "agents": len(scheduler.agents),
+        "cache_size": scheduler.mailing_lists.cache_size,
+    }
+    state = {
+        "mail_queue": list(scheduler.mail_queue) + list(scheduler._ingress),
+        "needs_update": list(scheduler.needs_update),
+        "has_keep_awake": list(scheduler.has_keep_awake),
+        "pending_setup": [agent.uuid for agent in scheduler._pending_setup],
+        "members": dict(scheduler.members),
+        "iteration": scheduler.iteration,
+        "periods": dict(scheduler._periods),
+        "timed_wakeups": list(scheduler._timed_wakeups),
+        "counted_wakeups": list(scheduler._counted_wakeups),
+        "directory": dict(scheduler.mailing_lists.directory),
+        "subscriptions": dict(scheduler.mailing_lists.subscriptions),
+        "registries": {receiver: dict(registry.alarms) for receiver, registry in clock.registry.items() if registry.alarms},
+        "alarms": [(wakeup_time, list(bucket)) for wakeup_time, bucket in clock.alarms.items()],
+    }
+    if isinstance(clock.alarms, SequencedAlarmStore):
+        state["alarm_sequences"] = clock.alarms.sequences()
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb", buffering=1 << 20) as f:
+        f.write(MAGIC)
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        agents = list(scheduler.agents.values())
+        with _gc_paused():  # the state of every agent is a new dict.
+            for start in range(0, len(agents), chunk_size):
+                pickle.dump(agents[start:start + chunk_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    os.replace(temporary, path)
+    return size
+
+
+def restore(path, scheduler=None):
+    """ restores a checkpoint.
+    :param path: file name.
+    :param scheduler: optional: an empty Scheduler (for example with a logger or an event sink).
+    If None, a Scheduler with the clock of the checkpoint is created.
+    :return: the Scheduler.
+    """
+    with open(path, "rb", buffering=1 << 20) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SchedulerException(f"{path} isn't a maslite checkpoint.")
+        header = pickle.load(f)
+        if scheduler is None:
+            scheduler = Scheduler(real_time=header["real_time"], checked=header["checked"],
+                                  discrete_events=header.get("discrete_events", False))
+        elif scheduler.agents or scheduler.mail_queue:
+            raise SchedulerException("checkpoints can only be restored into an empty scheduler.")
+        elif isinstance(scheduler.clock, RealTimeClock) != header["real_time"]:
+            raise SchedulerException("the clock of the scheduler doesn't match the clock of the checkpoint.")
+
+        agents = scheduler.agents
+        with _gc_paused():
+            while len(agents) < header["agents"]:
+                for agent in pickle.load(f):
+                    agents[agent.uuid] = agent
+                    scheduler._attach(agent)
+            state = pickle.load(f)
+
+    scheduler.mail_queue.extend(state["mail_queue"])
+    scheduler.needs_update.update((uuid, True) for uuid in state["needs_update"])
+    scheduler.has_keep_awake.update((uuid, True) for uuid in state["has_keep_awake"])
+    scheduler.members.update(state.get("members", {}))
+    scheduler._pending_setup.extend(agents[uuid] for uuid in state.get("pending_setup", ()))
+    scheduler.iteration = state.get("iteration", 0)
+    scheduler._periods.update(state.get("periods", {}))
+    scheduler._timed_wakeups.extend(state.get("timed_wakeups", ()))  # a list that was a heap is a heap.
+    scheduler._counted_wakeups.extend(state.get("counted_wakeups", ()))
+    sequences = [sequence for _, _, sequence in scheduler._periods.values()]
+    if sequences:
+        scheduler._wakeup_sequence = count(max(sequences) + 1)
+
+    mailing_lists = MailingList(cache_size=header["cache_size"])
+    mailing_lists.directory.update(state["directory"])
+    mailing_lists.subscriptions.update(state["subscriptions"])
+    for sender, receiver_dict in mailing_lists.directory.items():
+        for receiver in receiver_dict:
+            mailing_lists._senders_of[receiver][sender] = True
+    scheduler.mailing_lists = mailing_lists
+
+    clock = scheduler.clock
+    if not header["real_time"]:
+        clock._time = header["time"]
+    clock.last_required_alarm = header["last_required_alarm"]
+    for receiver, alarms in state["registries"].items():
+        registry = clock.registry[receiver] = AlarmRegistry(receiver)
+        registry.alarms.update(alarms)
+    if not isinstance(clock.alarms, SequencedAlarmStore):
+        for wakeup_time, receivers in state["alarms"]:
+            for receiver in receivers:
+                clock.alarms.set_alarm(wakeup_time, clock.registry[receiver])
+    elif "alarm_sequences" in state:
+        for wakeup_time, messages in state["alarm_sequences"]:
+            for msg in messages:
+                clock.alarms.set_alarm(wakeup_time, clock.registry[msg.receiver], msg)
+    else:  # a checkpoint of a SimulationClock, which releases the alarms by receiver.
+        for wakeup_time, receivers in state["alarms"]:
+            for receiver in receivers:
+                registry = clock.registry[receiver]
+                for msg in registry.alarms[wakeup_time]:
+                    clock.alarms.set_alarm(wakeup_time, registry, msg)
+
+    # new agents mustn't reuse the uuids of the restored agents and members.
+    numbers = [uuid for uuid in agents if isinstance(uuid, int)]
+    numbers.extend(uuid for uuid in scheduler.members if isinstance(uuid, int))
+    if numbers:
+        next_uuid = next(Agent.uuid_counter)
+        Agent.uuid_counter = count(max(next_uuid, max(numbers) + 1))
+    return scheduler
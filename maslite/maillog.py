@@ -0,0 +1,277 @@
+"""
+A write-ahead log of the mail of a Scheduler, for recovery and replay.
+
+    >>> from maslite.maillog import MailLog, replay
+    >>> s = build_model()
+    >>> s.mail_log = MailLog("run.maillog")   # or Scheduler(mail_log=MailLog(...))
+    >>> s.run()
+
+The log records, before they are delivered, the messages that the scheduler
+routes, the messages posted with `post()` and the clock's time of every
+iteration. Replaying the log re-runs the same iterations, with the same clock
+and the same posted messages, on a model that has been built the same way:
+
+    >>> s = build_model()                    # the same agents with the same uuids.
+    >>> replay(s, "run.maillog")             # raises SchedulerException if the model diverges.
+    >>> s.mail_log = MailLog("run-2.maillog")
+    >>> s.run()                              # carries on where the logged run stopped.
+
+So a crashed real-time run can be recovered, and any run can be replayed
+offline, for example in a debugger. To replay from a checkpoint instead of from
+scratch, start a new log whenever a checkpoint is saved (see maslite.checkpoint).
+
+The records are pickled as they are written, so the log holds the messages as
+they were routed, even if the recipients change them later. Writes go through a
+buffer of `buffer_size` bytes and the log is flushed at the end of every run,
+so a crash loses at most the buffer. A truncated last record is ignored.
+
+Limitations:
+- a replay is only identical if the agents depend on nothing but their messages
+  and the scheduler's clock: no wall clock time, unseeded random numbers or I/O.
+- messages must be pickleable, and they can't refer to themselves when the
+  replay is verified.
+- the ShardedScheduler can't log with more than one shard.
+- the results of Agent.offload are logged as posted messages. The computations
+  aren't run again in a replay, the logged results are delivered instead.
+"""
+import io
+import os
+import pickle
+from collections import deque
+
+from maslite import Clock, RealTimeClock, SchedulerException
+
+MAGIC = b"MASLITE-MAILLOG 1\n"
+ITERATION = "iteration"  # (ITERATION, time, posted messages, mail queue): an iteration of Scheduler.run
+DELIVERY = "delivery"  # (DELIVERY, time, posted messages, mail queue): Scheduler.process_mail_queue
+END = "end"  # (END, clear_alarms_at_end): the end of Scheduler.run
+
+
+class MailLog(object):
+    """ Records the mail of a Scheduler in a file. See the module docstring. """
+
+    __slots__ = ('path', 'fsync', 'records', '_file', '_pickler', '_posted')
+    replaying = False
+
+    def __init__(self, path, buffer_size=1 << 20, fsync=False):
+        """
+        :param path: file name. An existing file is replaced.
+        :param buffer_size: int, bytes that are buffered before they are written.
+        :param fsync: bool, if True every flush waits until the data is on disk.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.records = 0
+        self._file = open(path, "wb", buffering=buffer_size)
+        self._file.write(MAGIC)
+        self._pickler = pickle.Pickler(self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._posted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def inject(self, messages):
+        """ called by the Scheduler with the messages that are moved from post() to the mail queue. """
+        self._posted.extend(messages)
+
+    def iteration(self, time, mail_queue):
+        """ called by the Scheduler in every iteration of run, before the mail is delivered.
+        :param time: the clock's time.
+        :param mail_queue: the messages that are about to be delivered.
+        """
+        self._write(ITERATION, time, mail_queue)
+
+    def delivery(self, time, mail_queue):
+        """ called by Scheduler.process_mail_queue, before the mail is delivered.
+        :param time: the clock's time.
+        :param mail_queue: the messages that are about to be delivered.
+        """
+        self._write(DELIVERY, time, mail_queue)
+
+    def _write(self, kind, time, mail_queue):
+        self._pickler.dump((kind, time, tuple(self._posted), tuple(mail_queue)))
+        self._pickler.clear_memo()  # every record can be read on its own, and the memo doesn't keep the messages alive.
+        self._posted.clear()
+        self.records += 1
+
+    def finished(self, clear_alarms):
+        """ called by the Scheduler at the end of run.
+        :param clear_alarms: the clear_alarms_at_end parameter of the run.
+        """
+        self._pickler.dump((END, clear_alarms))
+        self._pickler.clear_memo()
+        self.records += 1
+        self.flush()
+
+    def flush(self):
+        """ writes the buffer to the file. """
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def records(path):
+    """ reads a mail log.
+    :param path: file name.
+    :return: generator of the records: (ITERATION or DELIVERY, time, posted, mail) and (END, clear_alarms_at_end).
+    """
+    with open(path, "rb", buffering=1 << 20) as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SchedulerException(f"{path} isn't a maslite mail log.")
+        while True:
+            try:
+                yield pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):  # the end, or a record that was cut off by a crash.
+                return
+
+
+def _fingerprint(messages):
+    """ returns the messages pickled without the memo, so that the bytes don't depend on
+    which of the attribute values are the same object. """
+    f = io.BytesIO()
+    pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.fast = True
+    pickler.dump(tuple(messages))
+    return f.getvalue()
+
+
+def _is_kind(record, kind):
+    return record is not None and record[0] == kind
+
+
+class ReplayClock(Clock):
+    """ A clock that plays back the times of a mail log. It shares the alarms of the clock it replaces. """
+
+    def __init__(self, scheduler_api, replay):
+        super().__init__(scheduler_api)
+        clock = scheduler_api.clock
+        self.checked = clock.checked
+        self._time = clock.time
+        self.registry = clock.registry
+        self.alarms = clock.alarms
+        self.last_required_alarm = clock.last_required_alarm
+        self.replay = replay
+
+    def tick(self, limit=None):
+        self._time = self.replay.tick()
+
+
+class _Replay(object):
+    """ Takes the place of the MailLog during a replay: it feeds the ReplayClock and
+    the posted messages to the scheduler and compares the mail with the log. """
+
+    replaying = True  # the results of Agent.offload come from the log, see Scheduler.offload.
+
+    def __init__(self, scheduler, path, verify):
+        self.scheduler = scheduler
+        self.path = path
+        self.verify = verify
+        self.iterations = 0
+        self._records = records(path)
+        self._ahead = deque()
+        self._current = None
+
+    def peek(self, index=0):
+        while len(self._ahead) <= index:
+            record = next(self._records, None)
+            if record is None:
+                return None
+            self._ahead.append(record)
+        return self._ahead[index]
+
+    def take(self):
+        record = self.peek()
+        if record is not None:
+            self._ahead.popleft()
+        return record
+
+    def starts_run(self):
+        """ True if the next records are the start of Scheduler.run, False if they are a call of process_mail_queue. """
+        return _is_kind(self.peek(), DELIVERY) and _is_kind(self.peek(1), ITERATION)
+
+    def tick(self):
+        """ called by the ReplayClock: starts the next iteration of the log. """
+        record = self.take()
+        if not _is_kind(record, ITERATION):
+            raise SchedulerException(f"the replay diverged from {self.path}: the log has no iteration {self.iterations + 1}.")
+        self._current = record
+        self.iterations += 1
+        _, time, posted, _ = record
+        self.scheduler.mail_queue.extend(posted)
+        if not _is_kind(self.peek(), ITERATION):
+            self.scheduler.pause()  # the logged run stopped after this iteration.
+        return time
+
+    def inject(self, messages):
+        pass  # messages posted during a replay aren't in the log, so the mail won't match it.
+
+    def iteration(self, time, mail_queue):
+        self._verify(mail_queue, self._current[3])
+
+    def delivery(self, time, mail_queue):
+        record = self.take()
+        if not _is_kind(record, DELIVERY):
+            raise SchedulerException(f"the replay diverged from {self.path}: the log has no call of "
+                                     f"process_mail_queue after iteration {self.iterations}.")
+        _, time, posted, logged = record
+        self.scheduler.clock._time = time
+        mail_queue.extend(posted)
+        self._verify(mail_queue, logged)
+
+    def _verify(self, mail_queue, logged):
+        if self.verify and _fingerprint(mail_queue) != _fingerprint(logged):
+            raise SchedulerException(f"the replay diverged from {self.path} in iteration {self.iterations}: "
+                                     f"{len(mail_queue)} messages were routed, the log has {len(logged)}: "
+                                     f"{[str(m) for m in mail_queue][:5]} vs {[str(m) for m in logged][:5]}")
+
+    def finished(self, clear_alarms):
+        record = self.peek()
+        if record is not None and record[0] == END:
+            self.take()
+            if record[1]:
+                self.scheduler.clock.clear_alarms()
+
+
+def _set_clock(scheduler, clock):
+    scheduler.clock = clock
+    for agent in scheduler.agents.values():
+        agent._clock = clock
+
+
+def replay(scheduler, path, verify=True):
+    """ re-runs the iterations of a mail log.
+    :param scheduler: Scheduler with the model in the state it had when the log started.
+    :param path: file name of the MailLog.
+    :param verify: bool, if True the mail of every iteration is compared with the log and
+    SchedulerException is raised when the replay diverges.
+    :return: int, the number of iterations replayed.
+
+    When the replay ends, the scheduler has its own clock back. A SimulationClock
+    continues from the last time in the log; a RealTimeClock continues from now.
+    """
+    clock, mail_log = scheduler.clock, scheduler.mail_log
+    session = _Replay(scheduler, path, verify)
+    replay_clock = ReplayClock(scheduler, session)
+    _set_clock(scheduler, replay_clock)
+    scheduler.mail_log = session
+    try:
+        while session.peek() is not None:
+            if session.starts_run():
+                scheduler.run(pause_if_idle=False, clear_alarms_at_end=False)
+            else:
+                scheduler.process_mail_queue()
+    finally:
+        clock.last_required_alarm = replay_clock.last_required_alarm
+        if not isinstance(clock, RealTimeClock):
+            clock._time = replay_clock.time
+        _set_clock(scheduler, clock)
+        scheduler.mail_log = mail_log
+    return session.iterations
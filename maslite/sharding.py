@@ -0,0 +1,780 @@
+"""
+Multi-process execution of the Scheduler.
+
+The ShardedScheduler partitions the agents over a number of worker processes
+(shards). Between runs it behaves like the regular Scheduler: agents are added,
+set up and subscribe in the parent process. When `run` is called, the agents and
+everything the scheduler knows about them are shipped to the shards, where each
+shard runs the update loop of `Scheduler.run` for its own agents. The shards
+meet at a barrier twice per iteration:
+
+1. after updating their agents, so that the parent can tick the clock for all of
+   them, and,
+2. after exchanging the messages of the iteration through shared memory ring
+   buffers, so that the parent can decide whether to stop.
+
+When the run ends, the state of the agents is shipped back and copied onto the
+agents in the parent, so that the user can inspect them as usual.
+
+Repeatability: every message, subscription, alarm and update carries an ordering
+key derived from the global update order of the single process Scheduler. Each
+shard sorts the messages of an iteration by that key before delivering them, and
+ranks its agents by it before updating them, so every agent sees the same inbox in
+the same order as it would have with `Scheduler.run`.
+
+Broadcasts: subscriptions are held by the shard of the subscriber. Messages that
+aren't direct are sent to every shard, which routes them against its local
+subscriptions, so broadcasts reach every subscriber. Direct messages are only sent
+to the shard of the receiver.
+
+Limitations:
+- agents and messages must be pickleable.
+- agents can't be added or removed whilst the ShardedScheduler is running.
+- messages posted with `post()` whilst the ShardedScheduler is running are
+  delivered when the next run starts.
+- if the same receiver has alarms set by agents on two different shards for the
+  same wakeup time, the two groups of alarm messages are delivered one after
+  the other rather than interleaved in the order they were set.
+- AgentArrays (see maslite.arrays), Agent.offload and Agent.wake_every can only
+  run with one shard.
+"""
+import os
+import pickle
+import struct
+import traceback
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from operator import itemgetter
+from math import inf
+
+from maslite import Scheduler, SimulationClock, MailingList, AlarmRegistry, SchedulerException
+
+_HEADER = struct.Struct('<QQ')  # length of the broadcast payload, length of the direct payload.
+_first = itemgetter(0)
+
+
+class RingBuffer(object):
+    """ A single producer, single consumer byte stream in shared memory.
+
+    The first 16 bytes hold the number of bytes read (head) and written (tail)
+    since the buffer was created. Only the consumer moves the head and only the
+    producer moves the tail. The counters are read and moved under a lock shared
+    by both ends, so that on CPUs with weak memory ordering (arm64) the consumer
+    can't see a new tail before the bytes that were written.
+    """
+
+    def __init__(self, name=None, capacity=1 << 20, lock=None):
+        """
+        :param name: None to create a new buffer, or the name of an existing buffer to attach to.
+        :param capacity: int, bytes.
+        :param lock: the multiprocessing.Lock of the buffer. None to create one, which is only
+        possible for a new buffer: both ends must use the same lock.
+        """
+        self.capacity = capacity
+        if name is None:
+            self.shm = SharedMemory(create=True, size=capacity + 16)
+            if lock is None:
+                lock = multiprocessing.Lock()
+        else:
+            if lock is None:
+                raise ValueError("attaching to a RingBuffer requires its lock.")
+            self.shm = SharedMemory(name=name)
+        self.lock = lock
+        self._counters = self.shm.buf[:16].cast('Q')
+        self._data = self.shm.buf[16:16 + capacity]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, data):
+        """ writes as much of data as there is room for.
+        :param data: bytes or memoryview
+        :return: number of bytes written.
+        """
+        with self.lock:
+            head, tail = self._counters[0], self._counters[1]
+        n = min(self.capacity - (tail - head), len(data))
+        if n <= 0:
+            return 0
+        position = tail % self.capacity
+        first = min(n, self.capacity - position)
+        self._data[position:position + first] = data[:first]
+        if first < n:
+            self._data[:n - first] = data[first:n]
+        with self.lock:  # publishes the bytes.
+            self._counters[1] = tail + n
+        return n
+
+    def read(self):
+        """ reads all bytes available.
+        :return: bytes
+        """
+        with self.lock:
+            head, tail = self._counters[0], self._counters[1]
+        n = tail - head
+        if n == 0:
+            return b''
+        position = head % self.capacity
+        first = min(n, self.capacity - position)
+        data = bytes(self._data[position:position + first])
+        if first < n:
+            data += bytes(self._data[:n - first])
+        with self.lock:  # frees the room.
+            self._counters[0] = head + n
+        return data
+
+    def close(self, unlink=False):
+        self._counters.release()
+        self._data.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class ShardClock(SimulationClock):
+    """ The clock of a shard. Time is set by the ShardedScheduler, so tick does nothing.
+
+    The clock keeps the ordering key of every pending alarm message, aligned with
+    the messages in the AlarmRegistry of the receiver, so that the alarms of all
+    shards can be released in the order they were set.
+    """
+
+    def __init__(self, scheduler_api):
+        super().__init__(scheduler_api)
+        self.set_keys = dict()  # (wakeup time, receiver): [ordering key of each message]
+
+    def tick(self, limit=None):
+        pass
+
+    def set_alarm(self, delay, alarm_message, ignore_alarm_if_idle):
+        super().set_alarm(delay, alarm_message, ignore_alarm_if_idle)
+        wakeup_time, receiver = self.time + delay, alarm_message.receiver
+        keys = self.set_keys.get((wakeup_time, receiver), None)
+        if keys is None:
+            # messages left in the registry by Clock.clear_alarms() are released first.
+            orphans = len(self.registry[receiver].alarms[wakeup_time]) - 1
+            keys = self.set_keys[(wakeup_time, receiver)] = [(-1, i) for i in range(orphans)]
+        keys.append(self.scheduler_api.next_key())
+
+    def clear_alarms(self, receiver=None, topic=None):
+        if receiver is None:
+            super().clear_alarms(receiver, topic)
+            self.set_keys.clear()
+            return
+        registry = self.registry.get(receiver, None)
+        if not registry:
+            return
+        for timestamp in list(registry.alarms):
+            keys = self.set_keys.get((timestamp, receiver), None)
+            if topic is None:
+                msgs = []
+            else:
+                messages = registry.alarms[timestamp]
+                kept = [i for i, msg in enumerate(messages) if msg.topic != topic]
+                msgs = [messages[i] for i in kept]
+                if keys is not None:
+                    keys[:] = [keys[i] for i in kept]
+            if msgs:
+                registry.alarms[timestamp] = msgs
+            else:
+                del registry.alarms[timestamp]
+                self.set_keys.pop((timestamp, receiver), None)
+                self.alarms.cancel(timestamp, receiver)
+
+
+class Shard(Scheduler):
+    """ The scheduler inside a worker process of the ShardedScheduler.
+
+    Ordering keys (all are tuples, compared within their kind only):
+    - update key: (round, 0, i) for agents that needed an update when the run started,
+      (round, 1, message key, category, subscription key) for agents that received mail
+      and (round, 2, keep awake key) for agents that are kept awake.
+    - message key: (round, 0, rank of sender, seq) or (round, 1, wakeup time, first alarm key, alarm key)
+      for alarms, where the first alarm key is the key of the receiver's first alarm at the wakeup time.
+    - subscription, alarm and keep awake keys: (0, i) if they were set before the run,
+      otherwise (round, rank of agent, seq).
+    The ShardedScheduler turns the update keys of all shards into global ranks every round.
+    """
+
+    def __init__(self, index, shard_of):
+        super().__init__(real_time=False)
+        self.clock = ShardClock(scheduler_api=self)
+        self.index = index
+        self.shard_of = shard_of
+        self.subscription_keys = dict()  # subscriber: {(sender, receiver, topic): key}
+        self.update_keys = dict()  # uuid: update key; shadows needs_update.
+        self.keep_awake_keys = dict()  # uuid: keep awake key; shadows has_keep_awake.
+        self.round = 0
+        self._key_prefix = (0, 0)
+        self._seq = 0
+        self._order = []
+        self._outgoing = []
+
+    def next_key(self):
+        """ returns the ordering key for an event caused by the agent that is being updated. """
+        self._seq += 1
+        return self._key_prefix + (self._seq,)
+
+    def add(self, agent):
+        raise SchedulerException("agents can't be added whilst the ShardedScheduler is running.")
+
+    def add_many(self, agents, setup=True):
+        raise SchedulerException("agents can't be added whilst the ShardedScheduler is running.")
+
+    def remove(self, agent_or_uuid):
+        raise SchedulerException("agents can't be removed whilst the ShardedScheduler is running.")
+
+    def offload(self, receiver, function, args=(), kwargs=None, topic=None):
+        raise SchedulerException("Agent.offload isn't supported with more than one shard.")
+
+    def subscribe(self, subscriber=None, sender=None, receiver=None, topic=None):
+        super().subscribe(subscriber=subscriber, sender=sender, receiver=receiver, topic=topic)
+        keys = self.subscription_keys.setdefault(subscriber, dict())
+        if (sender, receiver, topic) not in keys:
+            keys[(sender, receiver, topic)] = self.next_key()
+
+    def subscribe_many(self, subscriptions):
+        for subscriber, sender, receiver, topic in subscriptions:  # every subscription gets its ordering key.
+            self.subscribe(subscriber, sender, receiver, topic)
+
+    def unsubscribe(self, subscriber, sender=None, receiver=None, topic=None, everything=False):
+        super().unsubscribe(subscriber, sender, receiver, topic, everything=everything)
+        keys = self.subscription_keys.get(subscriber, None)
+        if keys is None:
+            return
+        if everything:
+            del self.subscription_keys[subscriber]
+        elif subscriber not in self.mailing_lists.get_subscriber_list(sender, receiver, topic):
+            keys.pop((sender, receiver, topic), None)
+
+    def install(self, state):
+        """ loads the state shipped by the ShardedScheduler.
+        :return: the update keys of the first round.
+        """
+        self._set_checked(state['checked'])
+        self.clock._time = state['time']
+        self.clock.last_required_alarm = state['last_required_alarm']
+        for agent in state['agents']:
+            self._attach(agent)
+            self.agents[agent.uuid] = agent
+
+        for key, sender, receiver, topic, subscriber in sorted(state['subscriptions'], key=_first):
+            self.mailing_lists.subscribe(subscriber=subscriber, sender=sender, receiver=receiver, topic=topic)
+            self.subscription_keys.setdefault(subscriber, dict()).setdefault((sender, receiver, topic), key)
+
+        for receiver, alarms in state['registries']:
+            registry = AlarmRegistry(receiver)
+            registry.alarms.update(alarms)
+            self.clock.registry[receiver] = registry
+        for wakeup_time, receiver, keys in sorted(state['schedule'], key=lambda row: (row[0], row[2][0])):
+            self.clock.alarms.set_alarm(wakeup_time, self.clock.registry[receiver])
+            self.clock.set_keys[(wakeup_time, receiver)] = keys
+
+        for key, uuid in state['needs_update']:
+            self.needs_update[uuid] = True
+            self.update_keys[uuid] = key
+        for key, uuid in state['has_keep_awake']:
+            self.has_keep_awake[uuid] = True
+            self.keep_awake_keys[uuid] = key
+        return self.plan()
+
+    def plan(self):
+        """ merges the agents that are kept awake into the agents that need an update
+        (like Scheduler.run does) and sorts them by their update keys.
+        :return: list of update keys.
+        """
+        entries = [(self.update_keys[uuid], uuid) for uuid in self.needs_update]
+        for uuid in self.has_keep_awake:
+            if uuid not in self.needs_update:
+                entries.append(((self.round, 2, self.keep_awake_keys[uuid]), uuid))
+        entries.sort(key=_first)
+        self._order = [uuid for _, uuid in entries]
+        return [key for key, _ in entries]
+
+    def update_agents(self, round_, ranks):
+        """ updates the agents in the order of their global ranks.
+        :return: dict with the pending mail and alarms.
+        """
+        self._quit = False
+        self.round = round_
+        outgoing = self._outgoing = []
+        mail_queue = self.mail_queue
+        for rank, uuid in zip(ranks, self._order):
+            agent = self.agents[uuid]
+            self._key_prefix, self._seq = (round_, rank), 0
+            agent.update()
+            if agent.keep_awake:
+                if uuid not in self.has_keep_awake:
+                    self.has_keep_awake[uuid] = True
+                    self.keep_awake_keys[uuid] = (round_, rank)
+            elif uuid in self.has_keep_awake:
+                del self.has_keep_awake[uuid]
+                del self.keep_awake_keys[uuid]
+            while mail_queue:
+                self._seq += 1
+                outgoing.append(((round_, 0, rank, self._seq), mail_queue.popleft()))
+        self.needs_update.clear()
+        self.update_keys.clear()
+        return {"mail": len(outgoing), "next_alarm": self.clock.alarms.next_timestamp(), "quit": self._quit}
+
+    def release_alarms(self):
+        """ releases the alarms that are due.
+        :return: list of ((None, wakeup time, receiver, key), message). The key is completed by `order`.
+        """
+        clock = self.clock
+        released = []
+        for wakeup_time, bucket in clock.alarms.pop_due(clock.time):
+            for receiver, registry in bucket.items():
+                keys = clock.set_keys.pop((wakeup_time, receiver))
+                for key, msg in zip(keys, registry.release_alarm(wakeup_time)):
+                    released.append(((None, wakeup_time, receiver, key), msg))
+        return released
+
+    def address(self, shards):
+        """ sorts the outgoing messages by destination.
+        :return: list of messages for all shards, list of lists of messages for each shard.
+        """
+        everyone, direct = [], [[] for _ in range(shards)]
+        shard_of = self.shard_of
+        for item in self._outgoing:
+            msg = item[1]
+            if msg.direct:
+                index = shard_of.get(msg.receiver, None)
+                if index is not None:
+                    direct[index].append(item)
+                    continue
+            everyone.append(item)
+        return everyone, direct
+
+    def order(self, items, alarms):
+        """ merges the messages from the agents' updates with the alarms of all shards.
+        Like the AlarmStore, the alarms are released by wakeup time, then by receiver in the
+        order of their first alarm for the wakeup time and then in the order they were set.
+        :return: list of (key, message) sorted by key.
+        """
+        first = dict()
+        for (_, wakeup_time, receiver, key), _ in alarms:
+            group = (wakeup_time, receiver)
+            if group not in first or key < first[group]:
+                first[group] = key
+        round_ = self.round
+        items.extend(((round_, 1, wakeup_time, first[(wakeup_time, receiver)], key), msg)
+                     for (_, wakeup_time, receiver, key), msg in alarms)
+        items.sort(key=_first)
+        return items
+
+    def deliver(self, items):
+        """ delivers the messages (sorted by their keys) to the local agents and
+        gives each agent that needs an update the key of its first message. """
+        round_ = self.round
+        agents, needs_update, update_keys = self.agents, self.needs_update, self.update_keys
+        get_mail_recipients = self.mailing_lists.get_mail_recipients
+        for key, msg in items:
+            for uuid in get_mail_recipients(msg):
+                agent = agents.get(uuid, None)
+                if agent is None:
+                    continue
+                if uuid not in needs_update:
+                    needs_update[uuid] = True
+                    update_keys[uuid] = (round_, 1, key) + self._category(msg, uuid)
+                if msg.receiver == uuid:
+                    agent.inbox.append(msg)
+                else:
+                    agent.inbox.append(msg.copy())
+
+    def _category(self, msg, uuid):
+        """ returns (category, subscription key) of the first mailing list through which
+        uuid receives msg, in the order used by MailingList.get_mail_recipients. """
+        if msg.direct or uuid == msg.receiver:
+            return 0, ()
+        keys = self.subscription_keys.get(uuid, {})
+        s, r, t = msg.sender, msg.receiver, msg.topic
+        for category, selector in enumerate(((s, r, t), (s, r, None), (s, None, t), (s, None, None),
+                                             (None, r, t), (None, r, None), (None, None, t)), start=1):
+            key = keys.get(selector, None)
+            if key is not None:
+                return category, key
+        raise SchedulerException(f"{uuid} received {msg} without a subscription.")
+
+    def export(self):
+        """ returns the state to be shipped back to the ShardedScheduler. """
+        subscriptions = []
+        for subscriber, keys in self.subscription_keys.items():
+            for (sender, receiver, topic), key in keys.items():
+                subscriptions.append((key, sender, receiver, topic, subscriber))
+        schedule = [(t, receiver, self.clock.set_keys[(t, receiver)])
+                    for t, bucket in self.clock.alarms.items() for receiver in bucket]
+        return {
+            "agents": list(self.agents.values()),
+            "needs_update": [(self.update_keys[uuid], uuid) for uuid in self.needs_update],
+            "has_keep_awake": [(self.keep_awake_keys[uuid], uuid) for uuid in self.has_keep_awake],
+            "subscriptions": subscriptions,
+            "registries": [(r.uuid, dict(r.alarms)) for r in self.clock.registry.values() if r.alarms],
+            "schedule": schedule,
+            "last_required_alarm": self.clock.last_required_alarm,
+        }
+
+
+def _exchange(index, everyone, direct, outboxes, inboxes, events):
+    """ sends the messages of this shard to all other shards and receives theirs.
+    Writing and reading are interleaved, so a full ring buffer can't cause a deadlock.
+    When neither is possible, the shard waits for its event, which the other shards set
+    when they write to it or read from it.
+    :param events: list of the multiprocessing.Event of each shard.
+    :return: list of (key, message) from the other shards.
+    """
+    common = pickle.dumps(everyone, protocol=pickle.HIGHEST_PROTOCOL)
+    pending_out = {}
+    for target, ring in outboxes.items():
+        own = pickle.dumps(direct[target], protocol=pickle.HIGHEST_PROTOCOL)
+        pending_out[target] = memoryview(_HEADER.pack(len(common), len(own)) + common + own)
+    pending_in = {source: bytearray() for source in inboxes}
+
+    received = []
+    ready = events[index]
+    while pending_out or pending_in:
+        ready.clear()  # before looking, so that a write or read meanwhile isn't missed.
+        progress = False
+        for target, data in list(pending_out.items()):
+            n = outboxes[target].write(data)
+            if n:
+                progress = True
+                events[target].set()
+                data = data[n:]
+                pending_out[target] = data
+            if not data:
+                del pending_out[target]
+        for source, data in list(pending_in.items()):
+            chunk = inboxes[source].read()
+            if chunk:
+                progress = True
+                events[source].set()
+                data += chunk
+            if len(data) < _HEADER.size:
+                continue
+            size_common, size_own = _HEADER.unpack_from(data)
+            end = _HEADER.size + size_common + size_own
+            if len(data) < end:
+                continue
+            received.extend(pickle.loads(data[_HEADER.size:_HEADER.size + size_common]))
+            received.extend(pickle.loads(data[_HEADER.size + size_common:end]))
+            del pending_in[source]
+        if not progress:
+            ready.wait()
+    return received
+
+
+def _shard_main(connection, index, shards, outbox_names, inbox_names, capacity, events):
+    """ the main loop of a worker process. Executes the commands of the ShardedScheduler.
+    :param outbox_names: dict target: (name, lock) of the ring buffer to the target shard.
+    :param inbox_names: dict source: (name, lock) of the ring buffer from the source shard.
+    :param events: list of the multiprocessing.Event of each shard, see _exchange.
+    """
+    outboxes = {target: RingBuffer(name, capacity, lock) for target, (name, lock) in outbox_names.items()}
+    inboxes = {source: RingBuffer(name, capacity, lock) for source, (name, lock) in inbox_names.items()}
+    shard = None
+    try:
+        while True:
+            command, *args = connection.recv()
+            if command == "start":
+                state, = args
+                shard = Shard(index, state['shard_of'])
+                connection.send(("ok", shard.install(state)))
+            elif command == "update":
+                round_, ranks = args
+                connection.send(("ok", shard.update_agents(round_, ranks)))
+            elif command == "deliver":
+                now, = args
+                shard.clock._time = now
+                alarms = shard.release_alarms()
+                sent = len(shard._outgoing) + len(alarms)
+                everyone, direct = shard.address(shards)
+                everyone.extend(alarms)  # every shard needs all alarms to put them in order.
+                items = everyone + direct[index]
+                items.extend(_exchange(index, everyone, direct, outboxes, inboxes, events))
+                alarms = [item for item in items if item[0][0] is None]
+                items = [item for item in items if item[0][0] is not None]
+                shard._outgoing = []
+                shard.deliver(shard.order(items, alarms))
+                report = {
+                    "sent": sent,
+                    "keys": shard.plan(),
+                    "next_alarm": shard.clock.alarms.next_timestamp(),
+                    "last_required_alarm": shard.clock.last_required_alarm,
+                }
+                connection.send(("ok", report))
+            elif command == "finish":
+                connection.send(("ok", shard.export()))
+                break
+            else:
+                raise SchedulerException(f"unknown command: {command}")
+    except Exception:
+        try:
+            connection.send(("error", traceback.format_exc()))
+        except OSError:
+            pass  # the ShardedScheduler has gone.
+    finally:
+        for ring in list(outboxes.values()) + list(inboxes.values()):
+            ring.close()
+        connection.close()
+
+
+class ShardedScheduler(Scheduler):
+    """ A Scheduler that runs its agents in several processes. See the module docstring. """
+
+    def __init__(self, shards=None, logger=None, real_time=True, partition=None,
+                 ring_size=1 << 20, start_method=None, checked=True):
+        """
+        :param shards: int, number of worker processes. Default: os.cpu_count()
+        :param logger: optional: logging.logger
+        :param real_time: bool, see Scheduler.
+        :param partition: optional callable(uuid) -> int, the shard of an agent.
+            Default: agents are dealt out to the shards in the order they are added.
+        :param ring_size: int, bytes in each of the shared memory ring buffers between two shards.
+        :param start_method: optional, multiprocessing start method ('fork', 'spawn', ...)
+        :param checked: bool, see Scheduler.
+        """
+        super().__init__(logger=logger, real_time=real_time, checked=checked)
+        if shards is None:
+            shards = os.cpu_count() or 1
+        if not isinstance(shards, int) or shards < 1:
+            raise ValueError(f"shards must be a positive int, not {shards}")
+        self.shards = shards
+        self.partition = partition
+        self.ring_size = ring_size
+        self._context = multiprocessing.get_context(start_method)
+        self.shard_of = dict()  # uuid: shard index
+        self._dealt = 0
+
+    def add(self, agent):
+        super().add(agent)
+        self._deal(agent)
+
+    def _deal(self, agent):
+        """ assigns the agent to a shard. """
+        if self.partition is None:
+            index = self._dealt % self.shards
+            self._dealt += 1
+        else:
+            index = self.partition(agent.uuid)
+            if not isinstance(index, int) or not 0 <= index < self.shards:
+                raise SchedulerException(f"partition({agent.uuid}) gave {index}, expected 0 <= int < {self.shards}")
+        self.shard_of[agent.uuid] = index
+
+    def add_many(self, agents, setup=True):
+        agents = super().add_many(agents, setup=setup)
+        for agent in agents:
+            self._deal(agent)
+        return agents
+
+    def remove(self, agent_or_uuid):
+        uuid = getattr(agent_or_uuid, "uuid", agent_or_uuid)
+        super().remove(agent_or_uuid)
+        if uuid not in self.agents:
+            self.shard_of.pop(uuid, None)
+
+    def run(self, seconds=None, iterations=None, pause_if_idle=True, clear_alarms_at_end=True):
+        """ As Scheduler.run, but with the agents updated in the worker processes. """
+        if self.shards == 1:
+            return super().run(seconds, iterations, pause_if_idle, clear_alarms_at_end)
+        if self.mail_log is not None:
+            raise SchedulerException("the mail log isn't supported with more than one shard.")
+        if self.members:
+            raise SchedulerException("agents with members (AgentArray) aren't supported with more than one shard.")
+        if self._periods:
+            raise SchedulerException("Agent.wake_every isn't supported with more than one shard.")
+
+        seconds, start_time, iterations_to_halt = self._start_run(seconds, iterations, pause_if_idle,
+                                                                  clear_alarms_at_end)
+
+        rings, workers = {}, []
+        try:
+            for source in range(self.shards):
+                for target in range(self.shards):
+                    if source != target:
+                        rings[(source, target)] = RingBuffer(capacity=self.ring_size, lock=self._context.Lock())
+            events = [self._context.Event() for _ in range(self.shards)]
+            for index in range(self.shards):
+                parent_end, child_end = self._context.Pipe()
+                outbox_names = {t: (rings[(index, t)].name, rings[(index, t)].lock)
+                                for t in range(self.shards) if t != index}
+                inbox_names = {s: (rings[(s, index)].name, rings[(s, index)].lock)
+                               for s in range(self.shards) if s != index}
+                process = self._context.Process(
+                    target=_shard_main,
+                    args=(child_end, index, self.shards, outbox_names, inbox_names, self.ring_size, events),
+                    daemon=True)
+                process.start()
+                child_end.close()
+                workers.append((process, parent_end))
+
+            keys = self._broadcast(workers, [("start", state) for state in self._export()])
+            self._loop(workers, keys, seconds, start_time, iterations_to_halt, pause_if_idle)
+            self._install(self._broadcast(workers, [("finish",)] * self.shards))
+        finally:
+            for process, connection in workers:
+                connection.close()
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+            for ring in rings.values():
+                ring.close(unlink=True)
+        self._end_run(clear_alarms_at_end)
+
+    def _loop(self, workers, keys, seconds, start_time, iterations_to_halt, pause_if_idle):
+        """ the main loop of Scheduler.run, with the work done by the shards. """
+        round_ = 0
+        self._quit = False
+        while not self._quit:
+            round_ += 1
+            ranks = self._rank(keys)
+            reports = self._broadcast(workers, [("update", round_, r) for r in ranks])
+            self._quit = self._quit or any(r["quit"] for r in reports)
+
+            # tick the clock for everyone.
+            if isinstance(self.clock, SimulationClock):
+                next_alarms = [r["next_alarm"] for r in reports if r["next_alarm"] is not None]
+                if self.clock.time < self.clock.last_required_alarm:  # also when the required alarm has been cleared.
+                    next_alarms.append(self.clock.last_required_alarm)
+                if not any(r["mail"] for r in reports) and next_alarms:
+                    self.clock._time = min(min(next_alarms), seconds if seconds else inf)
+            else:
+                self.clock.tick(limit=seconds)
+
+            reports = self._broadcast(workers, [("deliver", self.clock.time)] * self.shards)
+            keys = [r["keys"] for r in reports]
+            self.clock.last_required_alarm = max(r["last_required_alarm"] for r in reports)
+            no_messages = sum(r["sent"] for r in reports) == 0
+
+            # determine whether to stop:
+            iterations_to_halt = self._count_down(seconds, start_time, iterations_to_halt)
+            if no_messages:
+                next_alarms = [r["next_alarm"] for r in reports if r["next_alarm"] is not None]
+                next_alarm = min(next_alarms) if next_alarms else None
+                idle = not any(keys)  # keep_awake agents in the shards still need updates.
+                if self.clock.time < self.clock.last_required_alarm:
+                    if idle:
+                        self._idle(limit=seconds, next_alarm=next_alarm)
+                elif pause_if_idle:
+                    self._quit = True
+                elif idle and iterations_to_halt is None:
+                    self._idle(limit=seconds, next_alarm=next_alarm)
+
+    @staticmethod
+    def _rank(keys):
+        """ turns the update keys of each shard into global ranks.
+        :param keys: list of lists of update keys (one list per shard).
+        :return: list of lists of ints.
+        """
+        merged = sorted(((key, shard, i) for shard, shard_keys in enumerate(keys) for i, key in enumerate(shard_keys)),
+                        key=lambda row: row[0])
+        ranks = [[0] * len(shard_keys) for shard_keys in keys]
+        for rank, (_, shard, i) in enumerate(merged):
+            ranks[shard][i] = rank
+        return ranks
+
+    def _broadcast(self, workers, commands):
+        """ sends a command to each shard and waits for all of them to respond. """
+        for (_, connection), command in zip(workers, commands):
+            connection.send(command)
+        responses = []
+        for index, (_, connection) in enumerate(workers):
+            try:
+                status, response = connection.recv()
+            except EOFError:
+                raise SchedulerException(f"shard {index} died.")
+            if status == "error":
+                raise SchedulerException(f"shard {index} failed:\n{response}")
+            responses.append(response)
+        return responses
+
+    def _export(self):
+        """ splits the state of the scheduler into one state for each shard. """
+        def shard(uuid):
+            return self.shard_of.get(uuid, 0)
+
+        states = [{"checked": self.checked,
+                   "time": self.clock.time,
+                   "last_required_alarm": self.clock.last_required_alarm,
+                   "shard_of": self.shard_of,
+                   "agents": [], "subscriptions": [], "registries": [], "schedule": [],
+                   "needs_update": [], "has_keep_awake": []} for _ in range(self.shards)]
+
+        for uuid, agent in self.agents.items():
+            states[shard(uuid)]["agents"].append(agent)
+        for i, uuid in enumerate(self.needs_update):
+            states[shard(uuid)]["needs_update"].append(((0, 0, i), uuid))
+        for i, uuid in enumerate(self.has_keep_awake):
+            states[shard(uuid)]["has_keep_awake"].append(((0, i), uuid))
+        for sender, receiver_dict in self.mailing_lists.directory.items():
+            for receiver, topic_dict in receiver_dict.items():
+                for topic, subscribers in topic_dict.items():
+                    for i, subscriber in enumerate(subscribers):
+                        row = ((0, i), sender, receiver, topic, subscriber)
+                        states[shard(subscriber)]["subscriptions"].append(row)
+        for receiver, registry in self.clock.registry.items():
+            if registry.alarms:
+                states[shard(receiver)]["registries"].append((receiver, dict(registry.alarms)))
+        i = 0
+        for wakeup_time, bucket in self.clock.alarms.items():
+            for receiver, registry in bucket.items():
+                n = len(registry.alarms[wakeup_time])
+                keys = [(0, j) for j in range(i, i + n)]
+                states[shard(receiver)]["schedule"].append((wakeup_time, receiver, keys))
+                i += n
+        return states
+
+    def _install(self, states):
+        """ copies the state of the shards back onto the scheduler and its agents. """
+        for state in states:
+            for agent in state["agents"]:
+                original = self.agents[agent.uuid]
+                original.__setstate__(agent.__getstate__())
+                self._attach(original)
+
+        def merged(name):
+            return sorted((row for state in states for row in state[name]), key=_first)
+
+        self.needs_update.clear()
+        self.needs_update.update((uuid, True) for _, uuid in merged("needs_update"))
+        self.has_keep_awake.clear()
+        self.has_keep_awake.update((uuid, True) for _, uuid in merged("has_keep_awake"))
+
+        mailing_lists = MailingList(cache_size=self.mailing_lists.cache_size)
+        seen = set()
+        for _, sender, receiver, topic, subscriber in merged("subscriptions"):
+            if (sender, receiver, topic, subscriber) not in seen:
+                seen.add((sender, receiver, topic, subscriber))
+                mailing_lists.subscribe(subscriber=subscriber, sender=sender, receiver=receiver, topic=topic)
+        self.mailing_lists = mailing_lists
+
+        # alarms: the messages for the same receiver and wakeup time may come from several
+        # shards. They are merged in the order they were set.
+        scheduled = dict()  # (wakeup time, receiver): [(key, message)]
+        orphans = dict()  # receiver: {wakeup time: [message]}
+        for state in states:
+            keys = {(wakeup_time, receiver): k for wakeup_time, receiver, k in state["schedule"]}
+            for receiver, registry_alarms in state["registries"]:
+                for wakeup_time, messages in registry_alarms.items():
+                    k = keys.get((wakeup_time, receiver), None)
+                    if k is None:
+                        orphans.setdefault(receiver, dict()).setdefault(wakeup_time, []).extend(messages)
+                    else:
+                        scheduled.setdefault((wakeup_time, receiver), []).extend(zip(k, messages))
+        self.clock.registry.clear()
+        self.clock.alarms.clear()
+        for (wakeup_time, receiver), rows in sorted(scheduled.items(), key=lambda item: min(item[1], key=_first)[0]):
+            registry = self.clock.registry.get(receiver, None)
+            if registry is None:
+                registry = self.clock.registry[receiver] = AlarmRegistry(receiver)
+            registry.alarms[wakeup_time] = [msg for _, msg in sorted(rows, key=_first)]
+        for wakeup_time, receiver in sorted(scheduled, key=lambda item: (item[0], min(scheduled[item], key=_first)[0])):
+            self.clock.alarms.set_alarm(wakeup_time, self.clock.registry[receiver])
+        for receiver, registry_alarms in orphans.items():
+            registry = self.clock.registry.get(receiver, None)
+            if registry is None:
+                registry = self.clock.registry[receiver] = AlarmRegistry(receiver)
+            for wakeup_time, messages in registry_alarms.items():
+                registry.alarms[wakeup_time][:0] = messages
+        self.clock.last_required_alarm = max(state["last_required_alarm"] for state in states)
@@ -0,0 +1,151 @@
+"""
+Timeline traces of the Scheduler.
+
+    >>> from maslite.tracing import Tracer
+    >>> tracer = Tracer()
+    >>> s = Scheduler(tracer=tracer)     # or s.tracer = tracer
+    >>> s.run()
+    >>> tracer.export("run.trace.json")
+
+The tracer records a span for every iteration of `Scheduler.run`, every
+`agent.update()`, every delivery of the mail queue, every release of alarms and
+every wait of an idle scheduler.
+The spans are kept in a ring buffer that is allocated up front, so recording a
+span doesn't allocate memory and a long run keeps only the last `size` spans.
+
+`export` writes the spans in the trace event format of Chrome and Perfetto:
+open the file in https://ui.perfetto.dev or chrome://tracing to see the
+iterations on a timeline, with the updates and deliveries nested inside them.
+
+The ShardedScheduler doesn't trace the updates in its worker processes.
+"""
+import json
+from array import array
+
+ITERATION = 0  # argument: the number of the iteration.
+UPDATE = 1  # argument: the uuid of the agent.
+DELIVERY = 2  # argument: the number of messages delivered.
+ALARMS = 3  # argument: the number of alarm messages released.
+IDLE = 4  # argument: None. The scheduler waits for an alarm, a message or wake().
+
+SPAN_NAMES = {ITERATION: "iteration", UPDATE: "update", DELIVERY: "deliver mail", ALARMS: "release alarms",
+              IDLE: "idle"}
+ARGUMENT_NAMES = {ITERATION: "iteration", UPDATE: "agent", DELIVERY: "messages", ALARMS: "messages", IDLE: None}
+
+
+class Tracer(object):
+    """ Records spans of the Scheduler in a ring buffer. See the module docstring. """
+
+    __slots__ = ('size', 'recorded', '_kinds', '_starts', '_ends', '_arguments')
+
+    def __init__(self, size=100_000):
+        """
+        :param size: int, the number of spans to keep.
+        """
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("size must be a positive integer.")
+        self.size = size
+        self.recorded = 0  # spans recorded since the start (or clear), including those overwritten.
+        self._kinds = array('b', bytes(size))
+        self._starts = array('d', bytes(8 * size))
+        self._ends = array('d', bytes(8 * size))
+        self._arguments = [None] * size
+
+    def __len__(self):
+        return min(self.recorded, self.size)
+
+    def iteration(self, number, start, end):
+        """ called by the Scheduler at the end of an iteration of run.
+        :param number: int, the iteration of the run, starting at 1.
+        :param start: float, time.perf_counter() at the start.
+        :param end: float, time.perf_counter() at the end.
+        """
+        self.span(ITERATION, start, end, number)
+
+    def update(self, uuid, start, end):
+        """ called by the Scheduler after agent.update() """
+        self.span(UPDATE, start, end, uuid)
+
+    def delivery(self, messages, start, end):
+        """ called by the Scheduler after the mail queue has been delivered. """
+        self.span(DELIVERY, start, end, messages)
+
+    def alarms(self, messages, start, end):
+        """ called by the Scheduler after the alarms have been released. """
+        self.span(ALARMS, start, end, messages)
+
+    def idle(self, start, end):
+        """ called by the Scheduler after it has waited for something to do. """
+        self.span(IDLE, start, end)
+
+    def span(self, kind, start, end, argument=None):
+        """ records a span.
+        :param kind: ITERATION, UPDATE, DELIVERY or ALARMS
+        :param start: float, time.perf_counter() at the start.
+        :param end: float, time.perf_counter() at the end.
+        :param argument: see the kinds.
+        """
+        i = self.recorded % self.size
+        self._kinds[i] = kind
+        self._starts[i] = start
+        self._ends[i] = end
+        self._arguments[i] = argument
+        self.recorded += 1
+
+    def spans(self):
+        """
+        :return: list of (kind, start, end, argument), the oldest first.
+        """
+        n = len(self)
+        first = self.recorded - n
+        spans = []
+        for j in range(first, first + n):
+            i = j % self.size
+            spans.append((self._kinds[i], self._starts[i], self._ends[i], self._arguments[i]))
+        return spans
+
+    def clear(self):
+        self.recorded = 0
+        for i in range(self.size):
+            self._arguments[i] = None
+
+    def trace_events(self, pid=1, tid=1):
+        """
+        :param pid: the process id shown in the trace.
+        :param tid: the thread id shown in the trace.
+        :return: dict in the trace event format of Chrome and Perfetto, with the times
+        in microseconds since the first span.
+        """
+        spans = self.spans()
+        origin = min((start for _, start, _, _ in spans), default=0.0)
+        events = []
+        for kind, start, end, argument in spans:
+            if kind == UPDATE:
+                name = f"update {argument}"
+            else:
+                name = SPAN_NAMES[kind]
+            events.append({
+                "name": name,
+                "cat": SPAN_NAMES[kind],
+                "ph": "X",
+                "ts": (start - origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            })
+            if argument is not None:
+                events[-1]["args"] = {ARGUMENT_NAMES[kind]: argument if isinstance(argument, (int, float)) else str(argument)}
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path, pid=1, tid=1):
+        """ writes the spans as a Chrome/Perfetto trace.
+        :param path: file name, or a file opened for writing text.
+        :param pid: the process id shown in the trace.
+        :param tid: the thread id shown in the trace.
+        """
+        events = self.trace_events(pid=pid, tid=tid)
+        if hasattr(path, "write"):
+            json.dump(events, path)
+        else:
+            with open(path, "w") as f:
+                json.dump(events, f)
@@ -30,6 +30,7 @@ setup(
     data_files=[(".", ["license.md", "readme.md"])],
     platforms="any",
     install_requires=[],
+    extras_require={"arrays": ["numpy"]},  # maslite.arrays
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Science/Research",
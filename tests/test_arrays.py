@@ -0,0 +1,110 @@
+import pytest
+
+from maslite import Agent, AgentMessage, Scheduler, SchedulerException, RingBufferSink
+from maslite.checkpoint import save, restore
+
+np = pytest.importorskip("numpy")
+from maslite.arrays import AgentArray  # noqa: E402, needs numpy.
+
+
+class Order(AgentMessage):
+    def __init__(self, sender, receiver, quantity):
+        super().__init__(sender, receiver)
+        self.quantity = quantity
+
+
+class Shipment(AgentMessage):
+    def __init__(self, sender, receiver, quantity):
+        super().__init__(sender, receiver)
+        self.quantity = quantity
+
+
+class Warehouses(AgentArray):
+    """ each member ships what it has in stock of the orders it receives. """
+    columns = {"stock": "i8", "orders": "i4"}
+
+    def update(self):
+        messages = self.receive_all()
+        rows = self.rows_of(messages)
+        quantities = np.array([msg.quantity for msg in messages], dtype=np.int64)
+        np.add.at(self.orders, rows, 1)
+        for row, msg, quantity in zip(rows.tolist(), messages, quantities.tolist()):
+            shipped = min(quantity, int(self.stock[row]))
+            self.stock[row] -= shipped
+            self.send(Shipment(sender=int(self.uuids[row]), receiver=msg.sender, quantity=shipped))
+
+
+class Shop(Agent):
+    def __init__(self):
+        super().__init__()
+        self.received = {}
+
+    def update(self):
+        for msg in self.receive_all():
+            self.received[msg.sender] = self.received.get(msg.sender, 0) + msg.quantity
+
+
+def test_agent_array():
+    events = RingBufferSink()
+    s = Scheduler(real_time=False, event_sink=events, stats=True)
+    warehouses = Warehouses(size=1000, stock=10)
+    shop = Shop()
+    s.add(warehouses)
+    s.add(shop)
+    assert len(warehouses) == 1000 and len(s.members) == 1000 and len(s.agents) == 2
+    assert "add_members" in [kind for kind, _ in events.events()]
+
+    members = warehouses.uuids.tolist()
+    for uuid in members[:500]:
+        shop.send(Order(shop, uuid, quantity=4))
+    shop.send(Order(shop, members[0], quantity=10))
+    s.run()
+    assert shop.received[members[0]] == 10 and shop.received[members[1]] == 4
+    assert warehouses.stock[0] == 0 and warehouses.stock[1] == 6 and warehouses.stock[999] == 10
+    assert warehouses.orders.sum() == 501
+    stats = s.stats()
+    assert stats["topics"]["Order"] == 501 and stats["agents"][members[0]]["messages_in"] == 2
+
+    # members come and go.
+    new = warehouses.add_members(2, stock=[1, 2])
+    assert warehouses.stock[-2:].tolist() == [1, 2] and all(uuid in s.members for uuid in new.tolist())
+    assert warehouses.remove_members(members[:10] + [-1]) == 10
+    assert len(warehouses) == 992 and members[0] not in s.members
+    assert warehouses.rows[members[10]] == 0 and warehouses.stock[0] == 6
+    shop.send(Order(shop, members[0], quantity=1))  # a removed member gets no mail.
+    shop.send(Order(shop, int(new[1]), quantity=5))
+    s.run()
+    assert shop.received[int(new[1])] == 2 and warehouses.orders.sum() == 501 - 11 + 1
+
+    try:
+        s.add(Agent(uuid=members[20]))
+        raise AssertionError("an agent took the uuid of a member.")
+    except SchedulerException:
+        pass
+    try:
+        warehouses.add_members(uuids=[members[20]])
+        raise AssertionError("two members with the same uuid.")
+    except ValueError:
+        pass
+
+    s.remove(warehouses)
+    assert not s.members
+
+
+def test_agent_array_checkpoint(tmp_path):
+    s = Scheduler(real_time=False)
+    warehouses = Warehouses(size=100, stock=np.arange(100))
+    shop = Shop()
+    s.add(warehouses)
+    s.add(shop)
+    shop.send(Order(shop, int(warehouses.uuids[7]), quantity=3))
+    s.process_mail_queue()
+
+    path = tmp_path / "warehouses.checkpoint"
+    save(s, path)
+    restored = restore(path)
+    copy = restored.agents[warehouses.uuid]
+    assert copy.stock.tolist() == list(range(100)) and restored.members == s.members
+    restored.run()
+    assert restored.agents[shop.uuid].received == {int(warehouses.uuids[7]): 3}
+    assert Warehouses(size=1).uuids[0] > max(s.members)
@@ -0,0 +1,118 @@
+import time
+import asyncio
+import threading
+
+from maslite import Agent, AgentMessage, Scheduler, SchedulerException
+from maslite.asynchronous import AsyncScheduler
+from tests.test_sharding import Gossiper
+from tests.test_basics import Asker
+
+
+class AsyncGossiper(Gossiper):
+    async def update(self):
+        await asyncio.sleep(0)  # the other coroutines run here.
+        super().update()
+
+
+def gossip(scheduler, cls, n=24, rounds=8):
+    peers = list(range(1, n + 1))
+    agents = [cls(uuid, peers, rounds) for uuid in peers]
+    for agent in agents:
+        scheduler.add(agent)
+    if isinstance(scheduler, AsyncScheduler):
+        asyncio.run(scheduler.run())
+    else:
+        scheduler.run()
+    return {agent.uuid: (agent.received, agent.state) for agent in agents}, scheduler.clock.time
+
+
+def test_async_run_matches_scheduler():
+    expected = gossip(Scheduler(real_time=False), Gossiper)
+    assert gossip(AsyncScheduler(real_time=False), Gossiper) == expected
+    assert gossip(AsyncScheduler(real_time=False), AsyncGossiper) == expected
+
+
+class Lookup(Agent):
+    """ answers every question after waiting for a (pretend) database. """
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.answered = 0
+
+    async def update(self):
+        while self.messages:
+            msg = self.receive()
+            await asyncio.sleep(self.delay)
+            self.answered += 1
+            self.send(AgentMessage(self, msg.sender, topic="answer"))
+
+
+def test_async_updates_run_concurrently():
+    s = AsyncScheduler(stats=True)
+    asker = Asker()
+    s.add(asker)
+    lookups = [Lookup(delay=0.2) for _ in range(10)]
+    for agent in lookups:
+        s.add(agent)
+        asker.send(AgentMessage(asker, agent, topic="question"))
+
+    start = time.perf_counter()
+    asyncio.run(s.run(pause_if_idle=True))
+    end = time.perf_counter()
+    assert sorted(asker.answers) == sorted(agent.uuid for agent in lookups)
+    assert end - start < 1.0, "10 lookups of 0.2 seconds took as long as running them one by one."
+    assert s.stats()["agents"][lookups[0].uuid]["update_time"] >= 0.2
+
+
+def test_async_agents_need_the_async_scheduler():
+    s = Scheduler()
+    try:
+        s.add(Lookup(delay=0))
+        raise AssertionError("Scheduler accepted an agent with async def update.")
+    except SchedulerException:
+        pass
+
+
+def test_async_idle_wait():
+    s = AsyncScheduler()
+    asker = Asker()
+    s.add(asker)
+    asker.set_alarm(0.2, AgentMessage(asker, asker), ignore_alarm_if_idle=False)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():  # the event loop isn't blocked whilst the scheduler waits.
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await s.run(pause_if_idle=True)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+    assert asker.answers == [asker.uuid]
+
+    timer = threading.Timer(0.1, s.pause)
+    timer.start()
+    start = time.time()
+    asyncio.run(s.run(seconds=10, pause_if_idle=False))
+    assert time.time() - start < 5
+    timer.join()
+
+    # a required alarm that has been cleared doesn't keep the run waiting.
+    asker.set_alarm(0.2, AgentMessage(asker, asker), ignore_alarm_if_idle=False)
+    s.clock.clear_alarms()
+    timer = threading.Timer(5, s.pause)
+    timer.start()
+    start = time.time()
+    asyncio.run(s.run(pause_if_idle=True))
+    timer.cancel()
+    assert time.time() - start < 2
+
+    asker.wake_every(iterations=5)
+    asyncio.run(s.run(seconds=0.2, pause_if_idle=False))
+    assert s.iteration > 50, "agents that wake every few iterations keep the iterations going."
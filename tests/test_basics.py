@@ -1,7 +1,10 @@
 import logging
+import threading
 import time
+import pickle
 from collections import deque
-from maslite import Agent, AgentMessage, Scheduler, SchedulerException, MailingList
+from maslite import Agent, AgentMessage, FrozenMessage, Scheduler, SchedulerException, MailingList, PriorityInbox, handles
+from maslite import OffloadResult
 
 LOG_LEVEL = logging.INFO
 
@@ -546,3 +549,877 @@ def test_ping_pong_tests():
     assert player_b.update_count == limit
     assert player_b.outcome != "won!"
     print(mps, "messages per second")
+
+
+def test_alarm_store():
+    s = Scheduler(real_time=False)
+    a = TrialAgent()
+    b = TrialAgent()
+    s.add(a)
+    s.add(b)
+    msgs = [TrialMessage(sender=a, receiver=r, topic=str(i)) for i, r in enumerate([a, b, a, b])]
+    a.set_alarm(alarm_time=2, alarm_message=msgs[0])
+    a.set_alarm(alarm_time=2, alarm_message=msgs[1])
+    a.set_alarm(alarm_time=2, alarm_message=msgs[2])
+    a.set_alarm(alarm_time=1, alarm_message=msgs[3])
+    assert s.clock.alarm_time == [1, 2]
+    assert s.clock.alarms.next_timestamp() == 1
+
+    # cancel and set again: the stale heap entry must be skipped.
+    b.clear_alarms()
+    assert s.clock.alarm_time == [2]
+    assert s.clock.alarms.next_timestamp() == 2
+    b.set_alarm(alarm_time=1, alarm_message=msgs[3])
+    b.set_alarm(alarm_time=2, alarm_message=msgs[1])
+
+    s.clock._time = 1.5
+    s.clock.release_alarm_messages()
+    assert list(s.mail_queue) == [msgs[3]]
+    s.mail_queue.clear()
+
+    s.clock._time = 2
+    s.clock.release_alarm_messages()
+    assert list(s.mail_queue) == [msgs[0], msgs[2], msgs[1]]  # grouped by receiver.
+    assert len(s.clock.alarms) == 0
+    assert a.list_alarms() == [] and b.list_alarms() == []
+
+
+def test_routing_cache():
+    m = MailingList()
+    m.subscribe(subscriber=10, topic='A')
+    msg = TrialMessage(sender=1, receiver=2, topic='A')
+
+    assert m.get_mail_recipients(msg) == (2, 10)
+    assert m.get_mail_recipients(msg) == (2, 10)
+    assert m.cache_info()['hits'] == 1 and m.cache_info()['misses'] == 1
+
+    # subscriptions that match the route invalidate it.
+    m.subscribe(subscriber=11, sender=1)
+    assert m.get_mail_recipients(msg) == (2, 11, 10)
+    m.subscribe(subscriber=12, receiver=2, topic='A')
+    assert m.get_mail_recipients(msg) == (2, 11, 12, 10)
+
+    # ... whilst subscriptions that don't, leave it alone.
+    size = m.cache_info()['size']
+    m.subscribe(subscriber=13, sender=3, topic='A')
+    assert m.cache_info()['size'] == size
+    assert m.get_mail_recipients(msg) == (2, 11, 12, 10)
+
+    m.unsubscribe(11, everything=True)
+    assert m.get_mail_recipients(msg) == (2, 12, 10)
+    m.unsubscribe(10, topic='A')
+    assert m.get_mail_recipients(msg) == (2, 12)
+
+    broadcast = TrialMessage(sender=3, topic='A')
+    assert m.get_mail_recipients(broadcast) == (13,)
+    m.cache_clear()
+    assert m.cache_info()['size'] == 0
+    assert m.get_mail_recipients(broadcast) == (13,)
+
+
+class Echo(Agent):
+    """ listens to everything on topic 'news' and replies to the news addressed to it. """
+    def setup(self):
+        self.subscribe(topic='news')
+
+    def update(self):
+        while self.messages:
+            msg = self.receive()
+            if msg.topic == 'news' and msg.receiver == self.uuid:
+                self.send(TrialMessage(sender=self, receiver=msg.sender, topic='reply'))
+
+
+def test_stats():
+    s = Scheduler(real_time=False)
+    try:
+        s.stats()
+        assert False, "stats are off by default."
+    except SchedulerException:
+        pass
+
+    s.enable_stats()
+    a, b, c = Echo(), Echo(), Echo()
+    for agent in [a, b, c]:
+        s.add(agent)
+    a.send(TrialMessage(sender=a, receiver=b, topic='news'))  # b gets the original, c and a get copies.
+    s.run()
+
+    stats = s.stats()
+    assert stats['copies'] == 2
+    assert stats['topics'] == {'news': 3, 'reply': 1}
+    assert stats['agents'][a.uuid]['messages_out'] == 1
+    assert stats['agents'][a.uuid]['messages_in'] == 2  # the news copy and the reply.
+    assert stats['agents'][b.uuid]['messages_out'] == 1
+    assert stats['agents'][c.uuid]['messages_in'] == 1
+    assert stats['iterations'] >= 2
+    assert all(v['updates'] >= 1 and v['update_time'] >= 0 for v in stats['agents'].values())
+
+    s.enable_stats(False)
+    a.send(TrialMessage(sender=a, receiver=b, topic='news'))
+    s.run()
+    try:
+        s.stats()
+        assert False, "stats were switched off."
+    except SchedulerException:
+        pass
+
+
+def test_send_many_and_receive_all():
+    s = Scheduler(real_time=False)
+    a, b = Agent(), Agent()
+    s.add(a)
+    s.add(b)
+    a.send_many(TrialMessage(sender=a, receiver=b) for _ in range(3))
+    a.send_many([TrialMessage(sender=a, receiver=b)])
+    assert len(s.mail_queue) == 4
+    s.process_mail_queue()
+    assert len(b.inbox) == 4
+
+    messages = b.receive_all()
+    assert isinstance(messages, list) and len(messages) == 4
+    assert not b.messages
+    assert b.receive_all() == []
+
+    a.send_many(TrialMessage(sender=a, receiver=b) for _ in range(2))
+    s.process_mail_queue()
+    inbox = b.drain()
+    assert len(inbox) == 2
+    assert not b.messages
+    s.process_mail_queue()
+    a.send(TrialMessage(sender=a, receiver=b))
+    s.process_mail_queue()
+    assert len(b.inbox) == 1 and len(inbox) == 2  # new mail goes to the new inbox.
+
+
+class Quote(FrozenMessage):
+    def __init__(self, sender, price, receiver=None):
+        super().__init__(sender=sender, receiver=receiver)
+        self.price = price
+
+
+def test_frozen_message():
+    q = Quote(sender=1, price=10)
+    assert q.price == 10 and q.topic == 'Quote'
+    for attempt in [lambda: setattr(q, 'price', 11), lambda: setattr(q, 'receiver', 2), lambda: delattr(q, 'price')]:
+        try:
+            attempt()
+            assert False, "frozen messages can't change."
+        except AttributeError:
+            pass
+    assert q.copy() is q
+    assert pickle.loads(pickle.dumps(q)).price == 10
+
+    s = Scheduler(real_time=False, stats=True)
+    sender = Agent()
+    s.add(sender)
+    listeners = [Agent() for _ in range(5)]
+    for agent in listeners:
+        s.add(agent)
+        agent.subscribe(topic='Quote')
+    sender.send(Quote(sender=sender, price=12, receiver=listeners[0]))
+    s.process_mail_queue()
+    received = [agent.receive() for agent in listeners]
+    assert all(msg is received[0] for msg in received)
+    assert s.stats()['copies'] == 0
+
+
+class SlottedQuote(FrozenMessage):
+    __slots__ = ('price',)
+
+    def __init__(self, sender, price, receiver=None):
+        super().__init__(sender=sender, receiver=receiver)
+        self.price = price
+
+
+class Base(Agent):
+    __slots__ = ()
+    class_operations = {'a': 'on_a', 'b': 'on_b'}
+
+    def on_a(self, msg):
+        return 'base a'
+
+    def on_b(self, msg):
+        return 'base b'
+
+
+class Derived(Base):
+    __slots__ = ('count',)
+    class_operations = {'b': 'on_derived_b', 'c': 'on_a'}
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def on_a(self, msg):
+        return 'derived a'
+
+    def on_derived_b(self, msg):
+        return 'derived b'
+
+
+def test_slots_and_lazy_allocation():
+    a = Agent()
+    assert not hasattr(a, '__dict__')
+    assert a._inbox is None and a._operations is None
+    assert a.messages is False and a.receive() is None and a.receive_all() == []
+    assert a._inbox is None, "checking for mail doesn't allocate an inbox."
+
+    msg = AgentMessage(1, 2)
+    assert not hasattr(msg, '__dict__')
+
+    d = Derived()
+    assert not hasattr(d, '__dict__')
+    assert Derived.class_operations == {'a': 'on_a', 'b': 'on_derived_b', 'c': 'on_a'}
+    assert Base.class_operations == {'a': 'on_a', 'b': 'on_b'}
+    assert d.get_operation('a')(None) == 'derived a'
+    assert d.get_operation('b')(None) == 'derived b'
+    assert d.get_operation('c')(None) == 'derived a'
+    assert d.get_operation('x') is None
+    d.operations['b'] = lambda msg: 'instance b'  # the agents own operations come first.
+    assert d.get_operation('b')(None) == 'instance b'
+    d.operations.clear()
+
+    s = Scheduler(real_time=False)
+    s.add(d)
+    s.add(a)
+    a.send(TrialMessage(sender=a, receiver=d))
+    s.process_mail_queue()
+    assert len(d.inbox) == 1
+
+    clone = pickle.loads(pickle.dumps(d))
+    assert clone.uuid == d.uuid and clone.count == 0 and len(clone.inbox) == 1
+    assert clone._scheduler_api is None and clone._clock is None
+
+    q = SlottedQuote(sender=1, price=3)
+    assert not hasattr(q, '__dict__')
+    try:
+        q.price = 4
+        assert False, "frozen."
+    except AttributeError:
+        pass
+    clone = pickle.loads(pickle.dumps(q))
+    assert clone.price == 3 and clone.sender == 1
+    try:
+        clone.price = 4
+        assert False, "frozen."
+    except AttributeError:
+        pass
+
+
+def test_unchecked_scheduler():
+    class Duck(object):  # looks like a message, but isn't an AgentMessage.
+        def __init__(self, sender, receiver):
+            self.sender, self.receiver, self.topic, self.direct = sender, receiver, 'Duck', False
+
+    for checked in [True, False]:
+        s = Scheduler(real_time=False, checked=checked)
+        a, b = Agent(), Agent()
+        s.add(a)
+        s.add(b)
+        assert s.checked is checked and a._checked is checked
+        if checked:
+            for attempt in [lambda: a.send(Duck(a.uuid, b.uuid)), lambda: a.set_alarm(1, Duck(a.uuid, a.uuid))]:
+                try:
+                    attempt()
+                    assert False, "the checks should have caught the Duck."
+                except (AssertionError, TypeError) as e:
+                    assert "Duck" not in str(e)
+        else:
+            a.send(Duck(a.uuid, b.uuid))
+            a.set_alarm(1, Duck(a.uuid, a.uuid))
+            s.process_mail_queue()
+            assert isinstance(b.receive(), Duck)
+            assert s.clock.alarms.next_timestamp() == 1
+
+    unattached = Agent()
+    try:
+        unattached.send(TrialMessage(1, 2))
+        assert False, "agents must be added to a scheduler before they can send."
+    except AssertionError:
+        pass
+
+
+def test_event_sinks():
+    from maslite import RingBufferSink, LoggingSink, format_event
+
+    sink = RingBufferSink(size=4)
+    s = Scheduler(real_time=False, event_sink=sink)
+    a = Agent()
+    s.add(a)
+    s.subscribe(a.uuid, topic='news')
+    s.unsubscribe(a.uuid, topic='news')
+    assert sink.events() == [("add", ("Agent", a.uuid)),
+                             ("subscribe", (a.uuid, None, None, 'news')),
+                             ("unsubscribe", (a.uuid, None, None, 'news'))]
+    s.remove(a)
+    s.remove(a)
+    assert len(sink) == 4, "the ring buffer keeps the last 4 events."
+    assert sink.lines() == [f"{a.uuid} unsubscribing from msgs from all agents to all agents on topic news",
+                            f"DeRegistering agent {a.uuid}",
+                            f"{a.uuid} unsubscribing from everything",
+                            f"Agent exists but hasn't been added: {a.uuid}"]
+    sink.clear()
+    assert sink.events() == []
+    assert format_event("unknown", (1,)) == "unknown (1,)"
+
+    records = []
+
+    class Collector(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    logger = logging.getLogger("test_event_sinks")
+    logger.propagate = False
+    logger.addHandler(Collector())
+    logger.setLevel(logging.INFO)
+    s = Scheduler(real_time=False, event_sink=LoggingSink(logger, level=logging.DEBUG))
+    s.add(Agent())
+    assert records == [], "events below the loggers level aren't formatted or logged."
+    logger.setLevel(logging.DEBUG)
+    b = Agent()
+    s.add(b)
+    assert records == [f"Registering agent Agent {b.uuid}"]
+
+
+class Alarmed(Agent):
+    def __init__(self):
+        super().__init__()
+        self.woken_at = None
+
+    def update(self):
+        while self.messages:
+            self.receive()
+            self.woken_at = time.time()
+
+
+def test_idle_wait():
+    """ the real-time scheduler waits for the next alarm instead of polling,
+    and wake() or pause() from another thread end the wait. """
+    import threading
+    s = Scheduler(stats=True)
+    a = Alarmed()
+    s.add(a)
+    a.set_alarm(0.2, AgentMessage(a, a), ignore_alarm_if_idle=False)
+    due = s.clock.time + 0.2
+    s.run(pause_if_idle=True)
+    assert a.woken_at >= due
+    assert s.stats()["iterations"] < 10, "the scheduler shouldn't poll while it waits for the alarm."
+
+    # nothing to do for 10 seconds, unless another thread wakes the scheduler up.
+    timer = threading.Timer(0.1, s.pause)
+    timer.start()
+    start = time.time()
+    s.run(seconds=10, pause_if_idle=False)
+    assert time.time() - start < 5
+    timer.join()
+
+    # wake() ends the wait without stopping the scheduler.
+    s.enable_stats()
+    timer = threading.Timer(0.1, s.wake)
+    timer.start()
+    start = time.time()
+    s.run(seconds=0.3, pause_if_idle=False)
+    assert time.time() - start > 0.15, "the run continues after the wakeup."
+    assert s.stats()["iterations"] in (2, 3)
+    timer.join()
+
+
+def test_post_from_other_threads():
+    import threading
+    s = Scheduler()
+    a = Alarmed()
+    s.add(a)
+    received = []
+    a.update = lambda: received.extend(a.receive_all())
+
+    def reader(n):
+        for i in range(n):
+            s.post(AgentMessage(sender="socket", receiver=a.uuid, topic=i))
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=reader, args=(50,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    timer = threading.Timer(1, s.pause)
+    timer.start()
+    s.run(pause_if_idle=False)
+    for thread in threads:
+        thread.join()
+    timer.join()
+    assert len(received) == 150
+    assert all(msg.sender == "socket" for msg in received)
+
+    # the idle scheduler is woken up by post, long before the alarm.
+    a.set_alarm(60, AgentMessage(a, a), ignore_alarm_if_idle=False)
+    received.clear()
+    threading.Timer(0.1, s.post, args=(AgentMessage("socket", a.uuid),)).start()
+    threading.Timer(0.2, s.pause).start()
+    start = time.time()
+    s.run()
+    assert time.time() - start < 30
+    assert [msg.sender for msg in received] == ["socket"]
+
+    # messages posted between runs are delivered when the next run starts.
+    s.post(AgentMessage("file", a.uuid))
+    s.run(iterations=1)
+    assert [msg.sender for msg in received] == ["socket", "file"]
+
+
+class Urgent(AgentMessage):
+    priority = -1
+
+    def copy(self):
+        return Urgent(self.sender, self.receiver, self.topic)
+
+
+class Triage(Agent):
+    priority_inbox = True
+
+
+def test_priority_inbox_and_priority_mail():
+    s = Scheduler(real_time=False)
+    a, b, c = Agent(), Triage(), Agent()
+    for agent in (a, b, c):
+        s.add(agent)
+    c.subscribe(receiver=b.uuid)
+    a.send(TrialMessage(a, b))
+    a.send(Urgent(a, b, topic=1))
+    a.send(TrialMessage(a, b, topic=2))
+    a.send(Urgent(a, b, topic=3))
+    s.process_mail_queue()
+    assert isinstance(b.inbox, PriorityInbox) and len(b.inbox) == 4
+    assert [m.topic for m in b.inbox] == [1, 3, 'TrialMessage', 2], "iterates in the order of receive."
+    assert [b.receive().topic for _ in range(2)] == [1, 3]
+    assert [m.topic for m in b.receive_all()] == ['TrialMessage', 2]
+    assert b.receive() is None and not b.messages
+    order = [type(m).__name__ for m in c.receive_all()]
+    assert order == ['TrialMessage', 'Urgent', 'TrialMessage', 'Urgent'], "deques keep the order sent."
+
+    s.priority_mail = True  # urgent messages are delivered first.
+    a.send(TrialMessage(a, b))
+    a.send(Urgent(a, b, topic=1))
+    s.process_mail_queue()
+    assert [type(m).__name__ for m in c.receive_all()] == ['Urgent', 'TrialMessage']
+    assert [m.topic for m in b.drain()] == [1, 'TrialMessage']
+    assert pickle.loads(pickle.dumps(PriorityInbox([Urgent(1), TrialMessage(2)]))).popleft().sender == 1
+
+
+class Bid(AgentMessage):
+    pass
+
+
+class Counter(Bid):
+    pass
+
+
+class Auctioneer(Agent):
+    def __init__(self):
+        super().__init__()
+        self.log = []
+
+    @handles(Bid)
+    def bid(self, msg):
+        self.log.append(("bid", msg.topic))
+
+    @handles("close", "cancel")
+    def close(self, msg):
+        self.log.append(("close", msg.topic))
+
+    def update(self):
+        self.dispatch_inbox()
+
+    def unhandled(self, msg):
+        self.log.append(("unhandled", msg.topic))
+
+
+class StrictAuctioneer(Auctioneer):
+    @handles("close")
+    def close_now(self, msg):
+        self.log.append(("close now", msg.topic))
+
+
+def test_handles_and_dispatch_inbox():
+    assert Auctioneer.class_operations == {"close": "close", "cancel": "close"}
+    assert StrictAuctioneer.class_operations == {"close": "close_now", "cancel": "close"}, "subclasses override."
+
+    s = Scheduler(real_time=False)
+    a, b = Auctioneer(), StrictAuctioneer()
+    s.add(a)
+    s.add(b)
+    for agent in (a, b):
+        agent.send(Counter(agent, agent, topic="counter"))  # the handler of the base class.
+        agent.send(Bid(agent, agent))
+        agent.send(AgentMessage(agent, agent, topic="close"))
+        agent.send(AgentMessage(agent, agent, topic="cancel"))
+        agent.send(AgentMessage(agent, agent, topic="noise"))
+    s.run()
+    expected = [("bid", "counter"), ("bid", "Bid"), ("close", "close"), ("close", "cancel"), ("unhandled", "noise")]
+    assert a.log == expected
+    assert b.log == [("bid", "counter"), ("bid", "Bid"), ("close now", "close"), ("close", "cancel"),
+                     ("unhandled", "noise")]
+
+    a.log.clear()
+    a.operations["close"] = lambda msg: a.log.append(("operation", msg.topic))  # the instance's operations first.
+    a.send(AgentMessage(a, a, topic="close"))
+    s.run()
+    assert a.log == [("operation", "close")]
+    assert b.dispatch_inbox() == 0
+
+
+def slow_square(x, delay=0.2):
+    time.sleep(delay)
+    return x * x
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+class Planner(Agent):
+    def __init__(self):
+        super().__init__()
+        self.results = {}
+        self.received_at = []
+
+    def update(self):
+        for msg in self.receive_all():
+            if isinstance(msg, OffloadResult):
+                self.results[msg.topic] = msg.result if msg.error is None else msg.error
+                self.received_at.append(self.time)
+            else:
+                self.offload(slow_square, 7, topic="square")
+                self.offload(fail, "bad input", topic="fail")
+
+
+class Ticker(Agent):
+    def __init__(self):
+        super().__init__()
+        self.ticks = 0
+
+    def update(self):
+        while self.messages:
+            self.receive()
+        self.ticks += 1
+        if self.ticks < 10_000:
+            self.send(AgentMessage(self, self))
+
+
+def test_offload_to_process_pool():
+    s = Scheduler(real_time=False, processes=2)
+    planner, ticker = Planner(), Ticker()
+    s.add(planner)
+    s.add(ticker)
+    planner.set_alarm(100, AgentMessage(planner, planner, topic="later"), ignore_alarm_if_idle=False)
+    planner.send(AgentMessage(planner, planner, topic="plan"))
+    try:
+        s.run()  # doesn't stop until the results have arrived.
+    finally:
+        s.close()
+    assert planner.results["square"] == 49
+    assert isinstance(planner.results["fail"], ValueError)
+    assert planner.received_at[:2] == [0, 0], "the simulation clock waits for the results."
+    assert s.clock.time == 100 and not s._offloads
+    assert ticker.ticks > 100, "the other agents kept running whilst the computation ran."
+
+
+class Monitor(Agent):
+    def __init__(self):
+        super().__init__()
+        self.seen = []
+
+    def update(self):
+        self.receive_all()
+        self.seen.append((self._scheduler_api.iteration, self.time))
+
+
+class Chatter(Agent):
+    """ sends itself a message in every iteration, n times. """
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+
+    def setup(self):
+        self.send(AgentMessage(self, self))
+
+    def update(self):
+        self.receive_all()
+        self.n -= 1
+        if self.n > 0:
+            self.send(AgentMessage(self, self))
+
+
+def test_wake_every():
+    s = Scheduler(real_time=False)
+    by_time, by_iterations = Monitor(), Monitor()
+    for agent in (by_time, by_iterations, Chatter(10)):
+        s.add(agent)
+    by_time.wake_every(seconds=2.5)
+    by_iterations.wake_every(iterations=3)
+    by_time.set_alarm(10, AgentMessage(by_time, by_time), ignore_alarm_if_idle=False)
+    s.run()
+    # updated when added, then the clock jumps from wakeup to wakeup up to the alarm, which comes with one.
+    assert [t for _, t in by_time.seen] == [0, 2.5, 5.0, 7.5, 10]
+    iterations = [i for i, _ in by_iterations.seen]
+    assert iterations == [1] + list(range(3, s.iteration + 1, 3)) and len(iterations) > 2
+
+    by_iterations.wake_every()  # stops.
+    s.run(iterations=10)
+    assert len(by_iterations.seen) == len(iterations)
+    try:
+        by_time.wake_every(seconds=1, iterations=1)
+        raise AssertionError("two periods.")
+    except ValueError:
+        pass
+
+    real_time = Scheduler()
+    monitor = Monitor()
+    real_time.add(monitor)
+    monitor.wake_every(seconds=0.1)
+    real_time.run(seconds=0.35, pause_if_idle=False)
+    assert len(monitor.seen) == 1 + 3
+    assert real_time.iteration < 20, "the scheduler waits for the wakeups rather than spinning."
+    real_time.remove(monitor)
+    assert not real_time._periods and real_time.next_periodic_wakeup() is None
+
+    counted = Monitor()
+    real_time.add(counted)
+    counted.wake_every(iterations=5)
+    real_time.run(seconds=0.2, pause_if_idle=False)
+    assert len(counted.seen) > 10, "the scheduler doesn't wait when agents wake every few iterations."
+
+
+def test_remove_cleans_up_references():
+    s = Scheduler(real_time=False)
+    a, b, c, d = Agent(), Agent(), Agent(), Agent()
+    for agent in (a, b, c, d):
+        s.add(agent)
+    a.subscribe(topic="news")
+    b.subscribe(sender=a.uuid)
+    c.subscribe(receiver=a.uuid, topic="bid")
+    d.subscribe(topic="news")
+    a.set_alarm(5, AgentMessage(a, a), ignore_alarm_if_idle=False)
+    a.send(TrialMessage(a, d))
+    s.process_mail_queue()  # caches a route from a.
+
+    s.remove(a)
+    ml = s.mailing_lists
+    assert a.uuid not in ml.directory and all(a.uuid not in receivers for receivers in ml.directory.values())
+    assert set(ml.subscriptions) == {d.uuid}, "b and c subscribed to a, which is gone."
+    assert a.uuid not in ml._senders_of and a.uuid not in s.clock.registry and not s.clock.alarms
+    assert all(a.uuid not in key[:2] for key in ml._routes)
+    assert ml.get_subscriber_list(topic="news") == [d.uuid]
+
+    s.remove_many([b, c.uuid, d])
+    assert not s.agents and not ml.directory and not ml.subscriptions and not ml._senders_of
+
+    for _ in range(3):  # churn leaves nothing behind.
+        agents = [Agent() for _ in range(100)]
+        for agent in agents:
+            s.add(agent)
+        for x, y in zip(agents, agents[1:]):
+            x.subscribe(sender=y.uuid)
+            y.subscribe(receiver=x.uuid, topic="hello")
+            x.set_alarm(1, AgentMessage(x, y))
+        s.remove_many(agents)
+    assert not ml.directory and not ml.subscriptions and not ml._senders_of and not s.clock.registry
+
+    twice = Agent()
+    s.add(twice)
+    twice.subscribe(topic="t")
+    twice.subscribe(topic="t")
+    assert ml.get_subscriber_list(topic="t") == [twice.uuid]
+    s.remove(twice)
+    assert not ml.directory and not ml.subscriptions and not ml._senders_of
+
+
+def test_add_many_and_subscribe_many():
+    s = Scheduler(real_time=False)
+    agents = s.add_many(TrialAgent() for _ in range(10))
+    assert all(agent.count_setups == 1 and agent.uuid in s.needs_update for agent in agents)
+
+    lazy = s.add_many([TrialAgent() for _ in range(10)], setup=False)
+    assert all(agent.count_setups == 0 for agent in lazy)
+    s.subscribe_many([(agent.uuid, None, None, "news") for agent in lazy] +
+                     [(x.uuid, y.uuid, None, None) for x, y in zip(lazy, lazy[1:])] +
+                     [(lazy[0].uuid, None, None, "news")])  # subscribing twice is idempotent.
+    one_by_one = MailingList()
+    for agent in lazy:
+        one_by_one.subscribe(agent.uuid, topic="news")
+    for x, y in zip(lazy, lazy[1:]):
+        one_by_one.subscribe(x.uuid, sender=y.uuid)
+    assert s.mailing_lists.directory == one_by_one.directory
+    assert s.mailing_lists.subscriptions == one_by_one.subscriptions
+    assert s.mailing_lists._senders_of == one_by_one._senders_of
+
+    s.remove(lazy[0])
+    s.run(iterations=1)
+    assert all(agent.count_setups == 1 for agent in lazy[1:]) and lazy[0].count_setups == 0
+    s.run(iterations=1)
+    assert lazy[1].count_setups == 1, "the setup is deferred to the first run only."
+
+    for bad in ([TrialAgent(), agents[0]], [lazy[1]] * 2):  # clashes with an agent, or within the batch.
+        try:
+            s.add_many(bad)
+            raise AssertionError("added an agent twice.")
+        except SchedulerException:
+            pass
+    assert len(s.agents) == 19
+    uuid = agents[0].uuid
+    for bad in [(-1, None, None, "news"), (uuid, None, None, None), (uuid, None, None, lazy[1].uuid)]:
+        try:
+            s.subscribe_many([bad])
+            raise AssertionError(f"accepted subscription {bad}")
+        except ValueError:
+            pass
+
+
+class Logbook(Agent):
+    """ records the time and the sender of its mail. """
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def update(self):
+        while self.messages:
+            msg = self.receive()
+            self.entries.append((self.time, msg.sender))
+
+
+def test_discrete_events():
+    s = Scheduler(real_time=False, discrete_events=True)
+    a, b = TrialAgent(), TrialAgent()
+    s.add(a)
+    s.add(b)
+    msgs = [TrialMessage(sender=a, receiver=r, topic=str(i)) for i, r in enumerate([a, b, a, b, a])]
+    for msg in msgs:
+        a.set_alarm(alarm_time=2, alarm_message=msg)
+    a.clear_alarms(receiver=b.uuid, topic='3')
+    s.clock._time = 2
+    s.clock.release_alarm_messages()
+    assert list(s.mail_queue) == [msgs[0], msgs[1], msgs[2], msgs[4]]  # in the order they were set.
+    assert len(s.clock.alarms) == 0 and a.list_alarms() == [] and b.list_alarms() == []
+
+    # a run: the clock jumps from event to event, and the events of a time are released together.
+    s = Scheduler(real_time=False, discrete_events=True)
+    log, x, y = Logbook(), Logbook(), Logbook()
+    for agent in (log, x, y):
+        s.add(agent)
+    log.subscribe(topic="tick")
+    for delay, agent in [(5, x), (1e6, log), (5, y), (5, x)]:
+        agent.set_alarm(delay, TrialMessage(sender=agent.uuid, receiver=agent.uuid, topic="tick"),
+                        ignore_alarm_if_idle=False)
+    s.run()
+    assert s.clock.time == 1e6 and s.iteration == 3
+    assert x.entries == [(5, x.uuid), (5, x.uuid)] and y.entries == [(5, y.uuid)]
+    assert log.entries == [(5, x.uuid), (5, y.uuid), (5, x.uuid), (1e6, log.uuid)], "(time, sequence) order."
+
+    try:
+        Scheduler(real_time=True, discrete_events=True)
+        raise AssertionError("a real-time clock can't run discrete events.")
+    except ValueError:
+        pass
+
+
+def test_cleared_required_alarm_ends_the_run():
+    for real_time in (True, False):
+        s = Scheduler(real_time=real_time)
+        a = TrialAgent()
+        s.add(a)
+        a.set_alarm(0.3, TrialMessage(a, a), ignore_alarm_if_idle=False)
+        if real_time:
+            s.clock.clear_alarms()
+        else:
+            s.remove(a)  # which clears the alarms of the agent.
+        timer = threading.Timer(5, s.pause)  # ends a run that waits forever.
+        timer.start()
+        start = time.time()
+        s.run()
+        timer.cancel()
+        assert time.time() - start < 2
+        assert real_time or s.clock.time == 0.3, "the run ends at the time of the required alarm."
+
+
+class Asker(Agent):
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    def update(self):
+        while self.messages:
+            self.answers.append(self.receive().sender)
+
+
+class BlockingLookup(Agent):
+    """ answers every question after a blocking wait for a (pretend) database. """
+    io_bound = True
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def update(self):
+        questions = self.receive_all()
+        time.sleep(self.delay)
+        self.send(AgentMessage(self, questions[0].sender, topic="answer"))
+        self.send_many([AgentMessage(self, msg.sender, topic="again") for msg in questions])
+
+
+def test_io_bound_updates_in_threads():
+    s = Scheduler(io_threads=10, stats=True)
+    asker = Asker()
+    s.add(asker)
+    lookups = [BlockingLookup(delay=0.2 - 0.02 * i) for i in range(10)]  # the last one finishes first.
+    for agent in lookups:
+        s.add(agent)
+        asker.send(AgentMessage(asker, agent, topic="question"))
+
+    start = time.perf_counter()
+    s.run(pause_if_idle=True)
+    end = time.perf_counter()
+    assert end - start < 1.0, "10 lookups of up to 0.2 seconds took as long as running them one by one."
+    expected = []
+    for agent in lookups:  # each agent's messages in the order sent, the agents in the order of update.
+        expected.extend([agent.uuid, agent.uuid])
+    assert asker.answers == expected
+    assert s.stats()["agents"][lookups[0].uuid]["update_time"] >= 0.2
+    assert all(agent._post == s.mail_queue.append for agent in lookups)
+
+    sequential = Scheduler()  # without io_threads the agents are updated in turn.
+    asker = Asker()
+    sequential.add(asker)
+    for agent in [BlockingLookup(delay=0.01) for _ in range(3)]:
+        sequential.add(agent)
+        asker.send(AgentMessage(asker, agent, topic="question"))
+    sequential.run(pause_if_idle=True)
+    assert len(asker.answers) == 6
+
+
+class Booker(Agent):
+    """ sets an alarm and subscribes to a topic after a blocking wait. """
+    io_bound = True
+
+    def __init__(self, delay, logbook):
+        super().__init__()
+        self.delay = delay
+        self.logbook = logbook
+
+    def update(self):
+        self.receive_all()
+        time.sleep(self.delay)
+        self.set_alarm(1, TrialMessage(self, self.logbook))
+        self.subscribe(topic="bookings")
+
+
+def test_io_bound_calls_are_made_in_the_order_of_updates():
+    for _ in range(3):
+        s = Scheduler(real_time=False, io_threads=8, discrete_events=True)
+        logbook = Logbook()
+        s.add(logbook)
+        bookers = [Booker(0.01 * (8 - i), logbook.uuid) for i in range(8)]  # the last one finishes first.
+        for agent in bookers:
+            s.add(agent)
+            logbook.send(TrialMessage(logbook, agent))
+        s.run(pause_if_idle=True)
+        expected = [agent.uuid for agent in bookers]
+        assert [sender for _, sender in logbook.entries] == expected
+        assert s.get_subscriber_list(topic="bookings") == expected
@@ -0,0 +1,31 @@
+import json
+import benchmark
+
+
+def test_compare():
+    baseline = {"results": {"a": {"rate": benchmark.metric(100.0, "msg/s"),
+                                  "seconds": benchmark.metric(2.0, "s", better="lower")}}}
+    results = {"results": {"a": {"rate": benchmark.metric(80.0, "msg/s"),
+                                 "seconds": benchmark.metric(2.4, "s", better="lower")},
+                           "b": {"rate": benchmark.metric(1.0, "msg/s")}}}
+    assert benchmark.compare(results, baseline, threshold=0.25) == []
+
+    results["results"]["a"]["rate"]["value"] = 70.0
+    results["results"]["a"]["seconds"]["value"] = 2.6
+    regressions = benchmark.compare(results, baseline, threshold=0.25)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a rate")
+    assert regressions[1].startswith("a seconds")
+
+
+def test_quick_run_and_baseline(tmp_path):
+    output = tmp_path / "results.json"
+    assert benchmark.main(["--quick", "routing", "memory", "--save-baseline", str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert results["quick"] is True
+    assert set(results["results"]) == {"routing", "memory"}
+
+    for m in results["results"]["routing"].values():
+        m["value"] *= 10  # a baseline that is 10x faster.
+    output.write_text(json.dumps(results))
+    assert benchmark.main(["--quick", "routing", "--baseline", str(output)]) == 1
@@ -0,0 +1,80 @@
+from maslite import Agent, Scheduler, SchedulerException, DiscreteEventClock
+from maslite.checkpoint import save, restore
+from tests.test_sharding import Gossip, Gossiper
+
+
+def test_checkpoint_and_restore(tmp_path):
+    path = tmp_path / "gossip.checkpoint"
+    peers = list(range(1, 25))
+    s = Scheduler(real_time=False)
+    for uuid in peers:
+        s.add(Gossiper(uuid, peers, rounds=8))
+    s.run(iterations=4, clear_alarms_at_end=False)
+    s.post(Gossip(1, 2, value=3))
+    assert save(s, path, chunk_size=5) == path.stat().st_size
+    assert not (tmp_path / "gossip.checkpoint.tmp").exists()
+
+    restored = restore(path, scheduler=Scheduler(real_time=False))
+    assert list(restored.agents) == list(s.agents)
+    assert all(agent._scheduler_api is restored for agent in restored.agents.values())
+    assert list(restored.needs_update) == list(s.needs_update)
+    assert restored.clock.time == s.clock.time
+    assert restored.clock.alarm_time == s.clock.alarm_time
+    assert restored.mailing_lists.directory == s.mailing_lists.directory
+    assert restored.get_subscriptions(4) == s.get_subscriptions(4)
+    assert [a.received for a in restored.agents.values()] == [a.received for a in s.agents.values()]
+
+    # both continue the same way.
+    s.run()
+    restored.run()
+    assert [(a.received, a.state) for a in restored.agents.values()] == [(a.received, a.state) for a in s.agents.values()]
+    assert restored.clock.time == s.clock.time
+
+
+def test_restore_errors(tmp_path):
+    path = tmp_path / "empty.checkpoint"
+    s = Scheduler(real_time=False)
+    agent = Agent(uuid=10 ** 6)
+    s.add(agent)
+    save(s, path)
+
+    busy = Scheduler(real_time=False)
+    busy.add(Agent())
+    for scheduler in (busy, Scheduler()):
+        try:
+            restore(path, scheduler=scheduler)
+            raise AssertionError("restored into a scheduler with agents or another clock.")
+        except SchedulerException:
+            pass
+
+    restored = restore(path)
+    assert isinstance(restored.agents[10 ** 6], Agent)
+    assert Agent().uuid > 10 ** 6, "new agents mustn't reuse a restored uuid."
+
+    bad = tmp_path / "bad.checkpoint"
+    bad.write_bytes(b"not a checkpoint")
+    try:
+        restore(bad)
+        raise AssertionError("restored a file that isn't a checkpoint.")
+    except SchedulerException:
+        pass
+
+
+def test_checkpoint_of_discrete_events(tmp_path):
+    path = tmp_path / "events.checkpoint"
+    s = Scheduler(real_time=False, discrete_events=True)
+    a, b = Agent(), Agent()
+    s.add(a)
+    s.add(b)
+    messages = [Gossip(a.uuid, receiver, value=i) for i, receiver in enumerate([a.uuid, b.uuid, a.uuid, b.uuid])]
+    messages.insert(2, Gossip(a.uuid, b.uuid, topic="cancelled"))
+    for msg in messages:
+        a.set_alarm(3, msg, ignore_alarm_if_idle=False)
+    b.clear_alarms(receiver=b.uuid, topic="cancelled")
+    save(s, path)
+
+    restored = restore(path)
+    assert isinstance(restored.clock, DiscreteEventClock)
+    restored.clock._time = 3
+    restored.clock.release_alarm_messages()
+    assert [(msg.receiver, msg.value) for msg in restored.mail_queue] == [(a.uuid, 0), (b.uuid, 1), (a.uuid, 2), (b.uuid, 3)]
@@ -0,0 +1,91 @@
+import threading
+
+from maslite import Scheduler, SchedulerException
+from maslite.maillog import MailLog, replay, records, ITERATION, DELIVERY, END
+from tests.test_sharding import Gossip, Gossiper
+
+PEERS = list(range(1, 25))
+
+
+def gossip_model(real_time=False):
+    s = Scheduler(real_time=real_time)
+    for uuid in PEERS:
+        s.add(Gossiper(uuid, PEERS, rounds=8))
+    return s
+
+
+def snapshot(s):
+    return [(a.received, a.state) for a in s.agents.values()]
+
+
+def test_replay_of_simulation(tmp_path):
+    path = tmp_path / "gossip.maillog"
+    s = gossip_model()
+    with MailLog(path) as log:
+        s.mail_log = log
+        s.run(iterations=5, clear_alarms_at_end=False)
+        s.post(Gossip(1, 2, value=3))
+        s.run()
+    kinds = [record[0] for record in records(path)]
+    assert kinds.count(DELIVERY) == kinds.count(END) == 2
+
+    replayed = gossip_model()
+    iterations = replay(replayed, path)
+    assert iterations == kinds.count(ITERATION)
+    assert snapshot(replayed) == snapshot(s)
+    assert replayed.clock.time == s.clock.time
+    assert replayed.mail_log is None
+    assert all(agent._clock is replayed.clock for agent in replayed.agents.values())
+
+    # a model that behaves differently is detected.
+    diverged = gossip_model()
+    diverged.agents[5].rounds = 2
+    try:
+        replay(diverged, path)
+        raise AssertionError("the replay didn't notice that the model diverged.")
+    except SchedulerException:
+        pass
+
+
+def test_recovery_of_real_time_run(tmp_path):
+    path = tmp_path / "real_time.maillog"
+    s = gossip_model(real_time=True)
+    s.mail_log = MailLog(path)
+
+    def feed():
+        for value in range(4):
+            s.post(Gossip(100, PEERS[value], value=value))
+
+    thread = threading.Thread(target=feed)
+    thread.start()
+    s.run(seconds=0.2, pause_if_idle=False)
+    thread.join()
+    s.mail_log.close()
+
+    # offline, with a simulation clock that follows the logged wall clock.
+    replayed = gossip_model(real_time=False)
+    replay(replayed, path)
+    assert snapshot(replayed) == snapshot(s)
+    assert sum(len(a.received) for a in replayed.agents.values()) > len(PEERS)
+
+
+def test_truncated_log(tmp_path):
+    path = tmp_path / "crashed.maillog"
+    s = gossip_model()
+    s.mail_log = MailLog(path)
+    s.run()
+    s.mail_log.close()
+
+    data = path.read_bytes()
+    path.write_bytes(data[:-30])  # the run crashed whilst the last record was written.
+    recovered = gossip_model()
+    assert replay(recovered, path) > 0
+    assert recovered.clock.time <= s.clock.time
+
+    bad = tmp_path / "bad.maillog"
+    bad.write_bytes(b"not a log")
+    try:
+        replay(gossip_model(), bad)
+        raise AssertionError("replayed a file that isn't a mail log.")
+    except SchedulerException:
+        pass
@@ -0,0 +1,159 @@
+import time
+
+from maslite import Agent, AgentMessage, Scheduler, SchedulerException
+from maslite.sharding import ShardedScheduler, RingBuffer
+from demos.auction_model import Seller, Buyer, seller_data, buyer_data
+
+
+class Gossip(AgentMessage):
+    def __init__(self, sender, receiver=None, topic=None, value=0, direct=False):
+        super().__init__(sender=sender, receiver=receiver, topic=topic, direct=direct)
+        self.value = value
+
+    def copy(self):
+        return Gossip(self.sender, self.receiver, self.topic, self.value, self.direct)
+
+
+class Gossiper(Agent):
+    """ an agent whose messages depend on everything it has received, in the order received. """
+    def __init__(self, uuid, peers, rounds):
+        super().__init__(uuid=uuid)
+        self.peers = peers
+        self.rounds = rounds
+        self.received = []
+        self.state = uuid
+
+    def setup(self):
+        self.subscribe(topic=f"news-{self.uuid % 3}")
+        if self.uuid % 4 == 0:
+            self.subscribe(sender=self.peers[self.uuid % len(self.peers)])
+        self.send(Gossip(self, self.peers[(self.uuid * 7) % len(self.peers)], value=self.uuid))
+
+    def update(self):
+        while self.messages:
+            msg = self.receive()
+            self.received.append((self.time, msg.sender, msg.receiver, msg.topic, msg.value))
+            self.state = (self.state * 31 + msg.value + len(self.received)) % 1000003
+            if msg.value >= self.rounds:
+                continue
+            peer = self.peers[self.state % len(self.peers)]
+            if self.state % 5 == 0:
+                self.send(Gossip(self, topic=f"news-{self.state % 3}", value=msg.value + 1))
+            elif self.state % 5 == 1:
+                self.set_alarm(self.state % 3 + 1, Gossip(self, peer, value=msg.value + 1))
+            elif self.state % 5 == 2:
+                self.send(Gossip(self, peer, value=msg.value + 1, direct=True))
+            else:
+                self.send(Gossip(self, peer, value=msg.value + 1))
+
+
+def gossip(scheduler, n=24, rounds=8):
+    peers = list(range(1, n + 1))
+    agents = [Gossiper(uuid, peers, rounds) for uuid in peers]
+    for agent in agents:
+        scheduler.add(agent)
+    scheduler.run()
+    return {agent.uuid: (agent.received, agent.state) for agent in agents}, scheduler.clock.time
+
+
+def test_ring_buffer():
+    ring = RingBuffer(capacity=8)
+    try:
+        reader = RingBuffer(ring.name, capacity=8, lock=ring.lock)
+        assert ring.write(b"abcdef") == 6
+        assert reader.read() == b"abcdef"
+        assert ring.write(b"0123456789") == 8  # wraps around.
+        assert ring.write(b"x") == 0  # full.
+        assert reader.read() == b"01234567"
+        assert reader.read() == b""
+        reader.close()
+        try:
+            RingBuffer(ring.name, capacity=8)
+            raise AssertionError("attached without the lock of the buffer.")
+        except ValueError:
+            pass
+    finally:
+        ring.close(unlink=True)
+
+
+def test_sharded_run_matches_single_process():
+    expected, end_time = gossip(Scheduler(real_time=False))
+    assert end_time > 0  # the alarms were used.
+    for shards in (2, 3):
+        results, sharded_end_time = gossip(ShardedScheduler(shards=shards, real_time=False))
+        assert sharded_end_time == end_time
+        assert results == expected
+    results, _ = gossip(ShardedScheduler(shards=3, real_time=False, ring_size=64))  # the shards wait for room.
+    assert results == expected
+
+
+def test_sharded_auction():
+    sellers = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    buyers = [100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110, 111, 112]
+
+    def contracts(scheduler):
+        for uuid in sellers:
+            scheduler.add(Seller(uuid, prices=seller_data[uuid]))
+        for uuid in buyers:
+            scheduler.add(Buyer(uuid, max_price=buyer_data[uuid]))
+        scheduler.run(pause_if_idle=True)
+        return {uuid: agent.in_contract_with() for uuid, agent in scheduler.agents.items()}
+
+    expected = contracts(Scheduler())
+    assert contracts(ShardedScheduler(shards=3)) == expected
+
+
+def test_sharded_state_survives_successive_runs():
+    s = ShardedScheduler(shards=2, real_time=False)
+    peers = [1, 2, 3, 4]
+    agents = [Gossiper(uuid, peers, rounds=50) for uuid in peers]
+    for agent in agents:
+        s.add(agent)
+    s.run(iterations=3, clear_alarms_at_end=False)
+    assert agents[0]._scheduler_api is s
+    assert s.get_subscriptions(4) == {None: {None: {"news-1": True}}, 1: {None: {None: True}}}
+
+    single = Scheduler(real_time=False)
+    copies = [Gossiper(uuid, peers, rounds=50) for uuid in peers]
+    for agent in copies:
+        single.add(agent)
+    single.run(iterations=3, clear_alarms_at_end=False)
+    assert [a.received for a in agents] == [a.received for a in copies]
+    assert list(s.needs_update) == list(single.needs_update)
+    assert s.clock.alarm_time == single.clock.alarm_time
+
+    s.run(iterations=5, clear_alarms_at_end=False)
+    single.run(iterations=5, clear_alarms_at_end=False)
+    assert [a.received for a in agents] == [a.received for a in copies]
+
+
+def test_sharded_run_ends_at_cleared_required_alarm():
+    for real_time in (True, False):
+        s = ShardedScheduler(shards=2, real_time=real_time)
+        for uuid in (1, 2):
+            agent = Gossiper(uuid, [1, 2], rounds=0)
+            s.add(agent)
+            agent.set_alarm(0.3, Gossip(agent, agent), ignore_alarm_if_idle=False)
+        s.clock.clear_alarms()
+        start = time.time()
+        s.run()
+        assert time.time() - start < 5
+        assert real_time or s.clock.time == 0.3
+
+
+class Faulty(Agent):
+    def update(self):
+        raise ValueError("bad agent")
+
+
+def test_sharded_error_is_raised():
+    s = ShardedScheduler(shards=2, real_time=False)
+    for _ in range(3):
+        agent = Faulty()
+        agent.keep_awake = True
+        s.add(agent)
+    try:
+        s.run(iterations=2)
+        raise AssertionError("the ValueError should have been raised.")
+    except SchedulerException as e:
+        assert "bad agent" in str(e)
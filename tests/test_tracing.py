@@ -0,0 +1,67 @@
+import json
+
+from maslite import Agent, AgentMessage, Scheduler
+from maslite.tracing import Tracer, ITERATION, UPDATE, DELIVERY, ALARMS, IDLE
+from tests.test_sharding import Gossiper
+
+PEERS = list(range(1, 13))
+
+
+class Sleeper(Agent):
+    def setup(self):
+        self.set_alarm(0.02, AgentMessage(self, self), ignore_alarm_if_idle=False)
+
+    def update(self):
+        while self.messages:
+            self.receive()
+
+
+def test_trace_of_run(tmp_path):
+    tracer = Tracer()
+    s = Scheduler(real_time=False, tracer=tracer, stats=True)
+    for uuid in PEERS:
+        s.add(Gossiper(uuid, PEERS, rounds=6))
+    s.run()
+
+    spans = tracer.spans()
+    kinds = {kind for kind, _, _, _ in spans}
+    assert kinds == {ITERATION, UPDATE, DELIVERY, ALARMS}
+    iterations = [(start, end, number) for kind, start, end, number in spans if kind == ITERATION]
+    assert [number for _, _, number in iterations] == list(range(1, len(iterations) + 1))
+    updates = [(start, end) for kind, start, end, _ in spans if kind == UPDATE]
+    assert len(updates) == sum(agent["updates"] for agent in s.stats()["agents"].values())
+    for start, end in updates:  # every update happens inside an iteration.
+        assert any(i_start <= start <= end <= i_end for i_start, i_end, _ in iterations)
+    delivered = sum(n for kind, _, _, n in spans if kind == DELIVERY)
+    assert delivered == sum(agent["messages_out"] for agent in s.stats()["agents"].values())
+
+    path = tmp_path / "run.trace.json"
+    tracer.export(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert len(events) == len(spans)
+    assert all(e["ph"] == "X" and e["ts"] >= 0 and e["dur"] >= 0 for e in events)
+    assert {e["name"] for e in events} >= {"iteration", "deliver mail", "release alarms", f"update {PEERS[0]}"}
+
+
+def test_ring_buffer_and_idle():
+    tracer = Tracer()
+    s = Scheduler(tracer=tracer)
+    s.add(Sleeper())
+    s.run()
+    spans = tracer.spans()
+    assert spans[-1][0] == ITERATION, "the last span is the iteration that contains the others."
+    assert sum(end - start for kind, start, end, _ in spans if kind == IDLE) > 0.01, "waited for the alarm."
+
+    s.tracer = small = Tracer(size=3)
+    s.add(Sleeper())
+    s.run()
+    assert len(small) == 3 and small.recorded == tracer.recorded, "the ring buffer keeps the last spans."
+    assert [kind for kind, _, _, _ in small.spans()] == [kind for kind, _, _, _ in spans[-3:]]
+
+    tracer.clear()
+    assert len(tracer) == 0 and tracer.spans() == []
+    try:
+        Tracer(size=0)
+        raise AssertionError("a tracer without room for spans.")
+    except ValueError:
+        pass